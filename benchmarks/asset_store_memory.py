@@ -0,0 +1,97 @@
+"""
+Compares the memory used by Snipe-IT hardware rows kept as a list of dicts (what the views
+hold per request) with the same rows kept in userCheckIO.asset_store.AssetStore.
+
+Usage (from the repository root):
+    python benchmarks/asset_store_memory.py [row_count ...]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from userCheckIO.asset_store import AssetStore  # noqa: E402
+
+CATEGORIES = ['Laptops', 'Desktops', 'Monitors', 'Phones', 'Tablets', 'Docking Stations', 'Headsets']
+STATUSES = ['Ready to Deploy', 'Deployed', 'Pending', 'Archived', 'Broken']
+DISPLAY_PATHS = ['name', 'serial', 'model.name', 'status_label.name']
+
+
+def fake_hardware_row(i):
+    """A row shaped like a /api/v1/hardware row, with the usual nested objects and custom fields."""
+    category = CATEGORIES[i % len(CATEGORIES)]
+    user_id = 1000 + i % 3000
+    return {
+        'id': i + 1,
+        'name': f'{category[:-1]} {i:06d}',
+        'asset_tag': f'TAG-{i:07d}',
+        'serial': f'SN{(i * 7919) % 10**9:09d}',
+        'model': {'id': i % 250, 'name': f'Model {i % 250}'},
+        'byod': False,
+        'model_number': f'MN-{i % 250}',
+        'eol': None,
+        'asset_eol_date': None,
+        'status_label': {'id': i % len(STATUSES), 'name': STATUSES[i % len(STATUSES)], 'status_type': 'deployable', 'status_meta': 'deployed'},
+        'category': {'id': i % len(CATEGORIES), 'name': category},
+        'manufacturer': {'id': i % 12, 'name': f'Manufacturer {i % 12}'},
+        'supplier': None,
+        'notes': '',
+        'order_number': None,
+        'company': {'id': 1, 'name': 'ACME'},
+        'location': {'id': i % 40, 'name': f'Building {i % 40}'},
+        'rtd_location': {'id': i % 40, 'name': f'Building {i % 40}'},
+        'image': None,
+        'qr': None,
+        'alt_barcode': None,
+        'assigned_to': {'id': user_id, 'username': f'user{user_id}', 'name': f'User {user_id}', 'first_name': 'User', 'last_name': str(user_id), 'employee_number': str(user_id), 'type': 'user'} if i % 3 else None,
+        'warranty_months': '36 months',
+        'warranty_expires': {'date': '2027-01-01', 'formatted': '2027-01-01'},
+        'created_at': {'datetime': '2024-01-01 10:00:00', 'formatted': '2024-01-01 10:00 AM'},
+        'updated_at': {'datetime': f'2024-06-{1 + i % 28:02d} 10:00:00', 'formatted': '2024-06-01 10:00 AM'},
+        'last_audit_date': None,
+        'next_audit_date': None,
+        'deleted_at': None,
+        'purchase_date': {'date': '2023-12-01', 'formatted': '2023-12-01'},
+        'age': '1 year',
+        'last_checkout': {'datetime': '2024-02-01 10:00:00', 'formatted': '2024-02-01 10:00 AM'},
+        'expected_checkin': None,
+        'purchase_cost': '1,299.00',
+        'checkin_counter': i % 5,
+        'checkout_counter': i % 7,
+        'requests_counter': 0,
+        'user_can_checkout': False,
+        'custom_fields': {
+            'MAC Address': {'field': '_snipeit_mac_address_1', 'value': f'00:11:22:{i % 256:02x}:{i // 256 % 256:02x}:00', 'field_format': 'MAC'},
+            'RAM': {'field': '_snipeit_ram_2', 'value': '16GB', 'field_format': 'ANY'},
+        },
+        'available_actions': {'checkout': True, 'checkin': True, 'clone': True, 'restore': False, 'update': True, 'delete': False},
+    }
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def main(row_counts):
+    print(f"{'rows':>8} {'dicts MB':>10} {'store MB':>10} {'ratio':>7} {'store build s':>14} {'reported MB':>12}")
+    for row_count in row_counts:
+        rows, dict_bytes, _ = measure(lambda: [fake_hardware_row(i) for i in range(row_count)])
+        store, store_bytes, build_seconds = measure(lambda: AssetStore.from_rows(rows, extra_paths=DISPLAY_PATHS))
+        reported = store.memory_usage()['total']
+        del rows
+        print(f"{row_count:>8} {dict_bytes / 2**20:>10.1f} {store_bytes / 2**20:>10.1f} "
+              f"{dict_bytes / max(store_bytes, 1):>6.1f}x {build_seconds:>14.2f} {reported / 2**20:>12.1f}")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
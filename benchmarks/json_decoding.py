@@ -0,0 +1,81 @@
+"""
+Compares the decode time and peak memory of a Snipe-IT /hardware page decoded:
+
+* with the stdlib json module (what response.json() does),
+* with orjson, when it is installed,
+* with userCheckIO.json_decoding.parse_page(), keeping only the fields of the featured list.
+
+Usage (from the repository root):
+    python benchmarks/json_decoding.py [row_count ...]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings  # noqa: E402
+
+from asset_store_memory import DISPLAY_PATHS, fake_hardware_row  # noqa: E402
+
+settings.configure(
+    SNIPEIT_JSON_DECODER='auto',
+    # The default display properties, read by featured_snapshot.row_fields()
+    NEW_ASSET_LIST_DISPLAY_PROPERTIES=[{'path': path} for path in DISPLAY_PATHS],
+    # Read when featured_snapshot is imported
+    INVENTORY_STATS={'flush_interval': None, 'fold_after': 20},
+)
+
+from userCheckIO import featured_snapshot, json_decoding  # noqa: E402
+
+# The fields the featured list refresh parses out of each row
+FEATURED_PATHS = featured_snapshot.row_fields()
+REPEATS = 5
+
+
+def strategies():
+    yield 'json (response.json)', json.loads
+    if json_decoding.orjson is not None:
+        yield 'orjson', json_decoding.orjson.loads
+    else:
+        print("orjson is not installed, skipped (pip install orjson).")
+
+    def selective(body):
+        chunks = (body[i:i + json_decoding.CHUNK_SIZE] for i in range(0, len(body), json_decoding.CHUNK_SIZE))
+        return json_decoding.parse_page(chunks, FEATURED_PATHS)
+    yield 'selective streaming', selective
+
+
+def measure(decode, body):
+    """(best time in seconds, peak memory in bytes) of decode(body); the body itself is not counted."""
+    best = None
+    for _ in range(REPEATS):
+        gc.collect()
+        start = time.perf_counter()
+        result = decode(body)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    result = decode(body)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+
+def main(row_counts):
+    print(f"{'rows':>8} {'body MB':>8} {'strategy':<22} {'decode ms':>10} {'peak MB':>9}")
+    for row_count in row_counts:
+        body = json.dumps({'total': row_count, 'rows': [fake_hardware_row(i) for i in range(row_count)]}).encode()
+        for name, decode in strategies():
+            seconds, peak = measure(decode, body)
+            print(f"{row_count:>8} {len(body) / 2**20:>8.1f} {name:<22} {seconds * 1000:>10.1f} {peak / 2**20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [200, 5000])
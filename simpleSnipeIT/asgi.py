@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'simpleSnipeIT.settings')
+# A server process: start the background jobs (see UsercheckioConfig.ready())
+os.environ.setdefault('SNIPEIT_BACKGROUND_JOBS', '1')
 
 application = get_asgi_application()
@@ -41,7 +41,7 @@ LANGUAGES = [
 DEBUG = env('DJANGO_DEBUG')
 
 #ALLOWED_HOSTS = ['localhost', '127.0.0.1']
-#ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS").split(" ")
+ALLOWED_HOSTS = env.list('DJANGO_ALLOWED_HOSTS', default=[])
 #CSRF_TRUSTED_ORIGINS = [""]
 
 # Application definition
@@ -57,6 +57,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'userCheckIO.structured_logging.CorrelationIdMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -65,6 +66,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'userCheckIO.deadline.DeadlineMiddleware',
+    'userCheckIO.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'simpleSnipeIT.urls'
@@ -73,13 +76,23 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Templates are compiled once per worker in production; in development they are
+            # read from disk on every render, so edits show up without a restart.
+            'loaders': [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ] if DEBUG else [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -93,7 +106,7 @@ WSGI_APPLICATION = 'simpleSnipeIT.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': env('DATABASE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
     }
 }
 
@@ -148,6 +161,25 @@ SNIPEIT_API_URL = env('SNIPEIT_API_URL')
 SNIPEIT_API_TOKEN = env('SNIPEIT_API_TOKEN')
 SNIPEIT_ADMIN_GROUP_ID = env('SNIPEIT_ADMIN_GROUP_ID', default=None)
 
+# Snipe-IT instances read by the employee lookup and the featured list (userCheckIO/backends.py).
+# The first one is the primary instance above, which also receives the checkouts and checkins.
+# Other regions can be added as a JSON list in SNIPEIT_EXTRA_BACKENDS, e.g.
+# [{"name": "emea", "url": "https://emea.example.com/api/v1/", "token": "...", "rate_limit": 10}]
+# max_connections: size of the backend's connection pool; rate_limit: requests per second (0: none).
+SNIPEIT_BACKENDS = [
+    {'name': env('SNIPEIT_API_NAME', default='default'), 'url': SNIPEIT_API_URL, 'token': SNIPEIT_API_TOKEN,
+     'max_connections': 10, 'rate_limit': 0},
+] + env.json('SNIPEIT_EXTRA_BACKENDS', default=[])
+# Threads querying the backends in parallel (shared by all the requests of a worker)
+SNIPEIT_FAN_OUT_WORKERS = 16
+# Calls to Snipe-IT in flight at once per worker, by priority class (userCheckIO/scheduler.py).
+# Interactive calls (request handling) have their own slots and go ahead of background work
+# (cache refreshes, warm-up, activity polling).
+SNIPEIT_SCHEDULER = {
+    'interactive': 16,
+    'background': 2,
+}
+
 # Custom settings for the new filtered asset list page
 # Defines which asset properties to display.
 # Uses dot notation for nested fields from the Snipe-IT API response.
@@ -161,3 +193,202 @@ NEW_ASSET_LIST_DISPLAY_PROPERTIES = [
     # {'label': 'Warranty', 'path': 'warranty_expires.formatted'},
     # {'label': 'Location', 'path': 'location.name'},
 ]
+
+# Number of hardware rows requested per page when building the featured asset list.
+FEATURED_ASSETS_PAGE_SIZE = 200
+
+# Streaming render of the asset tables (featured list and user assets).
+# When enabled, the page header and the table head are sent immediately and the rows follow
+# in chunks as Snipe-IT responses arrive. Can also be toggled per request with ?stream=1 / ?stream=0.
+ASSET_LIST_STREAMING = env.bool('ASSET_LIST_STREAMING', default=False)
+# Maximum number of rows rendered per streamed chunk.
+ASSET_LIST_STREAM_CHUNK_SIZE = 100
+
+# Local full-text search index (SQLite FTS5) used by the typeahead endpoint.
+# Rebuild it with `python manage.py rebuild_search_index`.
+SEARCH_INDEX_PATH = BASE_DIR / 'search_index.sqlite3'
+# Queries shorter than this return no result.
+SEARCH_MIN_QUERY_LENGTH = 2
+
+# Cache shared by all the workers of the host (SQLite in WAL mode, no Redis needed).
+# Used for the Snipe-IT data: categories, user directory, asset tag resolution, user asset lists.
+CACHES = {
+    'default': {
+        'BACKEND': 'userCheckIO.cache_backends.SQLiteCache',
+        'LOCATION': env('CACHE_PATH', default=str(BASE_DIR / 'cache.sqlite3')),
+        'TIMEOUT': 300,
+    }
+}
+
+# How long (in seconds) each kind of Snipe-IT data is considered fresh.
+SNIPEIT_CACHE_TIMEOUTS = {
+    'categories': 3600,
+    'users': 900,
+    'tags': 86400,
+    'user_assets': 60,
+    'featured_hardware': 300,
+    'featured_list': 300,
+    # Counts of the statistics dashboard, kept up to date by asset events: fully rebuilt once a day
+    'inventory_stats': 86400,
+}
+
+# Changes of the statistics counts (userCheckIO/inventory_stats.py): buffered per worker and
+# logged by a background thread every `flush_interval` seconds (None or 0 logs each one synchronously);
+# the log is folded into the counts every `fold_after` entries.
+INVENTORY_STATS = {
+    'flush_interval': 1.0,
+    'fold_after': 20,
+}
+
+# Seconds a rendered asset row or card is kept in the shared cache (see userCheckIO/row_cache.py).
+# Rows are keyed by asset id and updated_at, so this only bounds the size of the cache.
+ROW_FRAGMENT_CACHE_TIMEOUT = 86400
+
+# Sessions live in the shared cache and are persisted to the database by a background thread,
+# so serving a page does not take the SQLite write lock. Saving the same value twice is a no-op.
+SESSION_ENGINE = 'userCheckIO.session_backend'
+# Seconds between two database flushes of the modified sessions. None or 0 writes synchronously.
+SESSION_WRITE_BEHIND_INTERVAL = 2
+
+# Seconds a Snipe-IT API token check is reused by login_view and the readiness probe,
+# depending on its outcome.
+TOKEN_HEALTH_TTL = {
+    'valid': 60,
+    'invalid': 10,
+    'unreachable': 5,
+}
+# Extra seconds a successful check may be served while it is re-checked in the background.
+TOKEN_HEALTH_STALE_GRACE = 300
+
+# Start the background jobs (cache warm-up, featured list scheduler, activity poller, inventory
+# history) in this process. Set by the WSGI and ASGI entry points, so that management commands
+# do not start them; `runserver` starts them in the process serving requests.
+BACKGROUND_JOBS = env.bool('SNIPEIT_BACKGROUND_JOBS', default=False)
+
+# Load the on-disk snapshot of the cached Snipe-IT datasets when a worker starts, then refresh
+# them in a background thread. Can also be run with `python manage.py warm_cache`.
+CACHE_WARMUP_ON_STARTUP = env.bool('CACHE_WARMUP_ON_STARTUP', default=False)
+# Snapshot file of the cached datasets (categories, user directory, featured hardware).
+CACHE_SNAPSHOT_PATH = env('CACHE_SNAPSHOT_PATH', default=str(BASE_DIR / 'cache_snapshot.bin'))
+
+# Shared secret of the asset event webhook (/webhooks/snipeit/). Unset disables the endpoint.
+SNIPEIT_WEBHOOK_SECRET = env('SNIPEIT_WEBHOOK_SECRET', default=None)
+
+# Seconds between two polls of Snipe-IT's activity report, applied as deltas to the cached data
+# (checkouts, checkins, edits). 0 disables the background poller.
+ACTIVITY_POLL_INTERVAL = env.int('ACTIVITY_POLL_INTERVAL', default=0)
+# Pages of 100 entries read per poll; beyond that the cached featured hardware is fully refreshed.
+ACTIVITY_POLL_MAX_PAGES = 20
+
+# Batch asset report (/reports/batch/): Snipe-IT calls in flight at once, and employees per upload.
+BATCH_REPORT_CONCURRENCY = 8
+BATCH_REPORT_MAX_EMPLOYEES = 2000
+
+# Time budget (seconds) of each request for its calls to Snipe-IT, see userCheckIO/deadline.py.
+# optional_reserve: optional data (category filter) is skipped when less time than this is left.
+# min_call_timeout: below this, calls are not made at all and fail as timeouts.
+REQUEST_DEADLINE = {
+    'budget': 20,
+    'optional_reserve': 5,
+    'min_call_timeout': 0.5,
+}
+
+# Hedged GETs (userCheckIO/hedging.py): a GET to one of these endpoints still unanswered after the
+# endpoint's observed p95 latency is sent again, and the first response wins. Extra requests are
+# capped at max_extra_percent % of the requests.
+SNIPEIT_HEDGING = {
+    'enabled': env.bool('SNIPEIT_HEDGING', default=False),
+    'endpoints': ['hardware', 'users/{id}/assets'],
+    'max_extra_percent': 5,
+    # Responses observed (per endpoint and process) before hedging starts
+    'min_samples': 20,
+    # Never hedge before this many seconds
+    'min_delay': 0.05,
+    'max_workers': 32,
+}
+
+# Decoder of the Snipe-IT responses (userCheckIO/json_decoding.py): 'auto' uses orjson when it is
+# installed, 'json' always uses the stdlib json module.
+SNIPEIT_JSON_DECODER = env('SNIPEIT_JSON_DECODER', default='auto')
+
+# Rebuild the featured asset list snapshot every N seconds in a background thread of each worker
+# (one at a time). 0: only rebuilt when a view finds it older than SNIPEIT_CACHE_TIMEOUTS['featured_list'].
+FEATURED_SNAPSHOT_REFRESH_INTERVAL = env.int('FEATURED_SNAPSHOT_REFRESH_INTERVAL', default=0)
+
+# Daily inventory history (userCheckIO/inventory_history.py): the changes of the assignment, status
+# and category of every asset, appended once a day after `snapshot_hour` (local time) by a
+# background thread of each worker (one at a time); -1 disables the schedule.
+INVENTORY_HISTORY = {
+    'directory': env('INVENTORY_HISTORY_DIRECTORY', default=str(BASE_DIR / 'inventory_history')),
+    'snapshot_hour': env.int('INVENTORY_SNAPSHOT_HOUR', default=-1),
+}
+
+# Speculative prefetch of a user's asset page from the index form (userCheckIO/prefetch.py).
+# The form sends a hint once `min_length` characters were typed and typing paused for `debounce_ms`
+# (or the field lost focus); a number is prefetched at most once every `dedupe_seconds`, at most
+# `max_in_flight` at once per worker. A submit waits up to `wait` seconds for its running prefetch.
+PREFETCH = {
+    'enabled': env.bool('PREFETCH_ENABLED', default=True),
+    'min_length': env.int('PREFETCH_MIN_LENGTH', default=3),
+    'debounce_ms': 400,
+    'dedupe_seconds': 30,
+    'max_in_flight': 4,
+    'wait': 5,
+}
+
+# Local audit log of the checkouts and checkins (userCheckIO/audit_log.py, listed on /audit/).
+# Entries are buffered in memory and written by a background thread every `flush_interval` seconds
+# (None or 0 writes each one synchronously); at most `max_pending` entries wait per worker.
+AUDIT_LOG = {
+    'flush_interval': env.float('AUDIT_LOG_FLUSH_INTERVAL', default=2.0),
+    'max_pending': 10000,
+}
+
+# Request profiling (userCheckIO/profiling.py). sample_rate: share of the requests profiled (0 to 1);
+# admins can also profile a request with an `X-Profile: 1` header or `?profile=1`.
+# format: 'pstats' (cProfile dump) or 'collapsed' (stacks sampled every `interval` seconds).
+# The last `keep` profiles are kept in `directory` and listed on /profiles/.
+PROFILING = {
+    'sample_rate': env.float('PROFILING_SAMPLE_RATE', default=0.0),
+    'format': env('PROFILING_FORMAT', default='pstats'),
+    'interval': 0.005,
+    'directory': env('PROFILING_DIRECTORY', default=str(BASE_DIR / 'profiles')),
+    'keep': 100,
+}
+
+# Logging (userCheckIO/structured_logging.py). The app's records are queued and written as JSON lines
+# to stderr by a background thread; a message repeated more than `burst` times in `window` seconds
+# is sampled (one record in `sample_every` kept). Response bodies are truncated to
+# LOG_BODIES['max_length'] characters, and at most LOG_BODIES['per_minute'] are logged per process.
+LOG_BODIES = {
+    'max_length': 500,
+    'per_minute': 10,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'correlation_id': {'()': 'userCheckIO.structured_logging.CorrelationIdFilter'},
+        'storm_sampling': {
+            '()': 'userCheckIO.structured_logging.StormSampler',
+            'burst': 20,
+            'window': 10,
+            'sample_every': 50,
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'userCheckIO.structured_logging.BackgroundQueueHandler',
+            'max_size': 10000,
+            'filters': ['correlation_id', 'storm_sampling'],
+        },
+    },
+    'loggers': {
+        'userCheckIO': {
+            'handlers': ['queue'],
+            'level': env('LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
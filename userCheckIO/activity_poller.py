@@ -0,0 +1,145 @@
+"""
+Incremental updates of the cached Snipe-IT data from the activity log, as an alternative to the
+webhook endpoint.
+
+Snipe-IT records every checkout, checkin, edit and deletion in its activity report
+(/reports/activity). The poller reads the entries newer than a stored cursor (the id of the
+last entry applied) and turns them into the asset events of cache_events.py, so a poll is
+usually a single call, plus one /hardware/{id} call per changed asset. A full refresh of the
+cached hardware then only serves as a periodic consistency check (SNIPEIT_CACHE_TIMEOUTS).
+
+The cursor lives in the shared cache without expiry. When it is missing, or when more entries
+than ACTIVITY_POLL_MAX_PAGES pages arrived since the last poll, the poll cannot tell what changed:
+the cached featured hardware is marked stale and the cursor moves to the newest entry.
+
+The poller runs in a background thread of each worker when ACTIVITY_POLL_INTERVAL is set (a
+cache.add() lock lets one worker poll at a time), or with `python manage.py poll_activity`.
+"""
+import logging
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import cache_events, featured_snapshot, scheduler, snipeit_api
+
+logger = logging.getLogger(__name__)
+
+CURSOR_KEY = 'activity:cursor'
+POLL_LOCK_KEY = 'lock:activity_poll'
+POLL_LOCK_TIMEOUT = 300
+PAGE_SIZE = 100
+
+# Activity report action types -> asset event types (other actions do not change cached data)
+ACTION_EVENTS = {
+    'checkout': 'checkout',
+    'checkin from': 'checkin',
+    'update': 'update',
+    'delete': 'delete',
+}
+
+
+def get_cursor():
+    return cache.get(CURSOR_KEY)
+
+
+def set_cursor(activity_id):
+    cache.set(CURSOR_KEY, int(activity_id), timeout=None)
+
+
+def fetch_new_activity(cursor, max_pages=None, timeout=15):
+    """
+    Returns (entries, complete): the asset activity entries with an id greater than cursor,
+    oldest first. complete is False when max_pages pages were read without reaching the cursor
+    (entries then only holds the newest ones).
+    """
+    max_pages = max_pages or settings.ACTIVITY_POLL_MAX_PAGES
+    entries = []
+    for page in range(max_pages):
+        response = scheduler.call(
+            requests.get, f"{settings.SNIPEIT_API_URL}reports/activity", headers=snipeit_api.api_headers(),
+            params={'item_type': 'asset', 'sort': 'id', 'order': 'desc',
+                    'limit': PAGE_SIZE, 'offset': page * PAGE_SIZE},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        rows = response.json().get('rows', [])
+        for row in rows:
+            if cursor is not None and row['id'] <= cursor:
+                return entries[::-1], True
+            entries.append(row)
+        if len(rows) < PAGE_SIZE:
+            return entries[::-1], True
+    return entries[::-1], False
+
+
+def events_from_activity(entries):
+    """
+    Turns activity entries (oldest first) into asset events, one per asset: the users of every
+    entry are kept, the event type is the one of the last entry.
+    """
+    events = {}
+    for entry in entries:
+        event_type = ACTION_EVENTS.get(entry.get('action_type'))
+        item = entry.get('item') or {}
+        if event_type is None or item.get('type', 'asset') != 'asset' or not item.get('id'):
+            continue
+        target = entry.get('target') if (entry.get('target') or {}).get('type') == 'user' else None
+        event = cache_events.parse_event({
+            'event': event_type,
+            'asset': {'id': item['id']},
+            'assigned_to': target if event_type == 'checkout' else None,
+            'previous_assigned_to': target if event_type == 'checkin' else None,
+        })
+        previous = events.pop(event['asset_id'], None)
+        if previous is not None:
+            event['user_ids'] = sorted(set(previous['user_ids']) | set(event['user_ids']))
+        events[event['asset_id']] = event
+    return list(events.values())
+
+
+def poll_once():
+    """
+    Applies the activity entries newer than the cursor and moves the cursor.
+    Returns a summary dict, or None when another worker is polling.
+    Raises requests.exceptions.RequestException when the activity report cannot be read.
+    """
+    if not cache.add(POLL_LOCK_KEY, os.getpid(), timeout=POLL_LOCK_TIMEOUT):
+        return None
+    try:
+        cursor = get_cursor()
+        # Without a cursor, only the newest entry matters: it becomes the cursor
+        entries, complete = fetch_new_activity(cursor, max_pages=1 if cursor is None else None)
+        if cursor is None or not complete:
+            # Changes may have been missed: let the next view refresh the featured list
+            featured_snapshot.invalidate()
+            set_cursor(entries[-1]['id'] if entries else 0)
+            return {'entries': len(entries), 'applied': [], 'resynced': True}
+
+        applied = [cache_events.apply_event(event) for event in events_from_activity(entries)]
+        if entries:
+            set_cursor(entries[-1]['id'])
+        return {'entries': len(entries), 'applied': applied, 'resynced': False}
+    finally:
+        cache.delete(POLL_LOCK_KEY)
+
+
+@scheduler.background_job
+def run_forever(interval):
+    while True:
+        try:
+            poll_once()
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not read the Snipe-IT activity report: %s", e)
+        except Exception:
+            # Keep polling, the next poll may succeed
+            logger.exception("Activity poll failed.")
+        time.sleep(interval)
+
+
+def start_background_poller():
+    threading.Thread(target=run_forever, args=(settings.ACTIVITY_POLL_INTERVAL,),
+                     name='activity-poller', daemon=True).start()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import AssetCategoryConfiguration
+from .models import AssetCategoryConfiguration, AssignmentAudit
 
 @admin.register(AssetCategoryConfiguration)
 class AssetCategoryConfigurationAdmin(admin.ModelAdmin):
@@ -32,6 +32,19 @@ class AssetCategoryConfigurationAdmin(admin.ModelAdmin):
         AssetCategoryConfiguration.load()
         return qs.filter(pk=1)
 
+@admin.register(AssignmentAudit)
+class AssignmentAuditAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'action', 'asset_tag', 'user_id', 'operator_name', 'result', 'latency_ms')
+    list_filter = ('action', 'result')
+    search_fields = ('asset_tag', 'operator_employee_number', 'correlation_id')
+
+    def has_add_permission(self, request):
+        # Entries are only written by audit_log.py
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # Note: To ensure the admin interface shows the single configuration object
 # immediately after running migrations (even before it's accessed by the app),
 # you might consider adding a signal in apps.py or a management command
@@ -1,6 +1,44 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def serves_requests(argv=None):
+    """
+    True in a process serving requests: a worker loading the WSGI or ASGI application (see
+    settings.BACKGROUND_JOBS), or runserver's process restarted by the autoreloader (the only
+    one with --noreload). False for the other management commands and the autoreloader itself.
+    """
+    if settings.BACKGROUND_JOBS:
+        return True
+    argv = sys.argv if argv is None else argv
+    if len(argv) < 2 or argv[1] != 'runserver':
+        return False
+    return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
 
 
 class UsercheckioConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'userCheckIO'
+
+    def ready(self):
+        if not serves_requests():
+            return
+        # Restore the cached Snipe-IT datasets and refresh them in the background (see warmup.py)
+        if settings.CACHE_WARMUP_ON_STARTUP:
+            from . import warmup
+            warmup.start_background_warmup()
+        # Rebuild the featured asset list on a schedule (see featured_snapshot.py)
+        if settings.FEATURED_SNAPSHOT_REFRESH_INTERVAL:
+            from . import featured_snapshot
+            featured_snapshot.start_background_scheduler()
+        # Apply Snipe-IT's activity log to the cached data (see activity_poller.py)
+        if settings.ACTIVITY_POLL_INTERVAL:
+            from . import activity_poller
+            activity_poller.start_background_poller()
+        # Append the day's inventory changes to the history (see inventory_history.py)
+        if settings.INVENTORY_HISTORY['snapshot_hour'] >= 0:
+            from . import inventory_history
+            inventory_history.start_background_scheduler()
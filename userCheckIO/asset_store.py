@@ -0,0 +1,365 @@
+"""
+Compact columnar in-memory store for Snipe-IT hardware rows.
+
+A hardware row returned by the API is a large nested dict (dozens of keys, nested dicts for
+model, category, status, location, custom fields...). AssetStore only keeps the fields this
+app displays, one column per field:
+
+* integer ids are stored in `array` columns (8 bytes per row),
+* per-asset strings (tag, name, serial, updated_at) are packed as UTF-8 in one bytearray
+  per column, with start/length arrays,
+* low-cardinality strings (category, status, model, assignee names...) are interned in a
+  pool and each row only stores a small integer code.
+
+Rows are materialized back as small nested dicts on access, with the same shape as the API
+data (asset['model']['name'], ...), so they can be used with get_nested_value(), FacetIndex
+and the templates. The store is a read-only sequence of these dicts: the cached rows of the
+featured list are kept as an AssetStore (see snipeit_cache.cache_featured_hardware()), and a
+FacetIndex over it only materializes the rows a filtered view shows.
+
+Asset ids are only unique within a Snipe-IT instance: rows are identified by their id and their
+'origin' (see backends.tag()).
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from copy import deepcopy
+
+from .utils import get_nested_value
+from . import snipeit_api
+
+NONE_CODE = -1
+
+
+class PackedStrings:
+    """Column of strings packed as UTF-8 in a single bytearray. None is stored as length -1."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.starts = array('Q')
+        self.lengths = array('i')
+
+    def append(self, value):
+        self.starts.append(len(self.data))
+        if value is None:
+            self.lengths.append(-1)
+            return
+        encoded = str(value).encode('utf-8')
+        self.data += encoded
+        self.lengths.append(len(encoded))
+
+    def set(self, row, value):
+        # The previous bytes are left in place; they are dropped on the next rebuild of the store.
+        self.starts[row] = len(self.data)
+        if value is None:
+            self.lengths[row] = -1
+            return
+        encoded = str(value).encode('utf-8')
+        self.data += encoded
+        self.lengths[row] = len(encoded)
+
+    def get(self, row):
+        length = self.lengths[row]
+        if length < 0:
+            return None
+        start = self.starts[row]
+        return self.data[start:start + length].decode('utf-8')
+
+    def memory_usage(self):
+        return sys.getsizeof(self.data) + sys.getsizeof(self.starts) + sys.getsizeof(self.lengths)
+
+
+class PooledStrings:
+    """Column of low-cardinality strings: each distinct value is stored once, rows hold its code."""
+
+    def __init__(self):
+        self.values = []
+        self.codes_by_value = {}
+        self.codes = array('i')
+
+    def code_for(self, value):
+        if value is None:
+            return NONE_CODE
+        value = sys.intern(str(value))
+        code = self.codes_by_value.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.codes_by_value[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(self.code_for(value))
+
+    def set(self, row, value):
+        self.codes[row] = self.code_for(value)
+
+    def get(self, row):
+        code = self.codes[row]
+        return None if code == NONE_CODE else self.values[code]
+
+    def memory_usage(self):
+        strings = sum(sys.getsizeof(value) for value in self.values)
+        return (sys.getsizeof(self.codes) + sys.getsizeof(self.values)
+                + sys.getsizeof(self.codes_by_value) + strings)
+
+
+class IntColumn:
+    """Column of optional integers. None is stored as -1 (Snipe-IT ids are positive)."""
+
+    def __init__(self):
+        self.values = array('q')
+
+    def append(self, value):
+        self.values.append(NONE_CODE if value is None else int(value))
+
+    def set(self, row, value):
+        self.values[row] = NONE_CODE if value is None else int(value)
+
+    def get(self, row):
+        value = self.values[row]
+        return None if value == NONE_CODE else value
+
+    def memory_usage(self):
+        return sys.getsizeof(self.values)
+
+
+# (column name, path in the API row, column type)
+BASE_COLUMNS = [
+    ('id', 'id', IntColumn),
+    ('asset_tag', 'asset_tag', PackedStrings),
+    ('name', 'name', PackedStrings),
+    ('serial', 'serial', PackedStrings),
+    ('updated_at', 'updated_at.datetime', PackedStrings),
+    ('category_id', 'category.id', IntColumn),
+    ('category_name', 'category.name', PooledStrings),
+    ('status_id', 'status_label.id', IntColumn),
+    ('status_name', 'status_label.name', PooledStrings),
+    ('model_id', 'model.id', IntColumn),
+    ('model_name', 'model.name', PooledStrings),
+    ('assigned_to_id', 'assigned_to.id', IntColumn),
+    ('assigned_to_name', 'assigned_to.name', PooledStrings),
+    ('assigned_to_type', 'assigned_to.type', PooledStrings),
+    ('assigned_to_employee_number', 'assigned_to.employee_number', PooledStrings),
+    ('origin', 'origin', PooledStrings),
+]
+BASE_PATHS = {path for _name, path, _column_type in BASE_COLUMNS}
+
+
+def _path_getter(path):
+    """
+    Returns a function reading `path` from an API row. Plain dict paths get a fast getter,
+    paths with list indices (e.g. "items.0.name") fall back to get_nested_value().
+    """
+    keys = path.split('.')
+    if any(key.isdigit() for key in keys):
+        return lambda asset: get_nested_value(asset, path)
+    if len(keys) == 1:
+        return lambda asset: asset.get(path)
+
+    def getter(asset):
+        value = asset
+        for key in keys:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return getter
+
+
+class AssetStore(Sequence):
+    def __init__(self, extra_paths=()):
+        """
+        Args:
+            extra_paths (iterable): Additional dot-separated paths to keep for each asset
+                                    (e.g. the paths of NEW_ASSET_LIST_DISPLAY_PROPERTIES).
+                                    They are stored as pooled strings.
+        """
+        self.columns = {name: column_type() for name, _path, column_type in BASE_COLUMNS}
+        self.paths = {name: path for name, path, _column_type in BASE_COLUMNS}
+        self.extra_paths = [path for path in dict.fromkeys(extra_paths) if path not in BASE_PATHS]
+        for path in self.extra_paths:
+            self.columns[path] = PooledStrings()
+            self.paths[path] = path
+        self._getters = self._make_getters()
+        self._size = 0
+        self._id_order = None
+        self._tag_order = None
+
+    def _make_getters(self):
+        return {name: _path_getter(path) for name, path in self.paths.items()}
+
+    def __getstate__(self):
+        # The getters are closures: rebuilt from the paths when the store is unpickled
+        return {key: value for key, value in self.__dict__.items() if key != '_getters'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._getters = self._make_getters()
+
+    def copy(self):
+        """An independent copy, to patch a store other threads may be reading."""
+        return deepcopy(self)
+
+    @classmethod
+    def from_rows(cls, rows, extra_paths=()):
+        store = cls(extra_paths=extra_paths)
+        store.extend(rows)
+        return store
+
+    @classmethod
+    def from_snipeit(cls, params=None, extra_paths=(), page_size=500):
+        """
+        Builds a store from the paginated /hardware endpoint. Only one page of raw JSON is
+        alive at any time; each row is reduced to its columns as soon as it arrives.
+        """
+        store = cls(extra_paths=extra_paths)
+        store.extend(snipeit_api.iter_rows('hardware', params=params, page_size=page_size))
+        return store
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self.row(index) for index in range(*row.indices(self._size))]
+        if row < 0:
+            row += self._size
+        if not 0 <= row < self._size:
+            raise IndexError('AssetStore index out of range')
+        return self.row(row)
+
+    def append(self, asset):
+        """Adds a single raw API row. Prefer extend() to load many rows."""
+        self.extend([asset])
+
+    def extend(self, assets):
+        """
+        Adds raw API rows. Rows without an id are ignored; a row whose id and origin are already
+        stored replaces the stored one.
+        """
+        existing_order = self._ensure_id_order() if self._size else None
+        appenders = [(self.columns[name].append, getter) for name, getter in self._getters.items()]
+        added = {}  # (id, origin) -> row, for the rows added by this call
+        for asset in assets:
+            asset_id = asset.get('id')
+            if asset_id is None:
+                continue
+            row = added.get((asset_id, asset.get('origin')))
+            if row is None and existing_order is not None:
+                row = self._find_id(existing_order, asset_id, asset.get('origin'))
+            if row is not None:
+                self.update(row, asset)
+                continue
+            added[(asset_id, asset.get('origin'))] = self._size
+            for append, getter in appenders:
+                append(getter(asset))
+            self._size += 1
+        if added:
+            self._id_order = None
+            self._tag_order = None
+
+    def update(self, row, asset):
+        """Overwrites the stored fields of `row` with a fresh raw API row (e.g. after a checkout)."""
+        for name, getter in self._getters.items():
+            self.columns[name].set(row, getter(asset))
+        self._tag_order = None
+
+    def set_assignment(self, row, assigned_to):
+        """Updates only the assignee of `row`. `assigned_to` is an API 'assigned_to' dict or None."""
+        assigned_to = assigned_to if isinstance(assigned_to, dict) else {}
+        self.columns['assigned_to_id'].set(row, assigned_to.get('id'))
+        self.columns['assigned_to_name'].set(row, assigned_to.get('name'))
+        self.columns['assigned_to_type'].set(row, assigned_to.get('type'))
+        self.columns['assigned_to_employee_number'].set(row, assigned_to.get('employee_number'))
+
+    def _sorted_rows(self, key):
+        return sorted(range(self._size), key=key)
+
+    def _ensure_id_order(self):
+        if self._id_order is None:
+            self._id_order = array('i', self._sorted_rows(self.columns['id'].values.__getitem__))
+        return self._id_order
+
+    def _find_id(self, id_order, asset_id, origin=None):
+        ids = self.columns['id'].values
+        origins = self.columns['origin']
+        position = bisect_left(id_order, asset_id, key=ids.__getitem__)
+        while position < len(id_order) and ids[id_order[position]] == asset_id:
+            if origins.get(id_order[position]) == origin:
+                return id_order[position]
+            position += 1
+        return None
+
+    def row_for_id(self, asset_id, origin=None):
+        """
+        Returns the row number of an asset id (of this origin, see backends.tag()), or None.
+        Uses a sorted permutation and bisect.
+        """
+        return self._find_id(self._ensure_id_order(), asset_id, origin)
+
+    def row_for_tag(self, asset_tag):
+        """Returns the row number of an asset tag (case-insensitive), or None."""
+        tags = self.columns['asset_tag']
+        tag_key = lambda row: (tags.get(row) or '').casefold()
+        if self._tag_order is None:
+            self._tag_order = array('i', self._sorted_rows(tag_key))
+        wanted = asset_tag.casefold()
+        position = bisect_left(self._tag_order, wanted, key=tag_key)
+        if position < len(self._tag_order) and tag_key(self._tag_order[position]) == wanted:
+            return self._tag_order[position]
+        return None
+
+    def row(self, row):
+        """Materializes a row as a small nested dict shaped like the Snipe-IT API data."""
+        get = lambda name: self.columns[name].get(row)
+        assigned_to_id = get('assigned_to_id')
+        asset = {
+            'id': get('id'),
+            'asset_tag': get('asset_tag'),
+            'name': get('name'),
+            'serial': get('serial'),
+            'updated_at': {'datetime': get('updated_at')},
+            'category': {'id': get('category_id'), 'name': get('category_name')},
+            'status_label': {'id': get('status_id'), 'name': get('status_name')},
+            'model': {'id': get('model_id'), 'name': get('model_name')},
+            'assigned_to': None if assigned_to_id is None else {
+                'id': assigned_to_id,
+                'name': get('assigned_to_name'),
+                'type': get('assigned_to_type'),
+                'employee_number': get('assigned_to_employee_number'),
+            },
+        }
+        if get('origin') is not None:
+            asset['origin'] = get('origin')
+        for path in self.extra_paths:
+            target = asset
+            *parents, leaf = path.split('.')
+            for key in parents:
+                if not isinstance(target.get(key), dict):
+                    target[key] = {}
+                target = target[key]
+            target[leaf] = get(path)
+        return asset
+
+    def get_by_id(self, asset_id, origin=None):
+        row = self.row_for_id(asset_id, origin)
+        return None if row is None else self.row(row)
+
+    def get_by_tag(self, asset_tag):
+        row = self.row_for_tag(asset_tag)
+        return None if row is None else self.row(row)
+
+    def __iter__(self):
+        for row in range(self._size):
+            yield self.row(row)
+
+    def memory_usage(self):
+        """
+        Returns the approximate number of bytes held by the store, per column and in total:
+        {'total': int, 'columns': {name: int}}.
+        """
+        columns = {name: column.memory_usage() for name, column in self.columns.items()}
+        indexes = sum(sys.getsizeof(order) for order in (self._id_order, self._tag_order) if order is not None)
+        return {'total': sum(columns.values()) + indexes, 'columns': columns}
@@ -0,0 +1,218 @@
+"""
+Local audit log of the checkouts and checkins made with this app.
+
+Snipe-IT only keeps the `note` sent with each checkout and checkin. Every attempt is recorded in
+the AssignmentAudit table instead: the operator (the admin employee of the session), the asset
+tag and id, the user, the latency of the Snipe-IT call, its result and the request's correlation
+id (see structured_logging.py).
+
+A scan must not wait for an SQLite commit: the entries are only appended to an in-memory buffer
+of the worker, written with one bulk_create by a background thread every
+AUDIT_LOG['flush_interval'] seconds (and when the worker exits). When the database cannot keep
+up, at most AUDIT_LOG['max_pending'] entries are kept and the newer ones are dropped and counted.
+Setting flush_interval to None (or 0) writes each entry synchronously.
+
+Usage in a view:
+
+    with audit_log.recording(request, audit_log.CHECKOUT, asset_tag, asset_id, user_id) as audit:
+        audit.response = scheduler.call(requests.post, ...)
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.utils import timezone
+
+from . import json_decoding, structured_logging
+
+logger = logging.getLogger(__name__)
+
+CHECKOUT = 'checkout'
+CHECKIN = 'checkin'
+# Rows per INSERT statement of a flush
+BATCH_SIZE = 500
+
+
+class AuditBuffer:
+    """Audit entries (AssignmentAudit instances, not saved yet) waiting to be written, oldest first."""
+
+    def __init__(self, interval, max_pending=10000, start_thread=True):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.start_thread = start_thread
+        self.dropped = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork: start one per worker process.
+        # Without a positive interval the buffer is only flushed explicitly.
+        if not self.start_thread or self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        self._thread = threading.Thread(target=self._run, name='audit-log-flush', daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def append(self, entry):
+        """Queues an entry; False when the buffer is full and the entry was dropped."""
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append(entry)
+            self._ensure_thread()
+            return True
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self, model):
+        """Writes all pending entries to the database. Returns the number of entries written."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(pending, batch_size=BATCH_SIZE)
+        except DatabaseError:
+            logger.exception("Could not write %d audit entries, they will be retried.", len(pending))
+            with self._lock:
+                # Keep the order, and the bound: the oldest entries go first
+                self._pending = (pending + self._pending)[:self.max_pending]
+            return 0
+        if self.dropped:
+            logger.warning("%d audit entries were dropped, the audit buffer was full.", self.dropped)
+            self.dropped = 0
+        return len(pending)
+
+    def _run(self):
+        from .models import AssignmentAudit
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            self.flush(AssignmentAudit)
+
+
+def _synchronous():
+    interval = settings.AUDIT_LOG['flush_interval']
+    return interval is None or interval <= 0
+
+
+def _flush_at_exit():
+    from .models import AssignmentAudit
+    audit_buffer.flush(AssignmentAudit)
+
+
+audit_buffer = AuditBuffer(settings.AUDIT_LOG['flush_interval'] or 0, settings.AUDIT_LOG['max_pending'])
+atexit.register(_flush_at_exit)
+
+
+class Recording:
+    """What a view tells about the Snipe-IT call of an audit entry, see recording()."""
+
+    def __init__(self):
+        self.response = None
+
+
+def outcome(response):
+    """(result, status_code, message) of a checkout or checkin response of Snipe-IT."""
+    if response.status_code != 200:
+        return 'failed', response.status_code, structured_logging.truncate(response.text, 200)
+    try:
+        data = json_decoding.decode(response)
+    except (TypeError, ValueError):
+        return 'failed', response.status_code, "Invalid JSON response"
+    if isinstance(data, dict) and data.get('status') == 'success':
+        return 'success', response.status_code, ''
+    messages = data.get('messages', '') if isinstance(data, dict) else ''
+    return 'failed', response.status_code, str(messages)
+
+
+def record(request, action, latency, result, asset_tag='', asset_id=None, user_id=None, status_code=None, message=''):
+    """Queues an audit entry (or writes it, when AUDIT_LOG['flush_interval'] is None or 0)."""
+    from .models import AssignmentAudit
+    operator = request.session.get('admin_granting_employee_info') or {}
+    entry = AssignmentAudit(
+        created_at=timezone.now(),
+        action=action,
+        operator_name=operator.get('name') or '',
+        operator_employee_number=operator.get('employee_number') or '',
+        asset_tag=asset_tag or '',
+        asset_id=asset_id,
+        user_id=user_id,
+        latency_ms=round(latency * 1000),
+        result=result,
+        status_code=status_code,
+        message=message[:255],
+        correlation_id=structured_logging.correlation_id(),
+    )
+    if _synchronous():
+        entry.save()
+    else:
+        audit_buffer.append(entry)
+    return entry
+
+
+@contextmanager
+def recording(request, action, asset_tag='', asset_id=None, user_id=None):
+    """
+    Records the Snipe-IT call made in the block, timed from the block's start: its outcome is
+    read from the response set on the yielded Recording; an exception (a network error) is
+    recorded as 'error' and raised again.
+    """
+    audit = Recording()
+    started = time.monotonic()
+    try:
+        yield audit
+    except Exception as e:
+        record(request, action, time.monotonic() - started, 'error', asset_tag, asset_id, user_id, message=str(e))
+        raise
+    latency = time.monotonic() - started
+    if audit.response is None:
+        return
+    result, status_code, message = outcome(audit.response)
+    record(request, action, latency, result, asset_tag, asset_id, user_id, status_code, message)
+
+
+# Filters of the audit page: query parameter -> lookup
+FILTERS = {
+    'asset_tag': 'asset_tag',
+    'user': 'user_id',
+    'operator': 'operator_employee_number',
+    'action': 'action',
+    'result': 'result',
+}
+
+
+def query(params, since=None, until=None, before=None, limit=50):
+    """
+    The newest entries matching the FILTERS of `params` and the period [since, until) (aware
+    datetimes), older than the entry id `before`. Returns (entries, id to pass as `before` for
+    the next page, or None). Paged by id so that every page is an index range scan.
+    """
+    from .models import AssignmentAudit
+    entries = AssignmentAudit.objects.all()
+    for param, lookup in FILTERS.items():
+        value = params.get(param, '').strip()
+        if value:
+            entries = entries.filter(**{lookup: value})
+    if since is not None:
+        entries = entries.filter(created_at__gte=since)
+    if until is not None:
+        entries = entries.filter(created_at__lt=until)
+    if before is not None:
+        entries = entries.filter(id__lt=before)
+    entries = list(entries.order_by('-id')[:limit + 1])
+    if len(entries) > limit:
+        return entries[:limit], entries[limit - 1].id
+    return entries, None
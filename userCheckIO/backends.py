@@ -0,0 +1,152 @@
+"""
+Federated Snipe-IT instances (one per region).
+
+SNIPEIT_BACKENDS lists the instances this app reads from; the first one is the primary instance,
+the one of SNIPEIT_API_URL, which also receives every write (checkouts, checkins). Each backend
+has its own connection pool (a requests Session mounted with max_connections connections) and its
+own rate limit (rate_limit requests per second, 0 for none), so a slow or throttled region does
+not starve the others.
+
+Lookups that fan out (employee lookup in views.get_user_by_employee_number, the featured list in
+featured_snapshot.py) run on every backend in parallel with fan_out(). When several backends are
+configured, the rows they return are tagged with the name of their backend in an 'origin' key;
+with a single backend the rows are left as Snipe-IT sent them.
+"""
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import hedging
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per second (with bursts of `rate` requests)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = float(rate)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request may be sent."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Backend:
+
+    def __init__(self, name, url, token, max_connections=10, rate_limit=0):
+        self.name = name
+        self.url = url
+        self.token = token
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.limiter = RateLimiter(rate_limit)
+
+    def __repr__(self):
+        return f'<Backend {self.name}>'
+
+    def headers(self):
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Accept": "application/json",
+        }
+
+    def get(self, path, **kwargs):
+        """GET `path` (relative to the backend's API url), through the pool and the rate limit."""
+        self.limiter.acquire()
+        return hedging.get(f"{self.url}{path}", session=self.session, headers=self.headers(), **kwargs)
+
+
+_backends = None
+_backends_config = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_backends():
+    """The configured backends, the primary one first."""
+    global _backends, _backends_config, _executor
+    with _lock:
+        if _backends_config != settings.SNIPEIT_BACKENDS:
+            _backends = [Backend(**config) for config in settings.SNIPEIT_BACKENDS]
+            _backends_config = settings.SNIPEIT_BACKENDS
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.SNIPEIT_FAN_OUT_WORKERS,
+                                           thread_name_prefix='snipeit-fan-out')
+        return _backends
+
+
+def primary():
+    return get_backends()[0]
+
+
+def get_backend(name):
+    """The backend called `name`; the primary backend when name is None."""
+    if name is None:
+        return primary()
+    for backend in get_backends():
+        if backend.name == name:
+            return backend
+    raise KeyError(f"Unknown Snipe-IT backend: {name!r}.")
+
+
+def is_federated():
+    return len(get_backends()) > 1
+
+
+def is_primary(row):
+    """True for rows read from the primary backend (the only one written to)."""
+    return row.get('origin', primary().name) == primary().name
+
+
+def tag(rows, backend):
+    """Tags rows with their backend when several backends are configured. Returns the rows."""
+    if is_federated():
+        for row in rows:
+            row['origin'] = backend.name
+    return rows
+
+
+def fan_out(function):
+    """
+    Calls function(backend) for every backend in parallel and yields (backend, result, error)
+    tuples as they complete; error is the exception raised, if any. Stopping the iteration
+    cancels the calls that have not started. A single backend is called in the current thread.
+    """
+    backends = get_backends()
+    if len(backends) == 1:
+        try:
+            yield backends[0], function(backends[0]), None
+        except Exception as e:
+            yield backends[0], None, e
+        return
+
+    # Each call runs in a copy of the caller's context, so the request deadline still applies
+    futures = {_executor.submit(contextvars.copy_context().run, function, backend): backend
+               for backend in backends}
+    try:
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+    finally:
+        for future in futures:
+            future.cancel()
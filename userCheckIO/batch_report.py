@@ -0,0 +1,162 @@
+"""
+Asset report for a batch of employees (audits), from an uploaded list of employee numbers.
+
+Looking employees up one by one with user_asset_view costs a user search, an asset call and a
+categories call each. For a batch:
+
+* employee numbers are deduplicated (case-insensitively) before any lookup,
+* users are resolved from the cached user directory; when many are missing, the directory is
+  reloaded once (a few paged calls) instead of searching every employee, and the remaining
+  misses are searched concurrently,
+* asset lists are fetched with at most BATCH_REPORT_CONCURRENCY calls in flight, through the
+  shared per-user cache, and each employee's rows are yielded as soon as they and all the
+  previous employees are ready, so the report can be streamed in upload order.
+"""
+import csv
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+
+from . import search_index, snipeit_cache
+
+logger = logging.getLogger(__name__)
+
+# Header names accepted for the employee number column (otherwise the first column is used)
+EMPLOYEE_NUMBER_COLUMNS = ('employee_number', 'employee_num', 'employee', 'employee number')
+# Above this many directory misses, reloading the whole directory is cheaper than searching each
+DIRECTORY_RELOAD_THRESHOLD = 20
+
+REPORT_COLUMNS = ['employee_number', 'status', 'user_id', 'user_name',
+                  'asset_tag', 'asset_name', 'category', 'model', 'serial']
+
+
+class BatchInputError(ValueError):
+    pass
+
+
+def read_employee_numbers(uploaded_file, max_count=None):
+    """
+    Returns the distinct employee numbers of an uploaded CSV (or plain list) file, in order.
+    Raises BatchInputError when the file cannot be read or holds too many employees.
+    """
+    max_count = max_count or settings.BATCH_REPORT_MAX_EMPLOYEES
+    try:
+        text = uploaded_file.read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise BatchInputError("The file must be UTF-8 encoded text (CSV).")
+
+    rows = [row for row in csv.reader(io.StringIO(text)) if row and any(cell.strip() for cell in row)]
+    column = 0
+    if rows:
+        header = [cell.strip().casefold() for cell in rows[0]]
+        matching = [i for i, name in enumerate(header) if name in EMPLOYEE_NUMBER_COLUMNS]
+        if matching:
+            column = matching[0]
+            rows = rows[1:]
+
+    employee_numbers = []
+    seen = set()
+    for row in rows:
+        employee_number = row[column].strip() if column < len(row) else ''
+        if employee_number and employee_number.casefold() not in seen:
+            seen.add(employee_number.casefold())
+            employee_numbers.append(employee_number)
+    if len(employee_numbers) > max_count:
+        raise BatchInputError(f"The file lists {len(employee_numbers)} employees, the maximum is {max_count}.")
+    return employee_numbers
+
+
+def resolve_users(employee_numbers, lookup):
+    """
+    Returns {employee_number: user or None}. lookup(employee_number) is the single-user search
+    (views.get_user_by_employee_number), only called for the numbers missing from the directory.
+    """
+    users = {employee_number: snipeit_cache.get_cached_user(employee_number) for employee_number in employee_numbers}
+    missing = [employee_number for employee_number, user in users.items() if user is None]
+
+    if len(missing) > DIRECTORY_RELOAD_THRESHOLD:
+        try:
+            snipeit_cache.refresh_user_directory()
+            search_index.update_from_cached_datasets()
+        except requests.exceptions.RequestException as e:
+            logger.warning("RequestException while reloading the user directory: %s", e)
+        for employee_number in missing:
+            users[employee_number] = snipeit_cache.get_cached_user(employee_number)
+        missing = [employee_number for employee_number in missing if users[employee_number] is None]
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=settings.BATCH_REPORT_CONCURRENCY) as executor:
+            for employee_number, user in zip(missing, executor.map(lookup, missing)):
+                users[employee_number] = user
+    return users
+
+
+def _fetch_assets(user):
+    try:
+        return snipeit_cache.get_user_assets(user['id'], origin=user.get('origin')), None
+    except requests.exceptions.RequestException as e:
+        return [], str(e)
+
+
+def iter_employee_assets(employee_numbers, lookup):
+    """
+    Yields (employee_number, user, assets, error) for each employee, in the given order.
+    user is None when the employee was not found; error is the message of a failed asset fetch.
+    """
+    users = resolve_users(employee_numbers, lookup)
+    executor = ThreadPoolExecutor(max_workers=settings.BATCH_REPORT_CONCURRENCY)
+    try:
+        futures = [
+            (employee_number, users[employee_number],
+             executor.submit(_fetch_assets, users[employee_number]) if users[employee_number] else None)
+            for employee_number in employee_numbers
+        ]
+        for employee_number, user, future in futures:
+            if future is None:
+                yield employee_number, None, [], None
+            else:
+                assets, error = future.result()
+                yield employee_number, user, assets, error
+    finally:
+        # The client may stop reading the report: drop the fetches not started yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def report_rows(employee_number, user, assets, error):
+    """Flattens one employee's result into report rows (dicts keyed by REPORT_COLUMNS)."""
+    if user is None:
+        return [{'employee_number': employee_number, 'status': 'not found'}]
+    base = {
+        'employee_number': employee_number,
+        'status': f'error: {error}' if error else 'ok',
+        'user_id': user.get('id'),
+        'user_name': user.get('name'),
+    }
+    if not assets:
+        return [base]
+    return [{
+        **base,
+        'asset_tag': asset.get('asset_tag'),
+        'asset_name': asset.get('name'),
+        'category': (asset.get('category') or {}).get('name'),
+        'model': (asset.get('model') or {}).get('name'),
+        'serial': asset.get('serial'),
+    } for asset in assets]
+
+
+class _Echo:
+    # csv.writer only needs write(); returning the line lets it be yielded right away
+    def write(self, value):
+        return value
+
+
+def iter_csv(results):
+    """Yields the CSV report line by line from iter_employee_assets() results."""
+    writer = csv.DictWriter(_Echo(), fieldnames=REPORT_COLUMNS, restval='')
+    yield writer.writerow(dict(zip(REPORT_COLUMNS, REPORT_COLUMNS)))
+    for result in results:
+        for row in report_rows(*result):
+            yield writer.writerow(row)
@@ -0,0 +1,170 @@
+"""
+Django cache backend storing entries in a local SQLite database in WAL mode.
+
+Every gunicorn worker on the host opens the same file, so a value cached (or refreshed) by one
+worker is immediately visible to all of them, without running Redis or memcached. WAL mode
+lets readers proceed while a writer commits, and the database pages are memory-mapped
+(PRAGMA mmap_size), so reads are served from the OS page cache shared by all processes.
+
+Configure it in settings.CACHES:
+    'BACKEND': 'userCheckIO.cache_backends.SQLiteCache',
+    'LOCATION': BASE_DIR / 'cache.sqlite3',
+"""
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires);
+"""
+
+# Probability that a write also purges the expired entries.
+_PURGE_PROBABILITY = 0.01
+
+
+class SQLiteCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = str(location)
+        options = params.get('OPTIONS', {})
+        self.mmap_size = int(options.get('MMAP_SIZE', 256 * 1024 * 1024))
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread, and a new one after a fork (gunicorn --preload).
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # The journal mode is stored in the file: only switch a new file to WAL. Switching
+            # needs an exclusive lock, which fails at once while other connections use the file.
+            if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+                conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA mmap_size={self.mmap_size}')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _maybe_purge(self, conn):
+        if random.random() < _PURGE_PROBABILITY:
+            conn.execute('DELETE FROM cache_entries WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Stores the value only if the key is missing or expired. Atomic across processes."""
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        cursor = conn.execute(
+            'INSERT INTO cache_entries (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+            'WHERE cache_entries.expires IS NOT NULL AND cache_entries.expires <= ?',
+            (key, self._dumps(value), self.get_backend_timeout(timeout), time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT value, expires FROM cache_entries WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return default
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not key_map:
+            return {}
+        placeholders = ', '.join('?' * len(key_map))
+        now = time.time()
+        rows = self._connection().execute(
+            f'SELECT key, value, expires FROM cache_entries WHERE key IN ({placeholders})', list(key_map)
+        ).fetchall()
+        return {
+            key_map[key]: pickle.loads(value)
+            for key, value, expires in rows
+            if expires is None or expires > now
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)',
+            (key, self._dumps(value), self.get_backend_timeout(timeout)),
+        )
+        self._maybe_purge(conn)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        rows = [(self.make_and_validate_key(key, version=version), self._dumps(value), expires)
+                for key, value in data.items()]
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR REPLACE INTO cache_entries (key, value, expires) VALUES (?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._maybe_purge(conn)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute(
+            'UPDATE cache_entries SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        """Atomically increments an integer value. Raises ValueError if the key does not exist."""
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value, expires FROM cache_entries WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                raise ValueError(f"Key '{key}' not found")
+            new_value = pickle.loads(row[0]) + delta
+            conn.execute('UPDATE cache_entries SET value = ? WHERE key = ?', (self._dumps(new_value), key))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return new_value
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._connection().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        keys = [(self.make_and_validate_key(key, version=version),) for key in keys]
+        self._connection().executemany('DELETE FROM cache_entries WHERE key = ?', keys)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        row = self._connection().execute(
+            'SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)', (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entries')
@@ -0,0 +1,170 @@
+"""
+Incremental updates of the cached Snipe-IT data from asset events: checkouts, checkins, edits
+and deletions.
+
+Instead of expiring the cached data quickly, the entries affected by a change are updated as
+soon as Snipe-IT reports it (webhook endpoint, see views.snipeit_webhook_view):
+
+* the asset tag resolution entry is re-pointed (or dropped when the tag changed or the asset
+  was deleted),
+* the cached asset lists of the previous and of the new assignee are dropped,
+* the asset row of the featured hardware dataset is replaced, added or removed, and the
+  featured list snapshot re-rendered from it (see featured_snapshot.py),
+* the asset is indexed again, or removed, in the local search index (see search_index.py).
+
+An event is a dict:
+    {
+        "event": "checkout" | "checkin" | "update" | "delete",
+        "asset": {"id": 12, "asset_tag": "LAP-0012", ...},    # the full hardware row is optional
+        "previous_asset_tag": "LAP-12",                        # optional, when the tag was edited
+        "assigned_to": {"id": 7},                              # optional, new assignee
+        "previous_assigned_to": {"id": 5},                     # optional, previous assignee
+    }
+When the event does not carry the full hardware row (no 'category' key), the row is fetched
+from /hardware/{id}, which is one call instead of a full refresh.
+"""
+import logging
+
+import requests
+from django.conf import settings
+
+from . import backends, deadline, featured_snapshot, hedging, inventory_stats, search_index, snipeit_api, snipeit_cache
+from .asset_store import AssetStore
+from .utils import get_nested_value
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ('checkout', 'checkin', 'update', 'delete')
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+def _user_id(assignee):
+    # Assets can also be checked out to locations or other assets; only users have asset lists
+    if isinstance(assignee, dict) and assignee.get('type', 'user') == 'user' and assignee.get('id'):
+        return int(assignee['id'])
+    return None
+
+
+def parse_event(data):
+    """Validates a raw event and returns it normalized. Raises InvalidEvent."""
+    if not isinstance(data, dict):
+        raise InvalidEvent("An event must be a JSON object.")
+    event_type = data.get('event')
+    if event_type not in EVENT_TYPES:
+        raise InvalidEvent(f"Unknown event type: {event_type!r}.")
+    asset = data.get('asset')
+    if not isinstance(asset, dict):
+        raise InvalidEvent("The event has no 'asset' object.")
+    try:
+        asset_id = int(asset.get('id'))
+    except (TypeError, ValueError):
+        raise InvalidEvent("The event asset has no valid 'id'.")
+
+    user_ids = {_user_id(data.get('assigned_to')), _user_id(data.get('previous_assigned_to'))}
+    return {
+        'event': event_type,
+        'asset_id': asset_id,
+        'asset_tag': asset.get('asset_tag'),
+        'previous_asset_tag': data.get('previous_asset_tag'),
+        'user_ids': sorted(user_id for user_id in user_ids if user_id is not None),
+        # Only trusted as the current hardware row when it is complete
+        'asset': asset if 'category' in asset else None,
+    }
+
+
+def fetch_asset(asset_id, timeout=10):
+    """Returns the hardware row of an asset, or None if it does not exist (anymore)."""
+    response = hedging.get(f"{settings.SNIPEIT_API_URL}hardware/{int(asset_id)}",
+                            headers=snipeit_api.api_headers(), timeout=deadline.timeout(timeout))
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = response.json()
+    # Snipe-IT answers 200 with {"status": "error"} for unknown ids
+    if data.get('status') == 'error':
+        return None
+    return data
+
+
+def _patch_featured_rows(asset_id, asset_row):
+    """Returns the update function for the featured hardware dataset (see update_dataset())."""
+
+    def update(payload):
+        store = payload.get('store')
+        if store is None:
+            # Rows cached by a previous release, as a list: replaced by the next refresh
+            return None
+        # Events come from the primary Snipe-IT instance, see backends.py
+        origin = backends.primary().name if backends.is_federated() else None
+        position = store.row_for_id(asset_id, origin)
+        if asset_row is not None:
+            backends.tag([asset_row], backends.primary())
+        featured = (asset_row is not None
+                    and get_nested_value(asset_row, 'category.id') in payload['category_ids'])
+        # The stored rows are shared with the readers of this version: patch a copy
+        if featured:
+            new_store = store.copy()
+            new_store.extend([asset_row])
+        elif position is not None:
+            new_store = AssetStore.from_rows((store[row] for row in range(len(store)) if row != position), extra_paths=store.extra_paths)
+        else:
+            return None
+        return {**payload, 'store': new_store}
+
+    return update
+
+
+def apply_event(event):
+    """
+    Updates the cached entries affected by a normalized event (see parse_event()).
+    Returns a summary of what was done. If the hardware row cannot be fetched, the affected
+    entries are dropped instead of patched; this never raises for Snipe-IT errors.
+    """
+    asset_id = event['asset_id']
+    summary = {'asset_id': asset_id, 'event': event['event']}
+
+    asset_row = event['asset']
+    if event['event'] == 'delete':
+        asset_row = None
+    elif asset_row is None:
+        try:
+            asset_row = fetch_asset(asset_id)
+        except requests.exceptions.RequestException as e:
+            logger.warning("Could not fetch asset %s for a cache update, dropping its cached entries: %s", asset_id, e)
+            for asset_tag in (event['asset_tag'], event['previous_asset_tag']):
+                if asset_tag:
+                    snipeit_cache.invalidate_asset_tag(asset_tag)
+            for user_id in event['user_ids']:
+                snipeit_cache.invalidate_user_assets(user_id)
+            featured_snapshot.invalidate()
+            summary['result'] = 'invalidated'
+            return summary
+
+    # Tag resolution
+    current_tag = asset_row.get('asset_tag') if asset_row else None
+    for asset_tag in {event['asset_tag'], event['previous_asset_tag']}:
+        if asset_tag and asset_tag != current_tag:
+            snipeit_cache.invalidate_asset_tag(asset_tag)
+    if current_tag:
+        snipeit_cache.cache_asset_id_for_tag(current_tag, asset_id)
+    summary['search_updated'] = search_index.apply_asset(asset_id, asset_row)
+
+    # Asset lists of the previous and of the current assignee
+    user_ids = set(event['user_ids'])
+    if asset_row and _user_id(asset_row.get('assigned_to')):
+        user_ids.add(_user_id(asset_row['assigned_to']))
+    for user_id in user_ids:
+        snipeit_cache.invalidate_user_assets(user_id)
+    summary['users'] = sorted(user_ids)
+
+    summary['featured_patched'] = snipeit_cache.update_dataset(
+        'featured_hardware', _patch_featured_rows(asset_id, asset_row))
+    if summary['featured_patched']:
+        # Re-render the featured list from the patched rows, without calling Snipe-IT
+        featured_snapshot.rebuild_from_cached_hardware()
+    summary['stats_updated'] = inventory_stats.apply_asset(asset_id, asset_row)
+    summary['result'] = 'patched'
+    return summary
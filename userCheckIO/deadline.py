@@ -0,0 +1,82 @@
+"""
+Per-request deadline budget for the calls made to Snipe-IT.
+
+Each call used to have its own hard-coded timeout, so a page making several calls could block
+for the sum of them. DeadlineMiddleware gives every request a budget of
+REQUEST_DEADLINE['budget'] seconds, and every outbound call takes its timeout from timeout(cap):
+the call's usual timeout, shortened to what is left of the budget. Once less than
+REQUEST_DEADLINE['min_call_timeout'] is left, timeout() raises DeadlineExceeded instead of
+calling Snipe-IT. It is a requests Timeout, so the views report it like any failed call and
+render the page with what they already have.
+
+Optional data (e.g. the categories of the filter dropdown) is only fetched while
+has_time_for_optional() is true, i.e. while more than REQUEST_DEADLINE['optional_reserve']
+seconds are left.
+
+The budget is held in a context variable: code running outside the request (background
+threads, management commands, streamed response bodies) has no deadline and uses the caps.
+"""
+import contextvars
+import time
+
+import requests
+from django.conf import settings
+
+_current = contextvars.ContextVar('snipeit_deadline', default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    pass
+
+
+class Deadline:
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def has_time_for(self, seconds):
+        return self.remaining() >= seconds
+
+
+def current():
+    """Returns the Deadline of the request being handled, or None."""
+    return _current.get()
+
+
+def timeout(cap):
+    """
+    Returns the timeout for an outbound call: cap seconds, shortened to the time left in the
+    current request's budget. Raises DeadlineExceeded when the budget is (almost) spent.
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return cap
+    remaining = deadline.remaining()
+    if remaining < settings.REQUEST_DEADLINE['min_call_timeout']:
+        raise DeadlineExceeded(f"Request deadline of {deadline.budget}s exceeded, Snipe-IT was not called.")
+    return min(cap, remaining)
+
+
+def has_time_for_optional():
+    """True while optional data may still be fetched for the current request."""
+    deadline = _current.get()
+    return deadline is None or deadline.has_time_for(settings.REQUEST_DEADLINE['optional_reserve'])
+
+
+class DeadlineMiddleware:
+    """Starts the deadline budget of each request (also available as request.deadline)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.deadline = Deadline(settings.REQUEST_DEADLINE['budget'])
+        token = _current.set(request.deadline)
+        try:
+            return self.get_response(request)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,300 @@
+"""
+Materialized snapshot of the featured asset list.
+
+filtered_asset_list_view used to fetch the hardware of every featured category from Snipe-IT on
+each view. The list is now built in the background and stored in the shared cache as the
+'featured_list' dataset (see snipeit_cache.py):
+
+    {
+        'category_ids': [3, 4],        # the featured categories the list was built for
+        'rows_html': '<tr>...</tr>',   # pre-rendered table rows (see render_rows())
+        'asset_count': 120,
+        'facets': [...],               # facet counts without any selection (see facets.py)
+        'errors': [...],               # messages of the categories that could not be fetched
+        'refreshed_at': 1718000000.0,  # when the content was last brought up to date
+    }
+
+The hardware rows are kept in the 'featured_hardware' dataset, for the facet filters and for
+incremental updates, as a columnar AssetStore (see asset_store.py): each worker holds one compact
+copy of it instead of the rows' dicts. Each worker builds the FacetIndex of the rows once per
+version of that dataset (get_facet_index()), so a filtered view only combines the precomputed
+bitmaps and materializes the rows it shows; only the row_fields() of each row are decoded from
+Snipe-IT's pages (see json_decoding.parse_page()). With several Snipe-IT backends (see backends.py), the hardware of every
+instance is fetched in parallel and merged, each row tagged with its 'origin'; the featured
+categories are expected to have the same ids on every instance. The snapshot is rebuilt:
+
+* when it is older than SNIPEIT_CACHE_TIMEOUTS['featured_list'] (the view starts a background
+  refresh and keeps serving the current snapshot meanwhile),
+* when AssetCategoryConfiguration is saved,
+* by the cache warm-up, by `python manage.py refresh_featured_list`, and every
+  FEATURED_SNAPSHOT_REFRESH_INTERVAL seconds when the background scheduler is enabled,
+* from the cached hardware rows, without calling Snipe-IT, when a webhook or the activity poller
+  patched them (see cache_events.py).
+
+A failed refresh keeps the previous rows, with the errors attached, and is retried RETRY_AFTER
+seconds later.
+"""
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import backends, inventory_stats, json_decoding, row_cache, scheduler, search_index, snipeit_cache, structured_logging
+from .facets import FacetIndex
+from .utils import get_nested_value
+
+logger = logging.getLogger(__name__)
+
+DATASET = 'featured_list'
+LOCK_KEY = f'lock:dataset:{DATASET}'
+# Seconds before a failed refresh is retried (by the next view)
+RETRY_AFTER = 30
+
+_facet_index = None  # (featured_hardware version, FacetIndex) of this process
+_facet_index_lock = threading.Lock()
+
+# Fields of the hardware rows kept for the featured list: the rows themselves, the facets, the
+# row cache, the asset events and the search index; the NEW_ASSET_LIST_DISPLAY_PROPERTIES paths
+# are added to them.
+ROW_FIELDS = ['id', 'name', 'asset_tag', 'serial', 'updated_at', 'assigned_to', 'category', 'status_label', 'model']
+
+
+def row_fields():
+    return ROW_FIELDS + [prop_config['path'] for prop_config in settings.NEW_ASSET_LIST_DISPLAY_PROPERTIES]
+
+
+def project_featured_asset(asset_data, display_properties_config):
+    """
+    Reduces a raw Snipe-IT hardware row to the dictionary used by the featured asset list rows.
+    """
+    processed_asset = {'id': asset_data.get('id'), 'raw': asset_data} # Store raw for potential future use in template
+
+    assigned_to_info = asset_data.get('assigned_to')
+    if assigned_to_info and isinstance(assigned_to_info, dict):
+        processed_asset['assigned_to_name'] = assigned_to_info.get('name')
+        processed_asset['assigned_to_type'] = assigned_to_info.get('type')
+    else:
+        processed_asset['assigned_to_name'] = None
+        processed_asset['assigned_to_type'] = None
+
+    processed_asset['category_name'] = get_nested_value(asset_data, 'category.name')
+
+    processed_asset['properties'] = []
+    for prop_config in display_properties_config:
+        value = get_nested_value(asset_data, prop_config['path'])
+        processed_asset['properties'].append({
+            'label': prop_config['label'],
+            'value': value if value is not None else ''
+        })
+    return processed_asset
+
+
+def iter_featured_asset_pages(featured_category_ids, backend):
+    """
+    Fetches the hardware of each featured category page by page from a Snipe-IT backend.
+    Yields (category_id, rows, error_message) tuples as each page arrives; error_message is None
+    on success. Pages are requested until the 'total' reported by Snipe-IT is reached.
+    """
+    page_size = settings.FEATURED_ASSETS_PAGE_SIZE
+    fields = row_fields()
+    # Name the instance in the error messages when there are several
+    source = f" ({backend.name})" if backends.is_federated() else ""
+    for category_id in featured_category_ids:
+        offset = 0
+        while True:
+            # Ensure category_id is an integer for the API call
+            assets_path = f"hardware?category_id={int(category_id)}&limit={page_size}&offset={offset}&sort=name&order=asc"
+            try:
+                response = backend.get(assets_path, timeout=15)
+            except requests.exceptions.RequestException as e:
+                yield category_id, [], f"Error connecting to Snipe-IT API{source} for category ID {category_id}: {e}"
+                break
+            if response.status_code != 200:
+                yield category_id, [], f"Failed to fetch assets for category ID {category_id}{source}. Snipe-IT API status: {response.status_code} - {structured_logging.truncate(response.text)}"
+                break
+
+            # Only the fields used by the list are decoded from each row
+            rows, data = json_decoding.parse_response_page(response, fields)
+            rows = backends.tag(rows, backend)
+            yield category_id, rows, None
+            offset += len(rows)
+            if not rows or offset >= (data.get('total') or 0):
+                break
+
+
+def _fetch_backend_hardware(category_ids, backend):
+    rows = []
+    errors = []
+    seen_asset_ids = set()
+    for category_id, page_rows, error_message in iter_featured_asset_pages(category_ids, backend):
+        if error_message:
+            errors.append(error_message)
+        for asset_data in page_rows:
+            # An asset could be in several featured categories (though Snipe-IT assigns one)
+            asset_id = asset_data.get('id')
+            if asset_id and asset_id not in seen_asset_ids:
+                seen_asset_ids.add(asset_id)
+                rows.append(asset_data)
+    return rows, errors
+
+
+def fetch_featured_hardware(category_ids):
+    """
+    Returns (rows, errors): the hardware of the categories on every Snipe-IT backend, fetched in
+    parallel and deduplicated by asset id within each backend. The rows of the primary backend
+    come first, then those of the other backends in configuration order.
+    """
+    results = {}
+    for backend, result, error in backends.fan_out(lambda backend: _fetch_backend_hardware(category_ids, backend)):
+        if error is not None:
+            raise error
+        results[backend.name] = result
+    rows = []
+    errors = []
+    for backend in backends.get_backends():
+        backend_rows, backend_errors = results[backend.name]
+        rows.extend(backend_rows)
+        errors.extend(backend_errors)
+    return rows, errors
+
+
+def render_rows(raw_rows):
+    """The table rows of these raw hardware rows; only the changed assets are rendered (see row_cache.py)."""
+    display_properties_config = settings.NEW_ASSET_LIST_DISPLAY_PROPERTIES
+    return row_cache.render_rows(
+        'partials/featured_asset_row.html', raw_rows,
+        variant=repr(display_properties_config),
+        row_of=lambda asset_data: project_featured_asset(asset_data, display_properties_config))
+
+
+def build_snapshot(category_ids, raw_rows, errors=(), facet_index=None):
+    return {
+        'category_ids': list(category_ids),
+        'rows_html': render_rows(raw_rows),
+        'asset_count': len(raw_rows),
+        'facets': (facet_index or FacetIndex(raw_rows)).facet_counts({}),
+        'errors': list(errors),
+        'refreshed_at': time.time(),
+    }
+
+
+def _configured_category_ids():
+    from .models import AssetCategoryConfiguration
+
+    return [int(category_id) for category_id in AssetCategoryConfiguration.load().allowed_category_ids]
+
+
+def get_snapshot(category_ids):
+    """
+    Returns (snapshot, is_stale) for these featured categories, or (None, True) when no snapshot
+    was built for them yet. Never calls Snipe-IT.
+    """
+    payload, pointer = snipeit_cache.get_dataset(DATASET)
+    if payload is None or payload['category_ids'] != [int(category_id) for category_id in category_ids]:
+        return None, True
+    return payload, time.time() - pointer['refreshed_at'] >= settings.SNIPEIT_CACHE_TIMEOUTS[DATASET]
+
+
+def get_facet_index(category_ids):
+    """
+    The FacetIndex of the cached raw hardware rows of the featured categories (any age), or None.
+    Built once per version of the rows in each worker. Never calls Snipe-IT.
+    """
+    global _facet_index
+    payload, pointer = snipeit_cache.get_dataset('featured_hardware')
+    if payload is None or payload['category_ids'] != [int(category_id) for category_id in category_ids]:
+        return None
+    if 'store' not in payload:
+        # Rows cached by a previous release, as a list: replaced by the next refresh
+        return None
+    with _facet_index_lock:
+        # Concurrent views wait for the index being built rather than building it again
+        if _facet_index is None or _facet_index[0] != pointer['version']:
+            _facet_index = (pointer['version'], FacetIndex(payload['store']))
+        return _facet_index[1]
+
+
+def _refresh_holding_lock():
+    try:
+        category_ids = _configured_category_ids()
+        previous, _ = get_snapshot(category_ids)
+        raw_rows, errors = fetch_featured_hardware(category_ids)
+        if not errors:
+            snipeit_cache.cache_featured_hardware(category_ids, raw_rows)
+            search_index.update_from_cached_datasets()
+            # Assets changed since the last refresh are counted again on the dashboard
+            inventory_stats.apply_rows(raw_rows)
+            snapshot = build_snapshot(category_ids, raw_rows, facet_index=get_facet_index(category_ids))
+            snipeit_cache.publish_dataset(DATASET, snapshot)
+            return snapshot
+        for error_message in errors:
+            logger.warning("Featured list refresh: %s", error_message)
+        # Keep serving the previous rows if there are any, and make the snapshot stale
+        # RETRY_AFTER seconds from now so that the refresh is retried
+        snapshot = {**previous, 'errors': errors} if previous is not None else build_snapshot(category_ids, raw_rows, errors)
+        retry_at = time.time() - settings.SNIPEIT_CACHE_TIMEOUTS[DATASET] + RETRY_AFTER
+        snipeit_cache.publish_dataset(DATASET, snapshot, refreshed_at=retry_at)
+        return snapshot
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def refresh(max_age=0):
+    """
+    Rebuilds the snapshot from Snipe-IT if it is older than max_age seconds (or was built for
+    other categories). Returns the current snapshot; returns without waiting when another
+    worker is already refreshing it.
+    """
+    snapshot, _ = get_snapshot(_configured_category_ids())
+    pointer = snipeit_cache.get_dataset_pointer(DATASET)
+    if snapshot is not None and time.time() - pointer['refreshed_at'] < max_age:
+        return snapshot
+    if not cache.add(LOCK_KEY, True, timeout=snipeit_cache.REFRESH_LOCK_TIMEOUT):
+        return snapshot
+    return _refresh_holding_lock()
+
+
+def refresh_in_background():
+    """Starts a refresh in a background thread, unless one is already running."""
+    if cache.add(LOCK_KEY, True, timeout=snipeit_cache.REFRESH_LOCK_TIMEOUT):
+        threading.Thread(target=scheduler.background_job(_refresh_holding_lock), name='featured-list-refresh', daemon=True).start()
+
+
+def rebuild_from_cached_hardware():
+    """
+    Re-renders the snapshot from the cached raw hardware rows, after they were patched by an
+    asset event. Does not call Snipe-IT. Returns True when the snapshot was updated.
+    """
+    def update(snapshot):
+        facet_index = get_facet_index(snapshot['category_ids'])
+        if facet_index is None:
+            return None
+        return {**build_snapshot(snapshot['category_ids'], facet_index.assets, facet_index=facet_index),
+                'errors': snapshot['errors']}
+
+    return snipeit_cache.update_dataset(DATASET, update)
+
+
+def invalidate():
+    """Marks the snapshot and the raw rows as stale: the next view triggers a full refresh."""
+    snipeit_cache.invalidate_dataset('featured_hardware')
+    snipeit_cache.invalidate_dataset(DATASET)
+
+
+@scheduler.background_job
+def run_scheduler(interval):
+    while True:
+        try:
+            refresh(max_age=interval)
+        except Exception:
+            # Keep the scheduler alive, the next run may succeed
+            logger.exception("Featured list refresh failed.")
+        time.sleep(interval)
+
+
+def start_background_scheduler():
+    threading.Thread(target=run_scheduler, args=(settings.FEATURED_SNAPSHOT_REFRESH_INTERVAL,),
+                     name='featured-list-scheduler', daemon=True).start()
@@ -82,3 +82,20 @@ class CategoryConfigForm(forms.Form):
         # For now, 'required=False' on field and view will validate.
         # if self.initial.get('mode') == 'fixed' or (self.is_bound and self.data.get('mode') == 'fixed'):
         #     self.fields['allowed_categories'].required = True
+
+class EmployeeBatchForm(forms.Form):
+    REPORT_FORMAT_CHOICES = [
+        ('html', _('Web page')),
+        ('csv', _('CSV file')),
+    ]
+
+    employees_file = forms.FileField(
+        label=_("Employee numbers (CSV)"),
+        help_text=_("One employee number per line, or a CSV file with an 'employee_number' column."),
+        widget=forms.ClearableFileInput(attrs={'class': 'file-input', 'accept': '.csv,.txt,text/csv,text/plain'})
+    )
+    report_format = forms.ChoiceField(
+        label=_("Report format"),
+        choices=REPORT_FORMAT_CHOICES,
+        initial='html',
+    )
@@ -0,0 +1,203 @@
+"""
+Hedged GET requests to Snipe-IT, to cut the latency outliers of slow endpoints.
+
+When SNIPEIT_HEDGING['enabled'] is set, a GET to one of SNIPEIT_HEDGING['endpoints'] that has not
+answered after the endpoint's observed 95th percentile latency is sent a second time, and the
+first response to arrive is used (the other one is discarded when it arrives). Only idempotent
+GETs go through get(); checkouts and checkins are never hedged.
+
+The percentile is computed per endpoint ('hardware', 'users/{id}/assets': numeric path segments
+are replaced by {id}) over the last WINDOW_SIZE responses of this process; no request is hedged
+before SNIPEIT_HEDGING['min_samples'] responses were seen. The extra load is capped by a budget:
+each request adds max_extra_percent / 100 of a token, each hedge spends one, so at most
+max_extra_percent % more requests are sent over time (with bursts of up to BUDGET_BURST).
+
+Within a request (see deadline.py) the hedge never outlives the request's budget: the wait before
+hedging is capped at the time left, and the second request is only sent, with its timeout
+shortened to the time left, while at least REQUEST_DEADLINE['min_call_timeout'] remains.
+"""
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+
+from . import deadline, scheduler
+
+WINDOW_SIZE = 200
+BUDGET_BURST = 10
+
+_NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_key(url):
+    """'https://snipeit/api/v1/users/12/assets?x=1' -> 'users/{id}/assets'"""
+    path = urlsplit(url).path
+    api_path = urlsplit(settings.SNIPEIT_API_URL).path
+    if path.startswith(api_path):
+        path = '/' + path[len(api_path):].lstrip('/')
+    return _NUMERIC_SEGMENT.sub('/{id}', path).strip('/')
+
+
+class LatencyWindow:
+    """Latencies (seconds) of the last WINDOW_SIZE responses of one endpoint."""
+
+    def __init__(self, size=WINDOW_SIZE):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, percent):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+class HedgeBudget:
+    """Token bucket limiting hedges to a percentage of the requests."""
+
+    def __init__(self, percent, burst=BUDGET_BURST):
+        self.percent = percent
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.percent / 100)
+
+    def try_acquire(self):
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+_windows = {}
+_windows_lock = threading.Lock()
+_budget = None
+_executor = None
+_setup_lock = threading.Lock()
+counters = {'requests': 0, 'hedges': 0, 'hedge_wins': 0}
+_counters_lock = threading.Lock()
+
+
+def _window(endpoint):
+    with _windows_lock:
+        return _windows.setdefault(endpoint, LatencyWindow())
+
+
+def _setup():
+    global _budget, _executor
+    with _setup_lock:
+        config = settings.SNIPEIT_HEDGING
+        if _budget is None or _budget.percent != config['max_extra_percent']:
+            _budget = HedgeBudget(config['max_extra_percent'])
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config['max_workers'], thread_name_prefix='snipeit-hedge')
+    return _budget, _executor
+
+
+def _count(name):
+    with _counters_lock:
+        counters[name] += 1
+
+
+def reset():
+    """Forgets the observed latencies and the budget (e.g. between tests)."""
+    global _budget
+    with _windows_lock:
+        _windows.clear()
+    _budget = None
+    with _counters_lock:
+        for name in counters:
+            counters[name] = 0
+
+
+def _timed_get(window, session, url, kwargs):
+    started = time.monotonic()
+    response = (session or requests).get(url, **kwargs)
+    window.add(time.monotonic() - started)
+    return response
+
+
+def _discard(future):
+    # The losing request of a hedge: free its connection once it completes
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def get(url, session=None, **kwargs):
+    """
+    requests.get(url, **kwargs), hedged as described in the module docstring. Sent through
+    `session` (a requests Session, see backends.py) when given, in a slot of the caller's
+    priority class (see scheduler.py).
+    """
+    with scheduler.slot():
+        return _get(url, session, kwargs)
+
+
+def _hedge_kwargs(kwargs, request_deadline):
+    """kwargs of the hedge, its timeout shortened to the request's budget; None when too little is left."""
+    if request_deadline is None:
+        return kwargs
+    remaining = request_deadline.remaining()
+    if remaining < settings.REQUEST_DEADLINE['min_call_timeout']:
+        return None
+    cap = kwargs.get('timeout')
+    return {**kwargs, 'timeout': remaining if cap is None else min(cap, remaining)}
+
+
+def _get(url, session, kwargs):
+    config = settings.SNIPEIT_HEDGING
+    endpoint = endpoint_key(url)
+    if not config['enabled'] or endpoint not in config['endpoints']:
+        return (session or requests).get(url, **kwargs)
+
+    budget, executor = _setup()
+    window = _window(endpoint)
+    budget.on_request()
+    _count('requests')
+    if len(window) < config['min_samples']:
+        return _timed_get(window, session, url, kwargs)
+
+    request_deadline = deadline.current()
+    delay = max(window.percentile(95), config['min_delay'])
+    if request_deadline is not None:
+        delay = min(delay, request_deadline.remaining())
+    primary = executor.submit(_timed_get, window, session, url, kwargs)
+    futures = [primary]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        hedge_kwargs = _hedge_kwargs(kwargs, request_deadline)
+        if hedge_kwargs is not None and budget.try_acquire():
+            _count('hedges')
+            futures.append(executor.submit(_timed_get, window, session, url, hedge_kwargs))
+
+    error = None
+    for future in as_completed(futures):
+        try:
+            response = future.result()
+        except requests.exceptions.RequestException as e:
+            error = e
+            continue
+        if future is not primary:
+            _count('hedge_wins')
+        for other in futures:
+            if other is not future:
+                other.add_done_callback(_discard)
+        return response
+    raise error
@@ -0,0 +1,339 @@
+"""
+Daily history of the assignment, status and category of every asset.
+
+Snipe-IT's activity log can tell who held an asset on a given day, but only by paging through
+the whole log. take_snapshot() (run every day, see run_daily() and `python manage.py
+snapshot_inventory`) reads the hardware of the primary Snipe-IT instance and appends one record
+per asset that changed since the previous snapshot:
+
+    day (date ordinal) | asset id | assigned user id | status label id | category id
+
+Each column is its own append-only file of 32-bit integers in INVENTORY_HISTORY['directory'],
+read through mmap. A record holds the state of the asset from its day on; -1 is "none" (an
+asset not assigned to a user, e.g. checked out to a location, has user -1) and an asset gone
+from Snipe-IT gets a record with category REMOVED. The number of committed records is kept in
+meta.json, written last, so a snapshot interrupted half-way is dropped by the next one. The
+names of the users, statuses and categories and the asset tags are appended to names.jsonl.
+
+The readers index the records once per process and then only the records appended since:
+
+* the records of each asset, so holder() finds the state of an asset on a day with a binary
+  search,
+* per snapshot day, the change of the number of assets (and assigned assets) of each category,
+  so headcount() sums them up without replaying the records.
+"""
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import scheduler, snipeit_api
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('day', 'asset', 'user', 'status', 'category')
+NONE = -1
+REMOVED = -2
+META_FILE = 'meta.json'
+NAMES_FILE = 'names.jsonl'
+SNAPSHOT_LOCK_KEY = 'lock:inventory_snapshot'
+SNAPSHOT_LOCK_TIMEOUT = 3600
+# Longest headcount() series, in days
+MAX_SERIES_DAYS = 3660
+# Seconds between two checks of run_daily() for a missing snapshot
+CHECK_INTERVAL = 900
+
+
+def _id(value):
+    return int(value) if value is not None else NONE
+
+
+def asset_state(asset):
+    """(user, status, category) of a hardware row, as stored in the history."""
+    assignee = asset.get('assigned_to')
+    user_id = NONE
+    if isinstance(assignee, dict) and assignee.get('type', 'user') == 'user':
+        user_id = _id(assignee.get('id'))
+    return (user_id, _id((asset.get('status_label') or {}).get('id')), _id((asset.get('category') or {}).get('id')))
+
+
+class InventoryHistory:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._columns = {column: array('i') for column in COLUMNS}
+        self._rows = 0
+        self._indexed = 0
+        self._names_offset = 0
+        self.names = {'user': {}, 'status': {}, 'category': {}, 'asset': {}}
+        self.asset_ids_by_tag = {}
+        # asset id -> positions of its records; asset id -> its latest (user, status, category)
+        self._positions = {}
+        self.current = {}
+        # day -> {category id: [assets delta, assigned assets delta]}, and the sorted days
+        self._deltas = {}
+        self._days = []
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path(META_FILE)) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return {'rows': 0, 'last_day': None}
+
+    def last_day(self):
+        """The day of the latest snapshot, or None."""
+        last_day = self._read_meta()['last_day']
+        return date.fromordinal(last_day) if last_day else None
+
+    def refresh(self):
+        """Maps the records committed since the last call and adds them to the indexes."""
+        with self._lock:
+            rows = self._read_meta()['rows']
+            if rows != self._rows:
+                self._map_columns(rows)
+            self._index_until(rows)
+            self._read_names()
+
+    def _map_columns(self, rows):
+        # The previous mappings are closed once their memoryviews are no longer referenced
+        columns = {}
+        for column in COLUMNS:
+            if not rows:
+                columns[column] = array('i')
+                continue
+            with open(self._path(f'{column}.i32'), 'rb') as column_file:
+                mapped = mmap.mmap(column_file.fileno(), rows * 4, access=mmap.ACCESS_READ)
+            columns[column] = memoryview(mapped).cast('i')
+        self._columns = columns
+        self._rows = rows
+
+    def _index_until(self, rows):
+        if rows < self._indexed:
+            # The files were replaced (e.g. restored from a backup): start over
+            self._reset()
+            self._map_columns(rows)
+        day_column, asset_column = self._columns['day'], self._columns['asset']
+        user_column, status_column, category_column = (self._columns[column] for column in ('user', 'status', 'category'))
+        for position in range(self._indexed, rows):
+            day, asset_id = day_column[position], asset_column[position]
+            state = (user_column[position], status_column[position], category_column[position])
+            self._positions.setdefault(asset_id, array('I')).append(position)
+            previous = self.current.get(asset_id)
+            day_deltas = self._deltas.get(day)
+            if day_deltas is None:
+                day_deltas = self._deltas[day] = {}
+                self._days.append(day)
+            if previous is not None and previous[2] != REMOVED:
+                counts = day_deltas.setdefault(previous[2], [0, 0])
+                counts[0] -= 1
+                counts[1] -= previous[0] != NONE
+            if state[2] != REMOVED:
+                counts = day_deltas.setdefault(state[2], [0, 0])
+                counts[0] += 1
+                counts[1] += state[0] != NONE
+            self.current[asset_id] = state
+        self._indexed = rows
+
+    def _read_names(self):
+        try:
+            with open(self._path(NAMES_FILE)) as names_file:
+                names_file.seek(self._names_offset)
+                for line in iter(names_file.readline, ''):
+                    if not line.endswith('\n'):
+                        # Still being written
+                        break
+                    entry = json.loads(line)
+                    self.names[entry['kind']][entry['id']] = entry['name']
+                    if entry['kind'] == 'asset':
+                        self.asset_ids_by_tag[entry['name']] = entry['id']
+                    self._names_offset = names_file.tell()
+        except FileNotFoundError:
+            pass
+
+    def _name(self, kind, object_id):
+        if object_id in (NONE, REMOVED):
+            return None
+        return {'id': object_id, 'name': self.names[kind].get(object_id)}
+
+    def state_on(self, asset_id, day):
+        """(user, status, category) of an asset on a day, or None if it was not in the history yet."""
+        self.refresh()
+        with self._lock:
+            positions = self._positions.get(int(asset_id))
+            if not positions:
+                return None
+            day_column = self._columns['day']
+            index = bisect_right(positions, day.toordinal(), key=lambda position: day_column[position])
+            if not index:
+                return None
+            position = positions[index - 1]
+            return tuple(self._columns[column][position] for column in ('user', 'status', 'category'))
+
+    def holder(self, asset_id, day):
+        """Who held an asset, with its status and category, at the end of a day."""
+        state = self.state_on(asset_id, day)
+        result = {'asset_id': int(asset_id), 'asset_tag': self.names['asset'].get(int(asset_id)), 'date': day.isoformat()}
+        if state is None or state[2] == REMOVED:
+            return {**result, 'known': False, 'user': None, 'status': None, 'category': None}
+        user_id, status_id, category_id = state
+        return {**result, 'known': True, 'user': self._name('user', user_id),
+                'status': self._name('status', status_id), 'category': self._name('category', category_id)}
+
+    def headcount(self, start, end, category_ids=None):
+        """
+        The number of assets, and of assets assigned to a user, of each category on every day
+        from start to end: {'categories': {id: name}, 'series': [{'date', 'counts': {id: {...}}}]}.
+        """
+        if (end - start).days >= MAX_SERIES_DAYS:
+            raise ValueError(f"At most {MAX_SERIES_DAYS} days can be requested.")
+        self.refresh()
+        with self._lock:
+            wanted = set(category_ids) if category_ids else None
+            totals = {}
+            index = 0
+            series = []
+            for offset in range((end - start).days + 1):
+                day = start + timedelta(days=offset)
+                ordinal = day.toordinal()
+                while index < len(self._days) and self._days[index] <= ordinal:
+                    for category_id, (assets, assigned) in self._deltas[self._days[index]].items():
+                        if wanted is None or category_id in wanted:
+                            counts = totals.setdefault(category_id, [0, 0])
+                            counts[0] += assets
+                            counts[1] += assigned
+                    index += 1
+                series.append({
+                    'date': day.isoformat(),
+                    'counts': {category_id: {'assets': assets, 'assigned': assigned}
+                               for category_id, (assets, assigned) in sorted(totals.items())},
+                })
+            return {
+                'categories': {category_id: self.names['category'].get(category_id) for category_id in sorted(totals)},
+                'series': series,
+            }
+
+    def append_snapshot(self, day, states, names):
+        """
+        Appends the changes of a snapshot: states is {asset id: (user, status, category)} for
+        every current asset, names {kind: {id: name}}. Returns the number of records appended.
+        """
+        with self._lock:
+            self.refresh()
+            last_day = self.last_day()
+            if last_day is not None and day < last_day:
+                raise ValueError(f"A snapshot was already taken for {last_day}, the history cannot go back to {day}.")
+
+            records = [(asset_id, state) for asset_id, state in sorted(states.items())
+                       if self.current.get(asset_id) != state]
+            records += [(asset_id, (NONE, NONE, REMOVED)) for asset_id, state in sorted(self.current.items())
+                        if asset_id not in states and state[2] != REMOVED]
+
+            os.makedirs(self.directory, exist_ok=True)
+            self._append_names(names)
+            rows = self._rows
+            for index, column in enumerate(COLUMNS):
+                values = array('i', [day.toordinal()] * len(records) if column == 'day'
+                               else [asset_id for asset_id, _ in records] if column == 'asset'
+                               else [state[index - 2] for _, state in records])
+                with open(self._path(f'{column}.i32'), 'ab') as column_file:
+                    # Drop what an interrupted snapshot may have left after the committed records
+                    column_file.truncate(rows * 4)
+                    values.tofile(column_file)
+                    column_file.flush()
+                    os.fsync(column_file.fileno())
+            temporary_path = self._path(META_FILE + '.tmp')
+            with open(temporary_path, 'w') as meta_file:
+                json.dump({'rows': rows + len(records), 'last_day': day.toordinal()}, meta_file)
+            os.replace(temporary_path, self._path(META_FILE))
+            self.refresh()
+            return len(records)
+
+    def _append_names(self, names):
+        lines = [json.dumps({'kind': kind, 'id': object_id, 'name': name}) + '\n'
+                 for kind, kind_names in names.items() for object_id, name in sorted(kind_names.items())
+                 if name is not None and self.names[kind].get(object_id) != name]
+        if lines:
+            with open(self._path(NAMES_FILE), 'a') as names_file:
+                names_file.writelines(lines)
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    global _history
+    with _history_lock:
+        if _history is None or _history.directory != settings.INVENTORY_HISTORY['directory']:
+            _history = InventoryHistory(settings.INVENTORY_HISTORY['directory'])
+        return _history
+
+
+def take_snapshot(day=None):
+    """
+    Reads every hardware row of Snipe-IT and appends the changes since the previous snapshot.
+    Returns a summary dict, or None when another process is taking a snapshot.
+    Raises requests.exceptions.RequestException when Snipe-IT cannot be read.
+    """
+    if not cache.add(SNAPSHOT_LOCK_KEY, os.getpid(), timeout=SNAPSHOT_LOCK_TIMEOUT):
+        return None
+    try:
+        day = day or timezone.localdate()
+        states = {}
+        names = {'user': {}, 'status': {}, 'category': {}, 'asset': {}}
+        for asset in snipeit_api.iter_rows('hardware'):
+            if asset.get('id') is None:
+                continue
+            asset_id = int(asset['id'])
+            states[asset_id] = user_id, status_id, category_id = asset_state(asset)
+            names['asset'][asset_id] = asset.get('asset_tag')
+            if user_id != NONE:
+                names['user'][user_id] = asset['assigned_to'].get('name')
+            if status_id != NONE:
+                names['status'][status_id] = asset['status_label'].get('name')
+            if category_id != NONE:
+                names['category'][category_id] = asset['category'].get('name')
+        changes = get_history().append_snapshot(day, states, names)
+        return {'date': day.isoformat(), 'assets': len(states), 'changes': changes}
+    finally:
+        cache.delete(SNAPSHOT_LOCK_KEY)
+
+
+@scheduler.background_job
+def run_daily(hour):
+    """Takes the day's snapshot once it is past `hour` (local time) and none was taken yet."""
+    while True:
+        try:
+            now = timezone.localtime()
+            last_day = get_history().last_day()
+            if now.hour >= hour and (last_day is None or last_day < now.date()):
+                summary = take_snapshot()
+                if summary:
+                    logger.info("Inventory snapshot of %s: %s changes for %s assets.",
+                                summary['date'], summary['changes'], summary['assets'])
+        except Exception:
+            # Keep the schedule, the next check may succeed
+            logger.exception("Inventory snapshot failed.")
+        time.sleep(CHECK_INTERVAL)
+
+
+def start_background_scheduler():
+    threading.Thread(target=run_daily, args=(settings.INVENTORY_HISTORY['snapshot_hour'],),
+                     name='inventory-snapshot', daemon=True).start()
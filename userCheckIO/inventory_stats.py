@@ -0,0 +1,445 @@
+"""
+Asset counts of the statistics dashboard, maintained incrementally.
+
+Counting the assets by category, status, model and assignment from Snipe-IT means reading every
+/hardware page. The counts are kept instead in the 'inventory_stats' dataset of the shared cache
+(see snipeit_cache.py), with the state of each asset of the primary Snipe-IT instance they were
+computed from:
+
+    {
+        'assets': {asset_id: (category_id, status_id, model_id, assigned)},
+        'categories': {category_id: {'total': 12, 'assigned': 9, 'status': {status_id: 4, ...},
+                                     'model': {model_id: 2, ...}}},
+        'names': {'category': {id: name}, 'status': {id: name}, 'model': {id: name}},
+    }
+
+Counts are kept per category so that the totals, and those of the featured categories, are a
+sum over a few categories. They are updated, one asset at a time, by:
+
+* the checkouts and checkins made with this app (set_assigned()),
+* the asset events of the webhook and the activity poller (cache_events.py),
+* the rows of every featured list refresh (featured_snapshot.py): an asset whose row changed is
+  counted again.
+
+A change never republishes the dataset on the request path: it is appended to a buffer of the
+worker, written every INVENTORY_STATS['flush_interval'] seconds by a background thread as one
+entry of a shared change log (a sequence number and one cache key per entry). Reads merge the
+entries not applied yet on top of the dataset (memoized per process), and every
+INVENTORY_STATS['fold_after'] entries the log is folded into the dataset with one
+update_dataset(). A change records the new state of its asset, so a rebuild simply applies again
+the entries logged since its scan started. Setting flush_interval to None (or 0) logs each
+change synchronously.
+
+The whole dataset is rebuilt from a full /hardware scan when it is older than
+SNIPEIT_CACHE_TIMEOUTS['inventory_stats'] (a consistency check, by default once a day), in the
+background, or with `python manage.py rebuild_inventory_stats`.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import backends, scheduler, snipeit_api, snipeit_cache
+
+logger = logging.getLogger(__name__)
+
+DATASET = 'inventory_stats'
+LOCK_KEY = f'lock:dataset:{DATASET}'
+# Shared log of the changes not folded into the dataset yet: entries 1..seq
+LOG_SEQ_KEY = f'log:dataset:{DATASET}:seq'
+LOG_KEY_PREFIX = f'log:dataset:{DATASET}:'
+LOG_LOCK_KEY = f'lock:log:dataset:{DATASET}'
+LOG_LOCK_TIMEOUT = 10
+# Number of models listed on the dashboard, the others are summed up in one line
+TOP_MODELS = 20
+
+
+def asset_state(asset):
+    """(category_id, status_id, model_id, assigned) of a hardware row."""
+    return (
+        (asset.get('category') or {}).get('id'),
+        (asset.get('status_label') or {}).get('id'),
+        (asset.get('model') or {}).get('id'),
+        bool(asset.get('assigned_to')),
+    )
+
+
+def _row_names(asset):
+    return {
+        kind: {value['id']: value.get('name')}
+        for kind, key in (('category', 'category'), ('status', 'status_label'), ('model', 'model'))
+        if isinstance(value := asset.get(key), dict) and value.get('id') is not None
+    }
+
+
+def _count(counts, key, sign):
+    value = counts.get(key, 0) + sign
+    if value:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
+
+
+def _add(categories, state, sign):
+    category_id, status_id, model_id, assigned = state
+    counts = categories[category_id]
+    counts['total'] += sign
+    counts['assigned'] += sign * assigned
+    _count(counts['status'], status_id, sign)
+    _count(counts['model'], model_id, sign)
+    if not counts['total']:
+        del categories[category_id]
+
+
+def apply_changes(payload, changes, names=None):
+    """
+    A new payload with the assets of `changes` ({asset_id: state, or None for a removed asset})
+    counted again, or None when nothing changed. The payload is not modified (other threads may
+    be reading it): only the touched categories are copied.
+    """
+    changes = {asset_id: state for asset_id, state in changes.items() if payload['assets'].get(asset_id) != state}
+    new_names = {kind: {**payload['names'][kind], **(names or {}).get(kind, {})} for kind in payload['names']}
+    if not changes:
+        return None if new_names == payload['names'] else {**payload, 'names': new_names}
+
+    assets = dict(payload['assets'])
+    categories = dict(payload['categories'])
+
+    def category_counts(category_id):
+        counts = categories.get(category_id)
+        if counts is None or counts is payload['categories'].get(category_id):
+            counts = categories[category_id] = {
+                'total': counts['total'] if counts else 0,
+                'assigned': counts['assigned'] if counts else 0,
+                'status': dict(counts['status']) if counts else {},
+                'model': dict(counts['model']) if counts else {},
+            }
+        return counts
+
+    for asset_id, state in changes.items():
+        previous = assets.pop(asset_id, None)
+        if previous is not None:
+            category_counts(previous[0])
+            _add(categories, previous, -1)
+        if state is not None:
+            category_counts(state[0])
+            _add(categories, state, 1)
+            assets[asset_id] = state
+    return {'assets': assets, 'categories': categories, 'names': new_names}
+
+
+_merged = None  # (dataset version, log seq, merged payload) of this process
+_merged_lock = threading.Lock()
+
+
+def build(rows):
+    """The payload of these hardware rows."""
+    payload = {'assets': {}, 'categories': {}, 'names': {'category': {}, 'status': {}, 'model': {}}}
+    changes = {}
+    names = {'category': {}, 'status': {}, 'model': {}}
+    for asset in rows:
+        if asset.get('id') is None:
+            continue
+        changes[asset['id']] = asset_state(asset)
+        for kind, kind_names in _row_names(asset).items():
+            names[kind].update(kind_names)
+    return apply_changes(payload, changes, names) or payload
+
+
+def _rebuild_holding_lock():
+    try:
+        # Changes logged from now on are applied again on top of the scan (see _apply_log()),
+        # unless they were made before it started: the scan already sees them
+        started, applied_seq = time.time(), _log_seq()
+        payload = {**build(snipeit_api.iter_rows('hardware')), 'applied_seq': applied_seq, 'built_at': started}
+        snipeit_cache.publish_dataset(DATASET, payload)
+    finally:
+        cache.delete(LOCK_KEY)
+    return payload
+
+
+def rebuild():
+    """
+    Counts the assets from a full /hardware scan. Returns the payload, or None when another
+    worker is rebuilding. Raises requests.exceptions.RequestException when Snipe-IT cannot be read.
+    """
+    if not cache.add(LOCK_KEY, True, timeout=snipeit_cache.REFRESH_LOCK_TIMEOUT):
+        return None
+    return _rebuild_holding_lock()
+
+
+def refresh(max_age=0):
+    """Rebuilds the counts if they are older than max_age seconds; returns the current payload."""
+    payload, pointer = snipeit_cache.get_dataset(DATASET)
+    if payload is not None and time.time() - pointer['refreshed_at'] < max_age:
+        return _merge_log(payload, pointer)
+    return rebuild() or (payload and _merge_log(payload, pointer))
+
+
+def rebuild_in_background():
+    """Starts a rebuild in a background thread, unless one is already running."""
+    if cache.add(LOCK_KEY, True, timeout=snipeit_cache.REFRESH_LOCK_TIMEOUT):
+        threading.Thread(target=scheduler.background_job(_rebuild_holding_lock), name='inventory-stats-rebuild', daemon=True).start()
+
+
+# --- Change log ---
+
+def _log_seq():
+    return cache.get(LOG_SEQ_KEY) or 0
+
+
+def _acquire_log_lock():
+    give_up_at = time.monotonic() + LOG_LOCK_TIMEOUT
+    while not cache.add(LOG_LOCK_KEY, os.getpid(), timeout=LOG_LOCK_TIMEOUT):
+        if time.monotonic() >= give_up_at:
+            return False
+        time.sleep(snipeit_cache.PATCH_LOCK_POLL)
+    return True
+
+
+def _read_log(first_seq, last_seq):
+    """The log entries first_seq..last_seq, oldest first; expired or not yet written ones are missing."""
+    keys = [f'{LOG_KEY_PREFIX}{seq}' for seq in range(first_seq, last_seq + 1)]
+    entries = cache.get_many(keys) if keys else {}
+    return [entries[key] for key in keys if key in entries]
+
+
+def _apply_log(payload, entries, seq):
+    """
+    The payload with the changes of these log entries applied in the order they were made (the
+    entries of different workers interleave). A change is absolute (the new state of an asset,
+    or its new assignment): one made before the scan of the payload, or before the last change
+    applied to its asset, is skipped.
+    """
+    changed_at = dict(payload.get('changed_at', {}))
+    states = {}
+    names = {'category': {}, 'status': {}, 'model': {}}
+    for entry in entries:
+        for kind, kind_names in entry['names'].items():
+            names[kind].update(kind_names)
+    for made_at, asset_id, change in sorted((change for entry in entries for change in entry['changes']), key=lambda change: change[0]):
+        if made_at < max(payload.get('built_at', 0), changed_at.get(asset_id, 0)):
+            continue
+        if isinstance(change, bool):
+            # Only the assignment changed
+            current = states[asset_id] if asset_id in states else payload['assets'].get(asset_id)
+            if current is None:
+                # Unknown asset: it is counted by the next rebuild
+                continue
+            change = current[:3] + (change,)
+        changed_at[asset_id] = made_at
+        states[asset_id] = change
+    counted = apply_changes(payload, states, names) or payload
+    return {**counted, 'applied_seq': seq, 'built_at': payload.get('built_at', 0), 'changed_at': changed_at}
+
+
+def _merge_log(payload, pointer):
+    """The payload with the changes logged since it was published; memoized per process."""
+    global _merged
+    seq = _log_seq()
+    applied_seq = payload.get('applied_seq', 0)
+    if seq <= applied_seq:
+        return payload
+    with _merged_lock:
+        if _merged is not None and _merged[:2] == (pointer['version'], seq):
+            return _merged[2]
+    entries = _read_log(applied_seq + 1, seq)
+    merged = _apply_log(payload, entries, seq)
+    if cache.get(f'{LOG_KEY_PREFIX}{seq}') is not None:
+        # Not memoized while the last entry is still being written (see _write_log())
+        with _merged_lock:
+            _merged = (pointer['version'], seq, merged)
+    return merged
+
+
+def fold():
+    """Applies the logged changes to the dataset itself, so that reads have less to merge."""
+    if not _acquire_log_lock():
+        return False
+    try:
+        seq = _log_seq()
+
+        def update(payload):
+            if seq <= payload.get('applied_seq', 0):
+                return None
+            return _apply_log(payload, _read_log(payload.get('applied_seq', 0) + 1, seq), seq)
+
+        return snipeit_cache.update_dataset(DATASET, update)
+    finally:
+        cache.delete(LOG_LOCK_KEY)
+
+
+def _write_log(changes, names):
+    """Appends one entry to the shared log; folds the log into the dataset every INVENTORY_STATS['fold_after'] entries."""
+    # Under the log lock: fold() must not read a sequence number before its entry is written
+    if not _acquire_log_lock():
+        logger.warning("Could not log %d inventory statistics changes, the next rebuild counts them.", len(changes))
+        return
+    try:
+        cache.add(LOG_SEQ_KEY, 0, timeout=None)
+        seq = cache.incr(LOG_SEQ_KEY)
+        cache.set(f'{LOG_KEY_PREFIX}{seq}', {'changes': changes, 'names': names},
+                  timeout=2 * settings.SNIPEIT_CACHE_TIMEOUTS[DATASET])
+    finally:
+        cache.delete(LOG_LOCK_KEY)
+    if seq % settings.INVENTORY_STATS['fold_after'] == 0:
+        fold()
+
+
+class ChangeBuffer:
+    """Changes recorded by this worker, logged by a background thread every `interval` seconds."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._changes = []
+        self._names = {'category': {}, 'status': {}, 'model': {}}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork: start one per worker process.
+        # Without a positive interval the buffer is only flushed explicitly.
+        if self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        self._thread = threading.Thread(target=self._run, name='inventory-stats-log', daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def add(self, changes, names):
+        with self._lock:
+            self._changes.extend(changes)
+            for kind, kind_names in names.items():
+                self._names[kind].update(kind_names)
+            self._ensure_thread()
+
+    def __len__(self):
+        return len(self._changes)
+
+    def flush(self):
+        with self._lock:
+            changes, self._changes = self._changes, []
+            names, self._names = self._names, {'category': {}, 'status': {}, 'model': {}}
+        if changes:
+            _write_log(changes, names)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not log the inventory statistics changes.")
+
+
+def _record(changes, names=None):
+    """
+    Records changes [(time, asset_id, new state or None when removed, or the new assignment)]:
+    logged at once when INVENTORY_STATS['flush_interval'] is None or 0, otherwise by change_buffer.
+    """
+    interval = settings.INVENTORY_STATS['flush_interval']
+    if interval is None or interval <= 0:
+        _write_log(changes, names or {})
+    else:
+        change_buffer.add(changes, names or {})
+
+
+change_buffer = ChangeBuffer(settings.INVENTORY_STATS['flush_interval'] or 0)
+atexit.register(change_buffer.flush)
+
+
+def get_stats():
+    """
+    Returns (payload, is_stale), or (None, True) when the counts were never built. The payload
+    includes the changes logged since it was published. Never calls Snipe-IT.
+    """
+    payload, pointer = snipeit_cache.get_dataset(DATASET)
+    if payload is None:
+        return None, True
+    return _merge_log(payload, pointer), time.time() - pointer['refreshed_at'] >= settings.SNIPEIT_CACHE_TIMEOUTS[DATASET]
+
+
+def apply_rows(rows):
+    """
+    Counts these hardware rows again (e.g. a refresh of the featured list). Rows of other
+    instances are ignored. Returns True when a change was recorded.
+    """
+    rows = [asset for asset in rows if asset.get('id') is not None and backends.is_primary(asset)]
+    payload, _ = get_stats()
+    if not rows or payload is None:
+        return False
+    names = {'category': {}, 'status': {}, 'model': {}}
+    for asset in rows:
+        for kind, kind_names in _row_names(asset).items():
+            names[kind].update(kind_names)
+    now = time.time()
+    # Only the assets counted with another state are recorded
+    changes = [(now, asset['id'], state) for asset in rows if payload['assets'].get(asset['id']) != (state := asset_state(asset))]
+    if not changes:
+        return False
+    _record(changes, names)
+    return True
+
+
+def apply_asset(asset_id, asset):
+    """Counts an asset again from its hardware row, or drops it when asset is None (deleted)."""
+    if asset is None:
+        payload, _ = get_stats()
+        if payload is None or asset_id not in payload['assets']:
+            return False
+        _record([(time.time(), asset_id, None)])
+        return True
+    return apply_rows([{**asset, 'id': asset_id}])
+
+
+def set_assigned(asset_id, assigned):
+    """Records a checkout (assigned=True) or a checkin made with this app, without writing the counts."""
+    _record([(time.time(), asset_id, bool(assigned))])
+
+
+def summarize(payload, category_ids=None):
+    """
+    The dashboard's tables for the given categories (all of them by default):
+    {'total', 'assigned', 'unassigned', 'by_category', 'by_status', 'by_model'}, each table a list
+    of {'id', 'name', 'count', ...} sorted by decreasing count.
+    """
+    names = payload['names']
+    selected = [category_id for category_id in payload['categories']
+                if category_ids is None or category_id in category_ids]
+    total = assigned = 0
+    statuses = {}
+    models = {}
+    by_category = []
+    for category_id in selected:
+        counts = payload['categories'][category_id]
+        total += counts['total']
+        assigned += counts['assigned']
+        for status_id, count in counts['status'].items():
+            statuses[status_id] = statuses.get(status_id, 0) + count
+        for model_id, count in counts['model'].items():
+            models[model_id] = models.get(model_id, 0) + count
+        by_category.append({'id': category_id, 'name': names['category'].get(category_id) or 'None',
+                            'count': counts['total'], 'assigned': counts['assigned']})
+
+    def table(kind, counts):
+        return sorted(({'id': value_id, 'name': names[kind].get(value_id) or 'None', 'count': count}
+                       for value_id, count in counts.items()), key=lambda entry: (-entry['count'], entry['name']))
+
+    by_model = table('model', models)
+    if len(by_model) > TOP_MODELS:
+        others = sum(entry['count'] for entry in by_model[TOP_MODELS:])
+        by_model = by_model[:TOP_MODELS] + [{'id': None, 'name': 'Other models', 'count': others}]
+    return {
+        'total': total,
+        'assigned': assigned,
+        'unassigned': total - assigned,
+        'by_category': sorted(by_category, key=lambda entry: (-entry['count'], entry['name'])),
+        'by_status': table('status', statuses),
+        'by_model': by_model,
+    }
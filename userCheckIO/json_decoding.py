@@ -0,0 +1,186 @@
+"""
+Decoding of Snipe-IT's JSON responses.
+
+response.json() builds the whole tree of a response with the stdlib decoder, including the dozens
+of fields of each /hardware row that no page displays. Two cheaper ways are offered:
+
+* decode(response): the whole body, with orjson when it is installed (`pip install orjson`) and
+  SNIPEIT_JSON_DECODER is 'auto', with the stdlib json module otherwise,
+* parse_page(chunks, paths): a selective streaming parse of a list page ({"total": ..., "rows":
+  [...]}). The body is read chunk by chunk (e.g. response.iter_content()), each row is decoded
+  on its own and only the given paths of it are kept (see select()), so the full tree of the
+  page is never built and at most one full row is held at a time.
+
+`python benchmarks/json_decoding.py` compares the decode time and peak memory of these with
+response.json() on 200 and 5,000 row pages.
+"""
+import codecs
+import json
+import re
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # Optional, the stdlib decoder is used without it
+    orjson = None
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters that can follow a complete number
+_NUMBER_END = frozenset(',]} \t\n\r')
+_decoder = json.JSONDecoder()
+
+
+def fast_decoder_available():
+    return orjson is not None and settings.SNIPEIT_JSON_DECODER == 'auto'
+
+
+def loads(data):
+    """Decodes a JSON document (bytes or str)."""
+    if fast_decoder_available():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode(response):
+    """The decoded body of a requests response, like response.json()."""
+    return loads(response.content)
+
+
+def path_tree(paths):
+    """['id', 'model.name', 'model.id'] -> {'id': None, 'model': {'name': None, 'id': None}}; None: the whole value."""
+    tree = {}
+    for path in paths:
+        *parents, leaf = path.split('.')
+        node = tree
+        for key in parents:
+            if key in node and node[key] is None:
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[leaf] = None
+    return tree
+
+
+def _select(row, tree):
+    selected = {}
+    for key, subtree in tree.items():
+        if key in row:
+            value = row[key]
+            selected[key] = _select(value, subtree) if subtree is not None and isinstance(value, dict) else value
+    return selected
+
+
+def select(row, paths):
+    """
+    The parts of a decoded row at these dot-separated paths, nested as in the row:
+    select(row, ['id', 'model.name']) -> {'id': 12, 'model': {'name': 'X1'}}.
+    A path stops at a value that is not an object (null, a list...), which is kept whole, so
+    get_nested_value() returns the same thing on the selected row as on the full row.
+    """
+    return _select(row, path_tree(paths))
+
+
+class _Reader:
+    """A window over the text of a JSON document read chunk by chunk."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._ended = False
+        self.text = ''
+        self.pos = 0
+
+    def read_more(self):
+        """Drops the text already parsed and appends the next chunk; False at the end of the body."""
+        self.text, self.pos = self.text[self.pos:], 0
+        while not self._ended:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._ended = True
+                text = self._utf8.decode(b'', final=True)
+            else:
+                text = self._utf8.decode(chunk.encode() if isinstance(chunk, str) else chunk)
+            if text:
+                self.text += text
+                return True
+        return False
+
+    def error(self, message):
+        return json.JSONDecodeError(message, self.text, self.pos)
+
+    def peek(self):
+        """The next non-whitespace character, without consuming it."""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.read_more():
+                raise self.error("Unexpected end of the document")
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise self.error(f"Expecting '{character}'")
+        self.pos += 1
+
+    def value(self):
+        """Decodes the next complete value, reading more chunks until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            # A number cut by the end of a chunk ("12" of "125") looks complete
+            if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                    and (end == len(self.text) or self.text[end] not in _NUMBER_END) and self.read_more()):
+                continue
+            self.pos = end
+            return value
+
+
+def parse_page(chunks, paths, rows_key='rows'):
+    """
+    Parses a list page read as an iterable of chunks (bytes or str). Returns (rows, fields): the
+    rows reduced to `paths` (see select()) and the other top-level fields ('total'...).
+    """
+    tree = path_tree(paths)
+    reader = _Reader(chunks)
+    rows = []
+    fields = {}
+    reader.expect('{')
+    if reader.peek() == '}':
+        return rows, fields
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key == rows_key and reader.peek() == '[':
+            reader.pos += 1
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    rows.append(_select(reader.value(), tree))
+                    separator = reader.peek()
+                    reader.pos += 1
+                    if separator == ']':
+                        break
+                    if separator != ',':
+                        raise reader.error("Expecting ',' or ']'")
+        else:
+            fields[key] = reader.value()
+        separator = reader.peek()
+        reader.pos += 1
+        if separator == '}':
+            return rows, fields
+        if separator != ',':
+            raise reader.error("Expecting ',' or '}'")
+
+
+def parse_response_page(response, paths):
+    """parse_page() over the body of a requests response."""
+    return parse_page(response.iter_content(chunk_size=CHUNK_SIZE), paths)
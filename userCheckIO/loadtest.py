@@ -0,0 +1,371 @@
+"""
+Load-test harness, to size the number of workers and threads of a deployment
+(see `python manage.py loadtest`).
+
+The app is started under a real server, in a child process, against FakeSnipeIT: a local HTTP
+server answering the Snipe-IT endpoints used by the app after a configurable latency, with a
+few thousand users and assets held in memory (checkouts and checkins change them). Virtual users
+then replay a weighted mix of pages (home page, user asset page, assign, unassign, featured
+list) for a fixed duration at each concurrency level, and each level reports throughput, error
+rate and latency percentiles.
+
+Servers:
+* 'sync': gunicorn (workers x threads) when installed, else Django's threaded runserver,
+* 'async': uvicorn when installed (skipped otherwise).
+
+The knee is the last concurrency level before adding clients stops paying off: throughput grows
+by less than KNEE_MIN_GAIN, or the p95 latency exceeds KNEE_LATENCY_FACTOR times the one of the
+lowest level. Past it, requests only queue up.
+"""
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.util import find_spec
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from django.conf import settings
+
+API_PREFIX = '/api/v1/'
+ADMIN_GROUP_ID = 1
+CATEGORIES = ['Laptops', 'Desktops', 'Monitors', 'Phones', 'Docking Stations']
+FEATURED_CATEGORY_IDS = [1, 4]
+
+DEFAULT_MIX = {'index': 2, 'user_assets': 4, 'assign': 1, 'unassign': 1, 'featured': 2}
+KNEE_MIN_GAIN = 0.10
+KNEE_LATENCY_FACTOR = 2.0
+
+_CSRF_TOKEN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+# --- Fake Snipe-IT ---
+
+class FakeSnipeIT:
+    """In-memory Snipe-IT API served on 127.0.0.1, answering after `latency` (+ up to `jitter`) seconds."""
+
+    def __init__(self, latency=0.05, jitter=0.02, user_count=2000, assets_per_user=3):
+        self.latency = latency
+        self.jitter = jitter
+        self.users = {
+            user_id: {'id': user_id, 'name': f'User {user_id}', 'username': f'user{user_id}',
+                      'employee_num': f'E{user_id}', 'employee_number': f'E{user_id}',
+                      'groups': {'rows': [{'id': ADMIN_GROUP_ID}]} if user_id % 50 == 1 else None}
+            for user_id in range(1, user_count + 1)
+        }
+        self.assets = {}
+        for asset_id in range(1, user_count * assets_per_user + 1):
+            category_id = asset_id % len(CATEGORIES) + 1
+            user_id = asset_id % user_count + 1
+            self.assets[asset_id] = {
+                'id': asset_id, 'asset_tag': f'TAG-{asset_id:06d}', 'name': f'Asset {asset_id}',
+                'serial': f'SN{asset_id:08d}', 'model': {'id': asset_id % 40, 'name': f'Model {asset_id % 40}'},
+                'category': {'id': category_id, 'name': CATEGORIES[category_id - 1]},
+                'status_label': {'id': 1, 'name': 'Deployed'},
+                'assigned_to': {'id': user_id, 'name': self.users[user_id]['name'], 'type': 'user'},
+                'updated_at': {'datetime': '2024-01-01 00:00:00'},
+            }
+        self.tags = {asset['asset_tag']: asset_id for asset_id, asset in self.assets.items()}
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}{API_PREFIX}"
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self._answer('GET', None)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self._answer('POST', json.loads(self.rfile.read(length) or b'{}'))
+
+            def _answer(self, method, payload):
+                time.sleep(fake.latency + random.uniform(0, fake.jitter))
+                url = urlsplit(self.path)
+                status, data = fake.handle(method, url.path[len(API_PREFIX):].strip('/'), parse_qs(url.query), payload)
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-snipeit', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _page(self, rows, query):
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', ['50'])[0])
+        return 200, {'total': len(rows), 'rows': rows[offset:offset + limit]}
+
+    def handle(self, method, path, query, payload=None):
+        """Returns (status, JSON data) for an API call; path is relative to /api/v1/."""
+        parts = path.split('/')
+        self.requests[f"{method} {re.sub(r'/[^/]*[0-9][^/]*', '/{id}', '/' + path)}"] += 1
+        with self._lock:
+            if method == 'POST' and len(parts) == 3 and parts[0] == 'hardware' and parts[2] in ('checkout', 'checkin'):
+                asset = self.assets.get(int(parts[1]))
+                if asset is None:
+                    return 404, {'status': 'error', 'messages': 'Asset not found.'}
+                user = self.users.get(int((payload or {}).get('assigned_user') or 0))
+                if parts[2] == 'checkout' and user is None:
+                    return 200, {'status': 'error', 'messages': 'User not found.'}
+                asset['assigned_to'] = ({'id': user['id'], 'name': user['name'], 'type': 'user'}
+                                        if parts[2] == 'checkout' else None)
+                asset['updated_at'] = {'datetime': time.strftime('%Y-%m-%d %H:%M:%S')}
+                return 200, {'status': 'success', 'messages': 'Done.'}
+            if method != 'GET':
+                return 405, {'status': 'error'}
+            if path == 'users/me':
+                return 200, self.users[1]
+            if path == 'users':
+                employee_number = query.get('employee_num', [None])[0]
+                if employee_number is None:
+                    return self._page(list(self.users.values()), query)
+                user = self.users.get(int(employee_number[1:])) if employee_number[1:].isdigit() else None
+                return 200, {'total': int(user is not None), 'rows': [user] if user else []}
+            if parts[0] == 'users' and len(parts) >= 2 and parts[1].isdigit():
+                user = self.users.get(int(parts[1]))
+                if user is None:
+                    return 404, {'status': 'error'}
+                if len(parts) == 3 and parts[2] == 'assets':
+                    rows = [asset for asset in self.assets.values()
+                            if (asset['assigned_to'] or {}).get('id') == user['id']]
+                    return 200, {'total': len(rows), 'rows': rows}
+                return 200, user
+            if path == 'categories':
+                return self._page([{'id': i + 1, 'name': name, 'category_type': 'asset'}
+                                   for i, name in enumerate(CATEGORIES)], query)
+            if path == 'hardware':
+                category_id = int(query.get('category_id', ['0'])[0])
+                rows = [asset for asset in self.assets.values() if not category_id or asset['category']['id'] == category_id]
+                return self._page(rows, query)
+            if parts[0] == 'hardware' and len(parts) == 3 and parts[1] == 'bytag':
+                asset_id = self.tags.get(parts[2])
+                return (200, self.assets[asset_id]) if asset_id else (404, {'status': 'error'})
+            if parts[0] == 'hardware' and len(parts) == 2 and parts[1].isdigit():
+                asset = self.assets.get(int(parts[1]))
+                return (200, asset) if asset else (404, {'status': 'error'})
+            if path == 'reports/activity':
+                return 200, {'total': 0, 'rows': []}
+        return 404, {'status': 'error', 'messages': 'Unknown endpoint.'}
+
+
+# --- App server ---
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, port, workers, threads):
+    """The command starting the app under the server of this kind, or None when unavailable."""
+    manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+    if kind == 'sync':
+        if find_spec('gunicorn'):
+            return [sys.executable, '-m', 'gunicorn', 'simpleSnipeIT.wsgi:application', '--bind', f'127.0.0.1:{port}',
+                    '--workers', str(workers), '--threads', str(threads), '--log-level', 'warning']
+        return [sys.executable, manage_py, 'runserver', f'127.0.0.1:{port}', '--noreload']
+    if kind == 'async' and find_spec('uvicorn'):
+        return [sys.executable, '-m', 'uvicorn', 'simpleSnipeIT.asgi:application', '--host', '127.0.0.1',
+                '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    return None
+
+
+class AppServer:
+    """The app running in a child process with its own database and cache, pointed at the fake Snipe-IT."""
+
+    def __init__(self, kind, fake_snipeit, workers=2, threads=4):
+        self.kind = kind
+        self.port = _free_port()
+        self.command = server_command(kind, self.port, workers, threads)
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix='loadtest-')
+        self.env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'simpleSnipeIT.settings',
+            'DJANGO_DEBUG': 'False',
+            'DJANGO_ALLOWED_HOSTS': '127.0.0.1',
+            'SNIPEIT_API_URL': fake_snipeit.url,
+            'SNIPEIT_API_TOKEN': 'loadtest',
+            'SNIPEIT_ADMIN_GROUP_ID': str(ADMIN_GROUP_ID),
+            'DATABASE_PATH': os.path.join(self._tmp_dir.name, 'db.sqlite3'),
+            'CACHE_PATH': os.path.join(self._tmp_dir.name, 'cache.sqlite3'),
+            'CACHE_SNAPSHOT_PATH': os.path.join(self._tmp_dir.name, 'cache_snapshot.bin'),
+            'PYTHONUNBUFFERED': '1',
+        }
+        self._process = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout=60):
+        manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+        subprocess.run([sys.executable, manage_py, 'migrate', '--noinput', '-v', '0'], env=self.env, check=True)
+        subprocess.run([sys.executable, manage_py, 'shell', '-v', '0', '-c',
+                        'from userCheckIO.models import AssetCategoryConfiguration as C; '
+                        f'c = C.load(); c.allowed_category_ids = {FEATURED_CATEGORY_IDS}; c.save()'],
+                       env=self.env, check=True)
+        self._process = subprocess.Popen(self.command, env=self.env, cwd=settings.BASE_DIR,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"The {self.kind} server exited with status {self._process.returncode}.")
+            try:
+                if requests.get(f"{self.url}/health/ready/", timeout=2).status_code == 200:
+                    return self
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"The {self.kind} server did not become ready within {timeout}s.")
+
+    def stop(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._tmp_dir.cleanup()
+
+
+# --- Traffic ---
+
+def parse_mix(value):
+    """'index=2,featured=1' -> {'index': 2, 'featured': 1}"""
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown page {name!r}, expected one of {', '.join(DEFAULT_MIX)}.")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class VirtualUser:
+    """A desk agent with its own session, looking up one employee and (un)assigning one asset."""
+
+    def __init__(self, base_url, user_id, asset_tag):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.asset_tag = asset_tag
+        self.session = requests.Session()
+
+    def _form_post(self, path):
+        page = self.session.get(f"{self.base_url}{path}", timeout=30)
+        match = _CSRF_TOKEN.search(page.text)
+        if match is None:
+            return page
+        return self.session.post(f"{self.base_url}{path}", timeout=30, allow_redirects=False,
+                                 data={'csrfmiddlewaretoken': match.group(1), 'asset_tag': self.asset_tag},
+                                 headers={'Referer': f"{self.base_url}{path}"})
+
+    def run(self, page):
+        """Sends the requests of one page; returns the final response."""
+        if page == 'index':
+            return self.session.get(f"{self.base_url}/", timeout=30)
+        if page == 'user_assets':
+            return self.session.get(f"{self.base_url}/user_assets/", params={'employee_number': f'E{self.user_id}'}, timeout=30)
+        if page == 'assign':
+            return self._form_post(f"/user/{self.user_id}/assign/")
+        if page == 'unassign':
+            return self._form_post(f"/user/{self.user_id}/unassign_by_tag/")
+        return self.session.get(f"{self.base_url}/assets/featured/", timeout=30)
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))]
+
+
+def run_level(base_url, concurrency, duration, mix, user_count):
+    """Runs `concurrency` virtual users for `duration` seconds and returns the level's statistics."""
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    pages, weights = zip(*mix.items())
+
+    def client(index):
+        user_id = index % user_count + 1
+        virtual_user = VirtualUser(base_url, user_id, f'TAG-{user_id:06d}')
+        while time.monotonic() < stop_at:
+            page = random.choices(pages, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = virtual_user.run(page)
+                error = None if response.status_code < 400 else f'HTTP {response.status_code}'
+            except requests.exceptions.RequestException as e:
+                error = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if error:
+                    errors[f'{page}: {error}'] += 1
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'error_rate': sum(errors.values()) / len(latencies) if latencies else 0.0,
+        'errors': dict(errors),
+        'p50': _percentile(latencies, 50),
+        'p95': _percentile(latencies, 95),
+        'p99': _percentile(latencies, 99),
+    }
+
+
+def find_knee(levels):
+    """The last level (see run_level()) worth its concurrency, see the module docstring."""
+    if not levels:
+        return None
+    knee = levels[0]
+    for previous, level in zip(levels, levels[1:]):
+        # A level without any successful request (no p95) is past the knee
+        if previous['p95'] is None or level['p95'] is None:
+            break
+        if level['throughput'] < previous['throughput'] * (1 + KNEE_MIN_GAIN):
+            break
+        if levels[0]['p95'] and level['p95'] > levels[0]['p95'] * KNEE_LATENCY_FACTOR:
+            break
+        knee = level
+    return knee
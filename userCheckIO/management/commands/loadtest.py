@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from userCheckIO import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Starts the app under a real server against a local fake Snipe-IT and replays a mix of "
+            "pages at increasing concurrency, to size the workers and threads of a deployment.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', default='sync,async',
+                            help="Comma-separated servers to compare: sync (gunicorn, or runserver) and async (uvicorn).")
+        parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                            help="Comma-separated numbers of concurrent clients, one level each.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds spent at each level.")
+        parser.add_argument('--latency', type=float, default=50, help="Latency of the fake Snipe-IT, in milliseconds.")
+        parser.add_argument('--jitter', type=float, default=20, help="Random extra latency, up to this many milliseconds.")
+        parser.add_argument('--mix', default=','.join(f'{page}={weight}' for page, weight in loadtest.DEFAULT_MIX.items()),
+                            help="Weights of the pages replayed: index, user_assets, assign, unassign, featured.")
+        parser.add_argument('--workers', type=int, default=2, help="Server worker processes (gunicorn, uvicorn).")
+        parser.add_argument('--threads', type=int, default=4, help="Threads per gunicorn worker.")
+        parser.add_argument('--users', type=int, default=2000, help="Users of the fake Snipe-IT (3 assets each).")
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        fake_snipeit = loadtest.FakeSnipeIT(latency=options['latency'] / 1000, jitter=options['jitter'] / 1000,
+                                            user_count=options['users']).start()
+        knees = {}
+        try:
+            for kind in options['servers'].split(','):
+                server = loadtest.AppServer(kind, fake_snipeit, workers=options['workers'], threads=options['threads'])
+                if server.command is None:
+                    self.stdout.write(self.style.WARNING(f"{kind}: skipped, no server available (install uvicorn)."))
+                    continue
+                self.stdout.write(self.style.MIGRATE_HEADING(f"{kind}: {' '.join(server.command[1:4])}"))
+                try:
+                    server.start()
+                except RuntimeError as e:
+                    raise CommandError(str(e))
+                try:
+                    results = []
+                    self.stdout.write(f"{'clients':>8} {'req/s':>9} {'errors':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+                    for concurrency in levels:
+                        result = loadtest.run_level(server.url, concurrency, options['duration'], mix, options['users'])
+                        results.append(result)
+                        self.stdout.write(
+                            f"{concurrency:>8} {result['throughput']:>9.1f} {result['error_rate']:>8.1%} "
+                            f"{(result['p50'] or 0) * 1000:>9.0f} {(result['p95'] or 0) * 1000:>9.0f} {(result['p99'] or 0) * 1000:>9.0f}")
+                        for error, count in sorted(result['errors'].items()):
+                            self.stdout.write(self.style.ERROR(f"{'':>8} {count} x {error}"))
+                finally:
+                    server.stop()
+                knees[kind] = loadtest.find_knee(results)
+        finally:
+            fake_snipeit.stop()
+
+        for kind, knee in knees.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{kind}: knee at {knee['concurrency']} concurrent clients, {knee['throughput']:.1f} req/s, "
+                f"p95 {(knee['p95'] or 0) * 1000:.0f} ms"))
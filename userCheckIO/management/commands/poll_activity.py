@@ -0,0 +1,32 @@
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from userCheckIO import activity_poller
+
+
+class Command(BaseCommand):
+    help = "Applies the new entries of the Snipe-IT activity report to the cached data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep polling every INTERVAL seconds instead of polling once.")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                summary = activity_poller.poll_once()
+            except requests.exceptions.RequestException as e:
+                raise CommandError(f"Could not read the Snipe-IT activity report: {e}")
+            if summary is None:
+                self.stdout.write(self.style.WARNING("Another process is polling the activity report."))
+            elif summary['resynced']:
+                self.stdout.write(self.style.WARNING(
+                    f"Activity cursor reset after {summary['entries']} entries; the featured hardware will be fully refreshed."))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{summary['entries']} activity entries, {len(summary['applied'])} assets updated."))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
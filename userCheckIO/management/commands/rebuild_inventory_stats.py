@@ -0,0 +1,18 @@
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from userCheckIO import inventory_stats
+
+
+class Command(BaseCommand):
+    help = "Recounts the assets of the inventory statistics dashboard from a full Snipe-IT hardware scan."
+
+    def handle(self, *args, **options):
+        try:
+            payload = inventory_stats.rebuild()
+        except requests.exceptions.RequestException as e:
+            raise CommandError(f"Could not read the hardware from Snipe-IT: {e}")
+        if payload is None:
+            self.stdout.write(self.style.WARNING("Another process is already rebuilding the statistics."))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Inventory statistics count {len(payload['assets'])} assets."))
@@ -0,0 +1,15 @@
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from userCheckIO.search_index import rebuild_from_snipeit
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the local full-text search index (assets and users) from the Snipe-IT API."
+
+    def handle(self, *args, **options):
+        try:
+            asset_count, user_count = rebuild_from_snipeit()
+        except requests.exceptions.RequestException as e:
+            raise CommandError(f"Could not fetch data from Snipe-IT: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt with {asset_count} assets and {user_count} users."))
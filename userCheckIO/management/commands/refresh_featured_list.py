@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from userCheckIO import featured_snapshot
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the featured asset list snapshot from the Snipe-IT API."
+
+    def handle(self, *args, **options):
+        snapshot = featured_snapshot.refresh()
+        if snapshot is None:
+            self.stdout.write(self.style.WARNING("Another process is already refreshing the featured list."))
+            return
+        for error_message in snapshot['errors']:
+            self.stdout.write(self.style.ERROR(error_message))
+        self.stdout.write(self.style.SUCCESS(f"Featured list snapshot holds {snapshot['asset_count']} assets."))
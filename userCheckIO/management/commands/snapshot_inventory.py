@@ -0,0 +1,27 @@
+from datetime import date
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from userCheckIO import inventory_history
+
+
+class Command(BaseCommand):
+    help = "Appends the changes of every asset's assignment, status and category to the inventory history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help="Day of the snapshot (YYYY-MM-DD), today by default.")
+
+    def handle(self, *args, **options):
+        try:
+            summary = inventory_history.take_snapshot(options['date'])
+        except requests.exceptions.RequestException as e:
+            raise CommandError(f"Could not read the hardware from Snipe-IT: {e}")
+        except ValueError as e:
+            raise CommandError(str(e))
+        if summary is None:
+            self.stdout.write(self.style.WARNING("Another process is taking an inventory snapshot."))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Inventory snapshot of {summary['date']}: {summary['changes']} changes for {summary['assets']} assets."))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from userCheckIO import warmup
+
+
+class Command(BaseCommand):
+    help = ("Restores the cached Snipe-IT datasets from the on-disk snapshot, refreshes the stale ones "
+            "from the Snipe-IT API and writes a new snapshot.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Refresh every dataset, even the fresh ones.")
+        parser.add_argument('--no-snapshot', action='store_true', help="Neither read nor write the snapshot file.")
+
+    def handle(self, *args, **options):
+        if not options['no_snapshot']:
+            restored = warmup.load_snapshot()
+            if restored:
+                self.stdout.write(f"Restored from snapshot: {', '.join(restored)}")
+
+        results = warmup.warm_up(force=options['force'], snapshot=not options['no_snapshot'])
+        if not results:
+            self.stdout.write(self.style.WARNING("Another process is already warming up the cache."))
+            return
+        for name, result in results.items():
+            if result == 'ok':
+                self.stdout.write(self.style.SUCCESS(f"{name}: refreshed"))
+            else:
+                self.stdout.write(self.style.ERROR(f"{name}: {result}"))
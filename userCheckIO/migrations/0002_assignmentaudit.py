@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-19 15:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userCheckIO', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssignmentAudit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(verbose_name='Time')),
+                ('action', models.CharField(choices=[('checkout', 'Checkout'), ('checkin', 'Checkin')], max_length=10, verbose_name='Action')),
+                ('operator_name', models.CharField(blank=True, max_length=255, verbose_name='Operator')),
+                ('operator_employee_number', models.CharField(blank=True, max_length=100, verbose_name='Operator employee number')),
+                ('asset_tag', models.CharField(blank=True, max_length=255, verbose_name='Asset tag')),
+                ('asset_id', models.IntegerField(null=True, verbose_name='Asset ID')),
+                ('user_id', models.IntegerField(null=True, verbose_name='User ID')),
+                ('latency_ms', models.PositiveIntegerField(verbose_name='Snipe-IT latency (ms)')),
+                ('result', models.CharField(choices=[('success', 'Success'), ('failed', 'Refused by Snipe-IT'), ('error', 'Network error')], max_length=10, verbose_name='Result')),
+                ('status_code', models.PositiveSmallIntegerField(null=True, verbose_name='HTTP status')),
+                ('message', models.CharField(blank=True, max_length=255, verbose_name='Message')),
+                ('correlation_id', models.CharField(blank=True, max_length=64, verbose_name='Correlation ID')),
+            ],
+            options={
+                'verbose_name': 'Assignment Audit Entry',
+                'verbose_name_plural': 'Assignment Audit Log',
+                'indexes': [models.Index(fields=['created_at'], name='audit_created_at_idx'), models.Index(fields=['asset_tag', 'id'], name='audit_asset_tag_idx'), models.Index(fields=['user_id', 'id'], name='audit_user_id_idx'), models.Index(fields=['operator_employee_number', 'id'], name='audit_operator_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 
 class AssetCategoryConfiguration(models.Model):
@@ -52,6 +52,9 @@ class AssetCategoryConfiguration(models.Model):
         """
         self.pk = 1
         super().save(*args, **kwargs)
+        # Rebuild the featured asset list snapshot for the new categories once saved
+        from .featured_snapshot import refresh_in_background
+        transaction.on_commit(refresh_in_background)
 
     @classmethod
     def load(cls): # Alias for convenience and clearer intent in views
@@ -60,6 +63,49 @@ class AssetCategoryConfiguration(models.Model):
         """
         return cls.get_solo()
 
+class AssignmentAudit(models.Model):
+    """
+    One checkout or checkin attempted with this app. Rows are buffered in memory and written in
+    batches by a background thread, see audit_log.py.
+    """
+    ACTION_CHOICES = [
+        ('checkout', _('Checkout')),
+        ('checkin', _('Checkin')),
+    ]
+    RESULT_CHOICES = [
+        ('success', _('Success')),
+        ('failed', _('Refused by Snipe-IT')),
+        ('error', _('Network error')),
+    ]
+
+    created_at = models.DateTimeField(verbose_name=_('Time'))
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name=_('Action'))
+    operator_name = models.CharField(max_length=255, blank=True, verbose_name=_('Operator'))
+    operator_employee_number = models.CharField(max_length=100, blank=True, verbose_name=_('Operator employee number'))
+    asset_tag = models.CharField(max_length=255, blank=True, verbose_name=_('Asset tag'))
+    asset_id = models.IntegerField(null=True, verbose_name=_('Asset ID'))
+    user_id = models.IntegerField(null=True, verbose_name=_('User ID'))
+    latency_ms = models.PositiveIntegerField(verbose_name=_('Snipe-IT latency (ms)'))
+    result = models.CharField(max_length=10, choices=RESULT_CHOICES, verbose_name=_('Result'))
+    status_code = models.PositiveSmallIntegerField(null=True, verbose_name=_('HTTP status'))
+    message = models.CharField(max_length=255, blank=True, verbose_name=_('Message'))
+    correlation_id = models.CharField(max_length=64, blank=True, verbose_name=_('Correlation ID'))
+
+    class Meta:
+        verbose_name = _('Assignment Audit Entry')
+        verbose_name_plural = _('Assignment Audit Log')
+        # The audit page lists the newest entries first (by id), optionally for one tag, user or operator
+        indexes = [
+            models.Index(fields=['created_at'], name='audit_created_at_idx'),
+            models.Index(fields=['asset_tag', 'id'], name='audit_asset_tag_idx'),
+            models.Index(fields=['user_id', 'id'], name='audit_user_id_idx'),
+            models.Index(fields=['operator_employee_number', 'id'], name='audit_operator_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_action_display()} of {self.asset_tag or self.asset_id} ({self.result})"
+
+
 # Example of how this might be used in a view (conceptual):
 # from .models import AssetCategoryConfiguration
 # config = AssetCategoryConfiguration.load()
@@ -0,0 +1,97 @@
+"""
+Speculative prefetch of a user's asset page while the employee number is being typed.
+
+user_asset_view only starts its chain of Snipe-IT calls (user search, the user's assets, the
+categories of the filter) once the form is submitted. The index page sends a hint to /prefetch/
+as soon as the number looks complete (PREFETCH['min_length'] characters and a pause in typing,
+or the field losing focus). The hint is answered at once; a thread of the worker then warms the
+caches the page reads:
+
+* the user lookup (snipeit_cache.cache_user()),
+* the user's asset list (snipeit_cache.get_user_assets()),
+* the categories of the filter dropdown (snipeit_cache.get_categories()),
+* the rendered asset cards (row_cache.py).
+
+When the form is submitted the page is served from these caches. The calls run with the
+interactive priority (see scheduler.py): a desk scan is about to wait for them. A number is
+prefetched at most once every PREFETCH['dedupe_seconds'] across the workers, and at most
+PREFETCH['max_in_flight'] prefetches run at once per worker, the others are dropped: a hint
+is never worth queueing.
+
+A submit arriving while the prefetch of the same number runs in the same worker waits for it
+(at most PREFETCH['wait'] seconds) rather than making the same calls again.
+"""
+import logging
+import threading
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import snipeit_cache
+
+logger = logging.getLogger(__name__)
+
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def looks_complete(employee_number):
+    return len(employee_number) >= settings.PREFETCH['min_length']
+
+
+def _lock_key(employee_number):
+    return f"prefetch:{quote(employee_number.casefold(), safe='')}"
+
+
+def warm(employee_number):
+    """Fills the caches read by user_asset_view for this employee. Returns the user, or None."""
+    from .views import _render_asset_cards, get_user_by_employee_number
+    user = get_user_by_employee_number(employee_number)
+    if not user or 'id' not in user:
+        return None
+    assets = snipeit_cache.get_user_assets(user['id'], origin=user.get('origin'))
+    _render_asset_cards(user, assets)
+    snipeit_cache.get_categories()
+    return user
+
+
+def _run(employee_number, done):
+    try:
+        warm(employee_number)
+    except requests.exceptions.RequestException as e:
+        logger.info("Prefetch of employee %s failed: %s", employee_number, e)
+    except Exception:
+        logger.exception("Prefetch of employee %s failed.", employee_number)
+    finally:
+        with _lock:
+            _in_flight.pop(employee_number, None)
+        done.set()
+
+
+def start(employee_number):
+    """Starts prefetching in a thread of the worker. Returns False when the hint was dropped."""
+    if not looks_complete(employee_number):
+        return False
+    # The slot is taken with the check, so that concurrent hints cannot exceed max_in_flight
+    with _lock:
+        if employee_number in _in_flight or len(_in_flight) >= settings.PREFETCH['max_in_flight']:
+            return False
+        done = _in_flight[employee_number] = threading.Event()
+    # Once per number across the workers
+    if not cache.add(_lock_key(employee_number), True, timeout=settings.PREFETCH['dedupe_seconds']):
+        with _lock:
+            _in_flight.pop(employee_number, None)
+        done.set()
+        return False
+    threading.Thread(target=_run, args=(employee_number, done), name='prefetch', daemon=True).start()
+    return True
+
+
+def wait(employee_number):
+    """Waits for the prefetch of this employee number running in this worker, if any."""
+    with _lock:
+        done = _in_flight.get(employee_number)
+    if done is not None:
+        done.wait(settings.PREFETCH['wait'])
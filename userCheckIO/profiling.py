@@ -0,0 +1,250 @@
+"""
+Per-view profiling of sampled requests, to find the hot spots of the views in production.
+
+ProfilingMiddleware profiles a request when:
+
+* a random draw falls under PROFILING['sample_rate'] (0 disables sampling), or
+* an admin session asks for it, with an `X-Profile: 1` header or a `?profile=1` query flag.
+
+A profiled request writes one file to PROFILING['directory'], named after the view:
+
+* 'pstats': a cProfile dump, to open with `python -m pstats <file>` or snakeviz,
+* 'collapsed': the stacks of the request thread sampled every PROFILING['interval'] seconds,
+  one "frame;frame;frame count" line per stack, to feed flamegraph.pl or speedscope.
+
+Only one cProfile profiler can be active in a process (since Python 3.12 it fails to start
+while another one runs): a request profiled while another thread of the worker is already
+under cProfile is sampled instead, and written in the 'collapsed' format.
+
+The time spent in a few known hot spots is also measured on its own: the HTTP calls made with
+requests, JSON decoding (json_decoding.py, and the stdlib json.loads() behind response.json()),
+get_nested_value() and template rendering. It is taken from the
+cumulative time of these functions (pstats), or from the share of samples going through them
+(collapsed). Only the request thread is profiled: the calls made by the fan-out and hedging
+threads show up as waiting time, and the body of a streamed response, produced after the view
+returned, is not part of the profile.
+
+The last PROFILING['keep'] profiles are listed, slowest first, on the admin page /profiles/.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'profiles:recent'
+INDEX_LOCK_KEY = 'lock:profiles:recent'
+INDEX_LOCK_TIMEOUT = 5
+
+# name -> ((source file suffix, function name), ...) of the functions timed on their own
+CATEGORIES = {
+    'requests': ((os.path.join('requests', 'sessions.py'), 'request'),),
+    'json': (
+        (os.path.join('userCheckIO', 'json_decoding.py'), 'decode'),
+        (os.path.join('userCheckIO', 'json_decoding.py'), 'loads'),
+        (os.path.join('userCheckIO', 'json_decoding.py'), 'parse_page'),
+        # response.json() and the stdlib fallback of json_decoding.loads()
+        (os.path.join('json', '__init__.py'), 'loads'),
+    ),
+    'get_nested_value': ((os.path.join('userCheckIO', 'utils.py'), 'get_nested_value'),),
+    # The template backend's render(), the entry point of render() and render_to_string()
+    'templates': ((os.path.join('django', 'template', 'backends', 'django.py'), 'render'),),
+}
+
+_UNSAFE_FILENAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# Held while a request of this process runs under cProfile
+_cprofile_lock = threading.Lock()
+
+
+def _matches(filename, function_name, category):
+    return any(function_name == name and filename.endswith(suffix) for suffix, name in CATEGORIES[category])
+
+
+def category_times_from_stats(stats):
+    """{category: seconds} from a pstats.Stats, using the cumulative time of each function."""
+    times = dict.fromkeys(CATEGORIES, 0.0)
+    for (filename, _, function_name), (_, _, _, cumulative, callers) in stats.stats.items():
+        for category in CATEGORIES:
+            if _matches(filename, function_name, category):
+                # Only count the outermost calls: a nested render (or json.loads() called by
+                # json_decoding.loads()) is part of its caller's time
+                if not any(_matches(caller[0], caller[2], category) for caller in callers):
+                    times[category] += cumulative
+    return times
+
+
+class StackSampler:
+    """Samples the stack of one thread every `interval` seconds, from a helper thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def collapsed(self):
+        """The samples in the collapsed stack format."""
+        lines = []
+        for stack, count in self.stacks.most_common():
+            frames = ';'.join(f"{os.path.basename(filename)}:{name}" for filename, name in stack)
+            lines.append(f"{frames} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def category_times(self):
+        times = dict.fromkeys(CATEGORIES, 0.0)
+        for stack, count in self.stacks.items():
+            for category in CATEGORIES:
+                if any(_matches(filename, name, category) for filename, name in stack):
+                    times[category] += count * self.interval
+        return times
+
+
+def should_profile(request):
+    config = settings.PROFILING
+    if request.session.get('is_admin') and (request.headers.get('X-Profile') == '1'
+                                            or request.GET.get('profile') == '1'):
+        return True
+    return config['sample_rate'] > 0 and random.random() < config['sample_rate']
+
+
+def _lock_index():
+    give_up_at = time.monotonic() + INDEX_LOCK_TIMEOUT
+    while not cache.add(INDEX_LOCK_KEY, os.getpid(), timeout=INDEX_LOCK_TIMEOUT):
+        if time.monotonic() >= give_up_at:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def record(entry):
+    """
+    Adds a profile to the index of recent profiles, dropping the files of the oldest ones.
+    Returns False when the index stayed locked by other workers (the profile is not listed).
+    """
+    # Workers record concurrently: the read-modify-write of the index is done under a lock
+    if not _lock_index():
+        logger.warning("Could not list the profile %s, the profile index is locked.", entry['file'])
+        return False
+    try:
+        entries = cache.get(INDEX_KEY, []) + [entry]
+        dropped, entries = entries[:-settings.PROFILING['keep']], entries[-settings.PROFILING['keep']:]
+        cache.set(INDEX_KEY, entries, timeout=None)
+    finally:
+        cache.delete(INDEX_LOCK_KEY)
+    for old_entry in dropped:
+        try:
+            os.remove(os.path.join(settings.PROFILING['directory'], old_entry['file']))
+        except OSError:
+            pass
+    return True
+
+
+def _start_cprofile():
+    """A started cProfile profiler, or None when one is already active in this process."""
+    if not _cprofile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool (e.g. a debugger) holds the process-wide profiler
+        _cprofile_lock.release()
+        return None
+    return profiler
+
+
+def slowest_profiles(limit=50):
+    return sorted(cache.get(INDEX_KEY, []), key=lambda entry: entry['duration'], reverse=True)[:limit]
+
+
+def profile_path(file_name):
+    """The path of a listed profile file, or None for any other name."""
+    if file_name not in {entry['file'] for entry in cache.get(INDEX_KEY, [])}:
+        return None
+    return os.path.join(settings.PROFILING['directory'], file_name)
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request):
+            return self.get_response(request)
+
+        config = settings.PROFILING
+        started = time.perf_counter()
+        profiler = _start_cprofile() if config['format'] != 'collapsed' else None
+        if profiler is None:
+            sampler = StackSampler(threading.get_ident(), config['interval'])
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+            content, category_times = sampler.collapsed(), sampler.category_times()
+        else:
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+                _cprofile_lock.release()
+                profiler.create_stats()
+            stats = pstats.Stats(profiler)
+            content, category_times = None, category_times_from_stats(stats)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view_name = (match.view_name if match else None) or 'unresolved'
+        extension = 'collapsed' if content is not None else 'prof'
+        file_name = f"{_UNSAFE_FILENAME.sub('_', view_name)}-{time.time_ns()}.{extension}"
+        os.makedirs(config['directory'], exist_ok=True)
+        path = os.path.join(config['directory'], file_name)
+        if content is not None:
+            with open(path, 'w') as profile_file:
+                profile_file.write(content)
+        else:
+            stats.dump_stats(path)
+
+        record({
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration': duration,
+            'categories': category_times,
+            'file': file_name,
+            'created_at': time.time(),
+        })
+        return response
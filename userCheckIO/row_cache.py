@@ -0,0 +1,73 @@
+"""
+Row-level fragment cache for the asset tables and card lists.
+
+Each asset row (a <tr> of the featured list, a card of a user's asset page) is rendered from a
+one-row template and stored in the shared cache under a key made of:
+
+* the asset id, its Snipe-IT `updated_at` (any edit, checkout or checkin changes it) and the
+  instance it comes from,
+* a digest of the row template's source, so a deploy changing the template drops its rows,
+* a `variant` string for whatever else the row depends on (display properties, the user whose
+  page shows the card).
+
+Rendering N rows is then one get_many() on the cache, the template only runs for the rows that
+changed, and the new rows are stored with one set_many(). Rows are shared by all the workers,
+requests and users. Assets without an `updated_at` are rendered every time.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from .utils import get_nested_value
+
+counters = {'hits': 0, 'misses': 0}
+
+
+def _template_digest(template):
+    return hashlib.sha1(template.template.source.encode()).hexdigest()[:12]
+
+
+def row_key(template_digest, variant, asset):
+    """The cache key of an asset's row, or None when the asset cannot be cached."""
+    asset_id = asset.get('id')
+    updated_at = get_nested_value(asset, 'updated_at.datetime')
+    if asset_id is None or not updated_at:
+        return None
+    # Asset ids are only unique within a Snipe-IT instance (see backends.py)
+    origin = asset.get('origin', '')
+    version = hashlib.sha1(f'{template_digest}|{variant}|{origin}|{updated_at}'.encode()).hexdigest()[:16]
+    return f'row:{asset_id}:{version}'
+
+
+def render_rows(template_name, assets, context=None, variant='', row_of=None):
+    """
+    Renders `template_name` once per raw Snipe-IT asset, with the asset's row as `asset` (plus
+    `context`), reusing the cached rows. Returns the concatenated HTML, marked safe.
+
+    row_of(asset) turns the raw asset into what the template expects; it is only called for the
+    rows that are rendered.
+    """
+    template = get_template(template_name)
+    template_digest = _template_digest(template)
+    keys = [row_key(template_digest, variant, asset) for asset in assets]
+    cached = cache.get_many([key for key in keys if key])
+
+    fragments = []
+    new_rows = {}
+    for asset, key in zip(assets, keys):
+        fragment = cached.get(key) if key else None
+        if fragment is None:
+            row = row_of(asset) if row_of else asset
+            fragment = template.render({**(context or {}), 'asset': row})
+            if key:
+                new_rows[key] = fragment
+            counters['misses'] += 1
+        else:
+            counters['hits'] += 1
+        fragments.append(fragment)
+    if new_rows:
+        cache.set_many(new_rows, timeout=settings.ROW_FRAGMENT_CACHE_TIMEOUT)
+    return mark_safe(''.join(fragments))
@@ -0,0 +1,121 @@
+"""
+Priority scheduling of the outbound calls to Snipe-IT.
+
+Every call goes through a gate with two classes of work, each with its own concurrency limit
+(SNIPEIT_SCHEDULER, per worker process):
+
+* interactive: everything done while handling a request (desk scans, checkouts, user pages);
+  this is the default,
+* background: cache refreshes, warm-up, activity polling, token re-checks... Code runs as
+  background work inside `with background():` or in a function decorated with
+  @background_job; the parallel calls of backends.fan_out() inherit it.
+
+Interactive calls only wait for other interactive calls, never for background ones: they have
+their own slots. A background call only starts when a background slot is free and no
+interactive call is waiting, so background work never delays a desk scan, and at most
+SNIPEIT_SCHEDULER['background'] connections of each pool are used by it.
+
+An interactive call waits at most for what is left of its request deadline (see deadline.py)
+and then fails with DeadlineExceeded, like a call that timed out.
+"""
+import contextlib
+import contextvars
+import functools
+import threading
+
+from django.conf import settings
+
+from . import deadline
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_priority = contextvars.ContextVar('snipeit_priority', default=INTERACTIVE)
+
+
+class PriorityGate:
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self.in_flight = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._condition = threading.Condition()
+
+    def _can_start(self, priority):
+        if self.in_flight[priority] >= self.limits[priority]:
+            return False
+        return priority == INTERACTIVE or not self.waiting[INTERACTIVE]
+
+    def acquire(self, priority, timeout=None):
+        """Waits for a slot of this class; returns False if none was free within `timeout`."""
+        with self._condition:
+            self.waiting[priority] += 1
+            try:
+                if not self._condition.wait_for(lambda: self._can_start(priority), timeout=timeout):
+                    return False
+                self.in_flight[priority] += 1
+                return True
+            finally:
+                self.waiting[priority] -= 1
+                # A background call may start now that this one stopped waiting
+                self._condition.notify_all()
+
+    def release(self, priority):
+        with self._condition:
+            self.in_flight[priority] -= 1
+            self._condition.notify_all()
+
+
+_gate = None
+_gate_lock = threading.Lock()
+
+
+def get_gate():
+    global _gate
+    with _gate_lock:
+        if _gate is None or _gate.limits != settings.SNIPEIT_SCHEDULER:
+            _gate = PriorityGate(settings.SNIPEIT_SCHEDULER)
+        return _gate
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def background():
+    """Runs the calls made in the block as background work."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def background_job(function):
+    """Decorator running a function (a thread target, a job) as background work."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with background():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@contextlib.contextmanager
+def slot():
+    """Holds a slot of the current priority class for the duration of the block."""
+    priority = _priority.get()
+    request_deadline = deadline.current() if priority == INTERACTIVE else None
+    gate = get_gate()
+    if not gate.acquire(priority, timeout=request_deadline.remaining() if request_deadline else None):
+        raise deadline.DeadlineExceeded(f"No Snipe-IT call slot was free before the request deadline of {request_deadline.budget}s.")
+    try:
+        yield
+    finally:
+        gate.release(priority)
+
+
+def call(function, *args, **kwargs):
+    """function(*args, **kwargs) (e.g. requests.post) in a slot of the current priority class."""
+    with slot():
+        return function(*args, **kwargs)
@@ -0,0 +1,248 @@
+"""
+Local full-text search index over the Snipe-IT assets and users.
+
+The index is a small SQLite database using FTS5 with prefix indexes, so typeahead lookups
+("LAP-00", "jean", "1234") are answered locally in a few milliseconds instead of calling
+/users?search= or /hardware?search= on Snipe-IT for every keystroke.
+It is populated from Snipe-IT data (see rebuild_from_snipeit() and the
+`rebuild_search_index` management command) and kept up to date:
+
+* row by row by the asset events of the webhook and the activity poller (apply_asset(), called
+  by cache_events.py),
+* from the cached datasets after they are refreshed (update_from_cached_datasets(), called by
+  the warm-up, the featured list refresh and the batch report): the users are replaced by those
+  of the user directory and the featured hardware rows are upserted. Each dataset is only read
+  again when its version changed.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from .utils import get_nested_value
+from . import backends, snipeit_api, snipeit_cache
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS asset_fts USING fts5(
+    asset_tag, serial, name, model, asset_id UNINDEXED, prefix='2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS user_fts USING fts5(
+    name, username, employee_num, user_id UNINDEXED, prefix='2 3'
+);
+CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# FTS5's unicode61 tokenizer splits on anything that is not a letter or a digit (underscore included).
+_TERM_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def _match_expression(query):
+    """
+    Turns free text typed by a user into a safe FTS5 MATCH expression where every term is a prefix.
+    "lap 00" -> '"lap"* "00"*'. Returns '' if the query has no searchable term.
+    """
+    return ' '.join(f'"{term}"*' for term in _TERM_RE.findall(query))
+
+
+def _asset_record(asset):
+    return (
+        asset.get('asset_tag') or '',
+        asset.get('serial') or '',
+        asset.get('name') or '',
+        get_nested_value(asset, 'model.name') or '',
+        asset.get('id'),
+    )
+
+
+def _user_record(user):
+    return (
+        user.get('name') or '',
+        user.get('username') or '',
+        # The list endpoint calls it employee_num, the detail endpoint employee_number
+        user.get('employee_num') or user.get('employee_number') or '',
+        user.get('id'),
+    )
+
+
+class SearchIndex:
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections must not be shared between threads, keep one per thread.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def replace_all(self, assets, users):
+        """
+        Replaces the whole index content in a single transaction.
+        Readers keep seeing the previous content until the commit (WAL mode).
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM asset_fts')
+            conn.execute('DELETE FROM user_fts')
+            conn.executemany('INSERT INTO asset_fts VALUES (?, ?, ?, ?, ?)',
+                             (_asset_record(a) for a in assets if a.get('id') is not None))
+            conn.executemany('INSERT INTO user_fts VALUES (?, ?, ?, ?)',
+                             (_user_record(u) for u in users if u.get('id') is not None))
+            conn.execute("INSERT OR REPLACE INTO index_meta VALUES ('built_at', ?)", (str(time.time()),))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def upsert_assets(self, assets):
+        """Inserts or replaces the given asset rows, matched by id."""
+        records = [_asset_record(a) for a in assets if a.get('id') is not None]
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('DELETE FROM asset_fts WHERE asset_id = ?', ((r[-1],) for r in records))
+            conn.executemany('INSERT INTO asset_fts VALUES (?, ?, ?, ?, ?)', records)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def replace_users(self, users):
+        """Replaces all the users of the index in a single transaction."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM user_fts')
+            conn.executemany('INSERT INTO user_fts VALUES (?, ?, ?, ?)',
+                             (_user_record(u) for u in users if u.get('id') is not None))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def upsert_users(self, users):
+        """Inserts or replaces the given user rows, matched by id."""
+        records = [_user_record(u) for u in users if u.get('id') is not None]
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('DELETE FROM user_fts WHERE user_id = ?', ((r[-1],) for r in records))
+            conn.executemany('INSERT INTO user_fts VALUES (?, ?, ?, ?)', records)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def remove_asset(self, asset_id):
+        self._connection().execute('DELETE FROM asset_fts WHERE asset_id = ?', (asset_id,))
+
+    def search(self, query, limit=10):
+        """
+        Prefix search over assets (tag, serial, name, model) and users (name, username, employee number).
+        Returns {'assets': [...], 'users': [...]}, each list ordered by relevance.
+        """
+        expression = _match_expression(query)
+        if not expression:
+            return {'assets': [], 'users': []}
+        conn = self._connection()
+        assets = [
+            {'id': row[4], 'asset_tag': row[0], 'serial': row[1], 'name': row[2], 'model': row[3]}
+            for row in conn.execute(
+                'SELECT asset_tag, serial, name, model, asset_id FROM asset_fts '
+                'WHERE asset_fts MATCH ? ORDER BY rank LIMIT ?', (expression, limit))
+        ]
+        users = [
+            {'id': row[3], 'name': row[0], 'username': row[1], 'employee_num': row[2]}
+            for row in conn.execute(
+                'SELECT name, username, employee_num, user_id FROM user_fts '
+                'WHERE user_fts MATCH ? ORDER BY rank LIMIT ?', (expression, limit))
+        ]
+        return {'assets': assets, 'users': users}
+
+    def built_at(self):
+        """Returns the timestamp of the last full rebuild, or None if the index was never built."""
+        row = self._connection().execute("SELECT value FROM index_meta WHERE key = 'built_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def get_meta(self, key):
+        row = self._connection().execute('SELECT value FROM index_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self._connection().execute('INSERT OR REPLACE INTO index_meta VALUES (?, ?)', (key, str(value)))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """Returns the process-wide SearchIndex stored at settings.SEARCH_INDEX_PATH."""
+    global _index
+    with _index_lock:
+        if _index is None or _index.path != str(settings.SEARCH_INDEX_PATH):
+            _index = SearchIndex(settings.SEARCH_INDEX_PATH)
+        return _index
+
+
+def apply_asset(asset_id, asset, index=None):
+    """
+    Indexes the new hardware row of an asset, or removes it when asset is None (deleted).
+    Returns False when the index could not be written (the next full rebuild fixes it).
+    """
+    index = index or get_search_index()
+    try:
+        if asset is None:
+            index.remove_asset(asset_id)
+        else:
+            index.upsert_assets([{**asset, 'id': asset_id}])
+    except sqlite3.Error as e:
+        logger.warning("Could not update asset %s in the search index: %s", asset_id, e)
+        return False
+    return True
+
+
+def update_from_cached_datasets(index=None):
+    """
+    Indexes the user directory and the featured hardware rows of the shared cache, if they changed
+    since they were last indexed. Never calls Snipe-IT. Returns the names of the datasets indexed.
+    """
+    index = index or get_search_index()
+    updated = []
+    try:
+        for name in ('users', 'featured_hardware'):
+            payload, pointer = snipeit_cache.get_dataset(name)
+            if payload is None or index.get_meta(f'{name}_version') == str(pointer['version']):
+                continue
+            if name == 'users':
+                index.replace_users(payload.values())
+            elif 'store' in payload:
+                # Only the primary instance's ids are indexed (see backends.py)
+                index.upsert_assets(asset for asset in payload['store'] if backends.is_primary(asset))
+            index.set_meta(f'{name}_version', pointer['version'])
+            updated.append(name)
+    except sqlite3.Error as e:
+        logger.warning("Could not update the search index from the cached datasets: %s", e)
+    return updated
+
+
+def rebuild_from_snipeit(index=None):
+    """
+    Fetches every asset and user from Snipe-IT and rebuilds the index with them.
+    Returns a (asset_count, user_count) tuple.
+    """
+    index = index or get_search_index()
+    assets = list(snipeit_api.iter_rows('hardware'))
+    users = list(snipeit_api.iter_rows('users'))
+    index.replace_all(assets, users)
+    return len(assets), len(users)
@@ -0,0 +1,146 @@
+"""
+Session engine backed by the shared cache, with write-behind persistence to the database.
+
+The app keeps its whole state in request.session (snipeit_authenticated, is_admin,
+admin_granting_employee_info). With the default database engine every modified session is an
+UPDATE on SQLite, taking the database write lock during the request. This engine:
+
+* reads and writes sessions in the shared cache (settings.CACHES, see cache_backends.py),
+* only marks the session as modified when a value actually changes, so re-assigning the same
+  value (e.g. is_admin on every employee lookup) does not trigger a save at all,
+* persists saved sessions to the django_session table from a background thread, every
+  SESSION_WRITE_BEHIND_INTERVAL seconds, as one bulk upsert.
+
+Enable it with SESSION_ENGINE = 'userCheckIO.session_backend'. Setting
+SESSION_WRITE_BEHIND_INTERVAL to None (or 0) writes the database synchronously (like cached_db).
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.db import DatabaseError, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Pending session writes, keyed by session key (last write wins), flushed in one transaction.
+    A pending value of None means the session must be deleted from the database.
+    """
+
+    def __init__(self, interval, start_thread=True):
+        self.interval = interval
+        self.start_thread = start_thread
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork: start one per worker process.
+        # Without a positive interval the queue is only flushed explicitly.
+        if not self.start_thread or self.interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        self._thread = threading.Thread(target=self._run, name='session-write-behind', daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def put(self, session_key, session_data, expire_date):
+        with self._lock:
+            self._pending[session_key] = (session_data, expire_date)
+            self._ensure_thread()
+
+    def delete(self, session_key):
+        with self._lock:
+            self._pending[session_key] = None
+            self._ensure_thread()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self, model):
+        """Writes all pending sessions to the database. Returns the number of sessions written or deleted."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        deletes = [session_key for session_key, value in pending.items() if value is None]
+        writes = [
+            model(session_key=session_key, session_data=value[0], expire_date=value[1])
+            for session_key, value in pending.items() if value is not None
+        ]
+        try:
+            with transaction.atomic():
+                if deletes:
+                    model.objects.filter(session_key__in=deletes).delete()
+                if writes:
+                    model.objects.bulk_create(writes, update_conflicts=True, unique_fields=['session_key'],
+                                              update_fields=['session_data', 'expire_date'])
+        except DatabaseError:
+            logger.exception("Could not persist %d sessions, they will be retried.", len(pending))
+            with self._lock:
+                # Keep the newer value if the session was saved again in the meantime
+                for session_key, value in pending.items():
+                    self._pending.setdefault(session_key, value)
+            return 0
+        return len(pending)
+
+    def _run(self):
+        model = SessionStore.get_model_class()
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            self.flush(model)
+
+
+def _synchronous():
+    interval = settings.SESSION_WRITE_BEHIND_INTERVAL
+    return interval is None or interval <= 0
+
+
+write_behind_queue = WriteBehindQueue(settings.SESSION_WRITE_BEHIND_INTERVAL or 0)
+atexit.register(lambda: write_behind_queue.flush(SessionStore.get_model_class()))
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = 'userCheckIO.session_backend'
+
+    def __setitem__(self, key, value):
+        # Dirty tracking: assigning the value a key already holds does not modify the session.
+        if key in self._session and self._session[key] == value:
+            return
+        super().__setitem__(key, value)
+
+    def save(self, must_create=False):
+        if _synchronous():
+            return super().save(must_create)
+        if self.session_key is None:
+            return self.create()
+
+        data = self._get_session(no_load=must_create)
+        if must_create:
+            # cache.add() is atomic across workers: it fails if the key is already taken.
+            if not self._cache.add(self.cache_key, data, self.get_expiry_age()):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+        write_behind_queue.put(self.session_key, self.encode(data), self.get_expiry_date())
+
+    def delete(self, session_key=None):
+        if _synchronous():
+            return super().delete(session_key)
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.delete(self.cache_key_prefix + session_key)
+        write_behind_queue.delete(session_key)
@@ -0,0 +1,45 @@
+from django.conf import settings
+
+from . import deadline, hedging, json_decoding
+
+
+def api_headers(json_body=False):
+    """
+    Returns the headers used to authenticate against the Snipe-IT API with the configured token.
+    Pass json_body=True for POST/PATCH requests sending a JSON payload.
+    """
+    headers = {
+        "Authorization": f"Bearer {settings.SNIPEIT_API_TOKEN}",
+        "Accept": "application/json",
+    }
+    if json_body:
+        headers["Content-Type"] = "application/json"
+    return headers
+
+
+def iter_rows(endpoint, params=None, page_size=500, timeout=30):
+    """
+    Yields every row of a paginated Snipe-IT list endpoint (e.g. "hardware", "users", "categories").
+
+    Pages are requested with limit/offset until the 'total' reported by Snipe-IT is reached.
+    Network errors and non-2xx responses are raised as requests.exceptions.RequestException,
+    it is up to the caller (usually a background job or a management command) to handle them.
+
+    Args:
+        endpoint (str): Endpoint path relative to SNIPEIT_API_URL, without leading slash.
+        params (dict): Extra query parameters (filters, sort...).
+        page_size (int): Number of rows requested per page.
+        timeout (int|float): Timeout in seconds for each page request.
+    """
+    offset = 0
+    while True:
+        page_params = {**(params or {}), 'limit': page_size, 'offset': offset}
+        response = hedging.get(f"{settings.SNIPEIT_API_URL}{endpoint}", headers=api_headers(),
+                                params=page_params, timeout=deadline.timeout(timeout))
+        response.raise_for_status()
+        data = json_decoding.decode(response)
+        rows = data.get('rows', [])
+        yield from rows
+        offset += len(rows)
+        if not rows or offset >= (data.get('total') or 0):
+            break
@@ -0,0 +1,314 @@
+"""
+Cached access to the Snipe-IT data used by the views: categories, the user directory,
+asset tag resolution and the per-user asset lists.
+
+Everything goes through Django's default cache, which is configured (settings.CACHES) as the
+SQLite backend shared by all the workers of the host, so a value fetched by one worker serves
+every worker.
+
+Large datasets (categories, user directory) are stored as versioned entries:
+    dataset:<name>            -> {'version': ..., 'refreshed_at': ...}   (small pointer)
+    dataset:<name>:<version>  -> payload
+A refresh writes the new payload under a new version, then swaps the pointer in one write, so
+readers see either the old or the new dataset, never a partial one. Each process keeps the
+decoded payload of the version it last read and only reads the pointer while the version is
+unchanged, so the payload is not copied out of the cache on every request. A cache.add() lock
+makes sure only one worker refreshes a given dataset at a time; the others keep serving the
+previous version meanwhile. Patches (update_dataset()) and publications take a second, short
+lock, waited for rather than skipped, so concurrent patches are applied one after the other.
+
+Functions fetching from Snipe-IT raise requests.exceptions.RequestException on failure.
+"""
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import backends, deadline, json_decoding, snipeit_api
+from .asset_store import AssetStore
+
+# Locks are released explicitly; the timeout only protects against a worker dying mid-refresh.
+REFRESH_LOCK_TIMEOUT = 300
+# Patches and publications of a dataset are serialized by a short lock (see update_dataset());
+# a writer waits for it at most this long, the time a dead holder's lock takes to expire.
+PATCH_LOCK_TIMEOUT = 10
+PATCH_LOCK_POLL = 0.01
+
+_local_datasets = {}  # name -> (version, payload), decoded payloads of this process
+_local_datasets_lock = threading.Lock()
+
+
+def _timeout(name):
+    return settings.SNIPEIT_CACHE_TIMEOUTS[name]
+
+
+def _key_part(value):
+    # Employee numbers and asset tags are user input: keep cache keys free of spaces/control chars.
+    return quote(str(value).casefold(), safe='')
+
+
+# --- Versioned datasets ---
+
+def _acquire_patch_lock(name):
+    """Waits for the patch lock of a dataset; False when it could not be taken in PATCH_LOCK_TIMEOUT seconds."""
+    lock_key = f'patch:dataset:{name}'
+    give_up_at = time.monotonic() + PATCH_LOCK_TIMEOUT
+    while not cache.add(lock_key, os.getpid(), timeout=PATCH_LOCK_TIMEOUT):
+        if time.monotonic() >= give_up_at:
+            return False
+        time.sleep(PATCH_LOCK_POLL)
+    return True
+
+
+def _release_patch_lock(name):
+    cache.delete(f'patch:dataset:{name}')
+
+
+def publish_dataset(name, payload, refreshed_at=None):
+    """
+    Stores a new version of a dataset and atomically makes it the current one.
+    refreshed_at defaults to now; pass the original fetch time when restoring older data
+    (e.g. from the on-disk snapshot) so that it is still revalidated on schedule.
+    """
+    # Not in the middle of a patch: it would publish its version over this one
+    locked = _acquire_patch_lock(name)
+    try:
+        return _publish(name, payload, refreshed_at)
+    finally:
+        if locked:
+            _release_patch_lock(name)
+
+
+def _publish(name, payload, refreshed_at=None):
+    version = time.time_ns()
+    pointer_key = f'dataset:{name}'
+    previous = cache.get(pointer_key)
+    cache.set(f'dataset:{name}:{version}', payload, timeout=None)
+    cache.set(pointer_key, {'version': version, 'refreshed_at': refreshed_at or time.time()}, timeout=None)
+    if previous:
+        cache.delete(f"dataset:{name}:{previous['version']}")
+    with _local_datasets_lock:
+        _local_datasets[name] = (version, payload)
+    return version
+
+
+def get_dataset(name):
+    """
+    Returns (payload, pointer) for the current version of a dataset, or (None, None) if it was
+    never published. pointer is {'version': ..., 'refreshed_at': ...}.
+    """
+    pointer = cache.get(f'dataset:{name}')
+    if pointer is None:
+        return None, None
+    local = _local_datasets.get(name)
+    if local is not None and local[0] == pointer['version']:
+        return local[1], pointer
+    payload = cache.get(f"dataset:{name}:{pointer['version']}")
+    if payload is None:
+        # The pointer moved between the two reads; read the newer version.
+        pointer = cache.get(f'dataset:{name}')
+        if pointer is None:
+            return None, None
+        payload = cache.get(f"dataset:{name}:{pointer['version']}")
+        if payload is None:
+            return None, None
+    with _local_datasets_lock:
+        _local_datasets[name] = (pointer['version'], payload)
+    return payload, pointer
+
+
+def get_dataset_pointer(name):
+    """Returns {'version': ..., 'refreshed_at': ...} for the current version of a dataset, without reading it."""
+    return cache.get(f'dataset:{name}')
+
+
+def invalidate_dataset(name):
+    """Marks a dataset as stale so that the next read refreshes it."""
+    pointer = cache.get(f'dataset:{name}')
+    if pointer is not None:
+        cache.set(f'dataset:{name}', {**pointer, 'refreshed_at': 0}, timeout=None)
+
+
+def get_or_refresh_dataset(name, loader, max_age):
+    """
+    Returns the current payload of a dataset, refreshing it with loader() when it is older than
+    max_age seconds. While another worker holds the refresh lock, or if the refresh fails, the
+    previous version is returned. Only raises when there is no previous version to fall back on.
+    """
+    payload, pointer = get_dataset(name)
+    if payload is not None and time.time() - pointer['refreshed_at'] < max_age:
+        return payload
+
+    lock_key = f'lock:dataset:{name}'
+    got_lock = cache.add(lock_key, os.getpid(), timeout=REFRESH_LOCK_TIMEOUT)
+    if payload is not None and not got_lock:
+        return payload
+    changed_key = f'changed:dataset:{name}'
+    cache.delete(changed_key)
+    try:
+        new_payload = loader()
+    except requests.exceptions.RequestException:
+        if payload is not None:
+            return payload
+        raise
+    finally:
+        if got_lock:
+            cache.delete(lock_key)
+    publish_dataset(name, new_payload)
+    if cache.get(changed_key):
+        # Snipe-IT data changed during the refresh (see update_dataset()): refresh again next time
+        invalidate_dataset(name)
+    return new_payload
+
+
+def update_dataset(name, update):
+    """
+    Replaces the current payload of a dataset by update(payload), keeping its refresh time, so a
+    patched dataset is still fully refreshed on schedule. update() must not modify the payload in
+    place (other threads may be reading it) and may return None when there is nothing to change.
+    Concurrent patches wait for each other. If a refresh is running, the version that refresh is
+    about to publish is also marked stale (it may have read Snipe-IT before the change).
+    Returns True when the dataset was patched.
+    """
+    if cache.get(f'lock:dataset:{name}') is not None:
+        cache.set(f'changed:dataset:{name}', True, timeout=REFRESH_LOCK_TIMEOUT)
+    if not _acquire_patch_lock(name):
+        # The change cannot be applied: have the dataset refreshed rather than lose it
+        invalidate_dataset(name)
+        return False
+    try:
+        payload, pointer = get_dataset(name)
+        if payload is None:
+            return False
+        new_payload = update(payload)
+        if new_payload is None:
+            return False
+        _publish(name, new_payload, refreshed_at=pointer['refreshed_at'])
+        return True
+    finally:
+        _release_patch_lock(name)
+
+
+# --- Categories ---
+
+def load_categories():
+    return list(snipeit_api.iter_rows('categories', params={'sort': 'name', 'order': 'asc'}))
+
+
+def get_categories():
+    """All Snipe-IT categories, sorted by name."""
+    return get_or_refresh_dataset('categories', load_categories, _timeout('categories'))
+
+
+def get_cached_categories():
+    """The categories last fetched, however old, or [] if never fetched. Never calls Snipe-IT."""
+    payload, _ = get_dataset('categories')
+    return payload or []
+
+
+# --- User directory ---
+
+def load_user_directory():
+    """Fetches every user and returns them indexed by casefolded employee number."""
+    directory = {}
+    for user in snipeit_api.iter_rows('users'):
+        employee_number = user.get('employee_num')
+        if employee_number:
+            directory.setdefault(str(employee_number).casefold(), user)
+    return directory
+
+
+def refresh_user_directory():
+    """Reloads the whole user directory. Meant for background jobs, not for request handling."""
+    return get_or_refresh_dataset('users', load_user_directory, max_age=0)
+
+
+def get_cached_user(employee_number):
+    """
+    Returns the cached Snipe-IT user with this exact employee number, or None on a miss.
+    Looks in the user directory dataset (when it was loaded by a background refresh) and
+    in the per-user entries cached by previous lookups. Never calls Snipe-IT.
+    """
+    directory, pointer = get_dataset('users')
+    if directory is not None and time.time() - pointer['refreshed_at'] < _timeout('users'):
+        user = directory.get(str(employee_number).casefold())
+        if user is not None and user.get('employee_num') == employee_number:
+            return user
+    # The key is casefolded: it may hold the user of a number differing only by case
+    user = cache.get(f'user:employee:{_key_part(employee_number)}')
+    if user is not None and (user.get('employee_num') or user.get('employee_number')) == employee_number:
+        return user
+    return None
+
+
+def cache_user(user):
+    employee_number = user.get('employee_num') or user.get('employee_number')
+    if employee_number:
+        cache.set(f'user:employee:{_key_part(employee_number)}', user, timeout=_timeout('users'))
+
+
+# --- Featured hardware ---
+
+def get_cached_featured_hardware(category_ids):
+    """
+    Returns the cached hardware rows of the featured categories (an AssetStore), or None when they
+    are missing, stale, or were fetched for another set of categories. Never calls Snipe-IT.
+    """
+    payload, pointer = get_dataset('featured_hardware')
+    if payload is None or time.time() - pointer['refreshed_at'] >= _timeout('featured_hardware'):
+        return None
+    if payload['category_ids'] != [int(category_id) for category_id in category_ids]:
+        return None
+    return payload['store']
+
+
+def cache_featured_hardware(category_ids, rows):
+    """Caches the hardware rows of the featured categories, reduced to the columns the list displays."""
+    store = AssetStore.from_rows(rows, extra_paths=[prop['path'] for prop in settings.NEW_ASSET_LIST_DISPLAY_PROPERTIES])
+    publish_dataset('featured_hardware', {'category_ids': [int(category_id) for category_id in category_ids], 'store': store})
+
+
+# --- Asset tag resolution ---
+
+def get_cached_asset_id_for_tag(asset_tag):
+    return cache.get(f'tag:{_key_part(asset_tag)}')
+
+
+def cache_asset_id_for_tag(asset_tag, asset_id):
+    cache.set(f'tag:{_key_part(asset_tag)}', asset_id, timeout=_timeout('tags'))
+
+
+def invalidate_asset_tag(asset_tag):
+    cache.delete(f'tag:{_key_part(asset_tag)}')
+
+
+# --- Per-user asset lists ---
+
+def get_user_assets(user_id, timeout=10, origin=None):
+    """
+    Returns the rows of /users/{id}/assets, from the cache when possible. origin is the backend
+    of the user (see backends.py), None for the primary one.
+    """
+    backend = backends.get_backend(origin)
+    if backend is backends.primary():
+        key = f'user_assets:{int(user_id)}'
+    else:
+        # User ids are only unique within a Snipe-IT instance
+        key = f'user_assets:{_key_part(backend.name)}:{int(user_id)}'
+    assets = cache.get(key)
+    if assets is None:
+        response = backend.get(f"users/{int(user_id)}/assets", timeout=deadline.timeout(timeout))
+        response.raise_for_status()
+        assets = backends.tag(json_decoding.decode(response).get('rows', []), backend)
+        cache.set(key, assets, timeout=_timeout('user_assets'))
+    return assets
+
+
+def invalidate_user_assets(user_id):
+    """Drops the cached asset list of a user, e.g. after a checkout or a checkin."""
+    if user_id is not None:
+        cache.delete(f'user_assets:{int(user_id)}')
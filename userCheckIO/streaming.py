@@ -0,0 +1,52 @@
+from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Placeholder rendered where the streamed rows go. It is split out of the rendered page,
+# so it never reaches the browser.
+STREAM_PLACEHOLDER = '<!--stream-rows-placeholder-->'
+
+
+def chunked(items, size):
+    """
+    Yields successive lists of at most `size` items from an iterable.
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def render_streaming(request, template_name, context, fragments):
+    """
+    Renders `template_name` as a StreamingHttpResponse.
+
+    The page is rendered once with `streaming=True` and a `stream_placeholder` variable in
+    the context. Everything before the placeholder (base layout, headings, table head) is
+    sent immediately, then each HTML string from `fragments` is sent as it is produced,
+    and finally the rest of the page.
+
+    Args:
+        request: The current HttpRequest (used for csrf, messages, session, ...).
+        template_name (str): The full page template. It must output `{{ stream_placeholder }}`
+                             exactly once when `streaming` is true.
+        context (dict): The template context for the page itself.
+        fragments (iterable): An iterable (usually a generator) of already rendered HTML strings.
+
+    Returns:
+        StreamingHttpResponse
+    """
+    page_context = {**context, 'streaming': True, 'stream_placeholder': mark_safe(STREAM_PLACEHOLDER)}
+    page_html = render_to_string(template_name, page_context, request)
+    head, tail = page_html.split(STREAM_PLACEHOLDER, 1)
+
+    def generate():
+        yield head
+        yield from fragments
+        yield tail
+
+    return StreamingHttpResponse(generate(), content_type='text/html; charset=utf-8')
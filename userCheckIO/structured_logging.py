@@ -0,0 +1,215 @@
+"""
+Structured, non-blocking logging of the app's errors.
+
+The error paths used to print() from the request threads, with the whole body of Snipe-IT's
+response (often a large HTML error page). During an outage every request did so, and the
+writes to stdout added to the slowdown. Now:
+
+* the app logs through the 'userCheckIO' logger, whose QueueHandler only puts the records in a
+  bounded in-memory queue; a background thread formats them as JSON lines and writes them.
+  When the queue is full (the writer cannot keep up), records are dropped and counted instead of
+  blocking the request,
+* every record carries the correlation id of its request (CorrelationIdMiddleware: the incoming
+  X-Request-ID header, or a new id), also sent back in the X-Request-ID response header; work
+  done outside a request logs '-',
+* response bodies are only logged through body_excerpt(): truncated to
+  LOG_BODIES['max_length'] characters, and at most LOG_BODIES['per_minute'] of them per process
+  and minute, the others are replaced by their size,
+* under an error storm, a message logged more than `burst` times in `window` seconds is sampled:
+  only one record in `sample_every` is kept, with the number of records dropped since the last
+  one kept ('suppressed').
+
+The handlers, filters and their limits are set in LOGGING (simpleSnipeIT/settings.py).
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+NO_CORRELATION_ID = '-'
+
+_correlation_id = contextvars.ContextVar('correlation_id', default=NO_CORRELATION_ID)
+
+# Attributes of every LogRecord: the others were passed with extra= and are logged as fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def correlation_id():
+    return _correlation_id.get()
+
+
+class CorrelationIdMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Only accept a sane id from the client, it ends up in the logs
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        request_id = incoming if 0 < len(incoming) <= 64 and incoming.isprintable() else uuid.uuid4().hex
+        token = _correlation_id.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            _correlation_id.reset(token)
+        response[REQUEST_ID_HEADER] = request_id
+        return response
+
+
+class CorrelationIdFilter(logging.Filter):
+    """Adds the correlation id of the current request to the record."""
+
+    def filter(self, record):
+        if not hasattr(record, 'correlation_id'):
+            record.correlation_id = _correlation_id.get()
+        return True
+
+
+class StormSampler(logging.Filter):
+    """
+    Keeps the first `burst` records of a message in each `window` seconds, then one in
+    `sample_every`. A message is identified by its logger and format string.
+    """
+
+    def __init__(self, burst=20, window=10, sample_every=50):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.sample_every = sample_every
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            count += 1
+            keep = count <= self.burst or (count - self.burst) % self.sample_every == 0
+            self._windows[key] = (started, count, 0 if keep else suppressed + 1)
+            if len(self._windows) > 1000:
+                # Forget the messages of the windows that are over
+                self._windows = {k: v for k, v in self._windows.items() if now - v[0] < self.window}
+        if keep and suppressed:
+            record.suppressed = suppressed
+        return keep
+
+
+class BodyBudget:
+    """At most `per_minute` response bodies logged per minute."""
+
+    def __init__(self):
+        self._minute = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def take(self, per_minute):
+        minute = int(time.monotonic() // 60)
+        with self._lock:
+            if minute != self._minute:
+                self._minute, self._count = minute, 0
+            if self._count >= per_minute:
+                return False
+            self._count += 1
+            return True
+
+
+_body_budget = BodyBudget()
+
+
+def truncate(text, max_length=None):
+    max_length = settings.LOG_BODIES['max_length'] if max_length is None else max_length
+    if len(text) <= max_length:
+        return text
+    return f"{text[:max_length]}... [{len(text) - max_length} more characters]"
+
+
+def body_excerpt(response):
+    """The body of a response, as logged: truncated, or only its size past the rate limit."""
+    if not _body_budget.take(settings.LOG_BODIES['per_minute']):
+        return f"[body not logged, {len(response.content)} bytes]"
+    return truncate(response.text)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the fields passed in extra=."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', NO_CORRELATION_ID),
+        }
+        entry.update((name, value) for name, value in vars(record).items() if name not in _RECORD_ATTRIBUTES)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _Writer(QueueListener):
+
+    def enqueue_sentinel(self):
+        # Waits for room in a full queue: the records already queued are written before stopping
+        self.queue.put(self._sentinel)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Puts the records in a bounded queue, written by a background thread to the handler of
+    `target` (a stream handler on stderr by default) with JsonFormatter.
+    """
+
+    def __init__(self, max_size=10000, target=None):
+        super().__init__(queue.Queue(maxsize=max_size))
+        self.dropped = 0
+        self.target = target or logging.StreamHandler()
+        self.target.setFormatter(JsonFormatter())
+        self.listener = _Writer(self.queue, self.target, respect_handler_level=True)
+        self.listener.start()
+        self.writing = True
+        atexit.register(self.close)
+
+    def prepare(self, record):
+        # The message and the traceback are resolved in the logging thread: the record's args
+        # and traceback objects may change or go away before the writer thread formats it
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Waits for the records already queued to be written."""
+        if self.writing:
+            self.queue.join()
+        self.target.flush()
+
+    def stop_writing(self):
+        if self.writing:
+            self.writing = False
+            self.listener.stop()
+
+    def close(self):
+        self.stop_writing()
+        super().close()
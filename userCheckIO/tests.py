@@ -1,9 +1,36 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.http import HttpResponse
 from django.urls import reverse
 from django.conf import settings
+from django.apps import apps as django_apps
 from unittest.mock import patch, MagicMock
+import cProfile
+import io
+import json
+import logging
+import os
+import pickle
+import pstats
+import tempfile
+import threading
+import time
+from datetime import date
 import requests
 
+from .models import AssetCategoryConfiguration, AssignmentAudit
+from .search_index import SearchIndex
+from .facets import FacetIndex, bitmap_from_positions, iter_positions
+from .asset_store import AssetStore
+from .apps import serves_requests
+from . import activity_poller, audit_log, backends, batch_report, cache_events, deadline, featured_snapshot, hedging, inventory_history, inventory_stats, loadtest, prefetch, profiling, row_cache, scheduler, search_index, snipeit_cache, structured_logging, token_health, warmup, json_decoding
+from .views import get_user_by_employee_number
+from .session_backend import SessionStore, WriteBehindQueue
+from django.contrib.sessions.models import Session
+from django.db import DatabaseError
+from django.utils import timezone
+
 class UserAuthTests(TestCase):
 
     def setUp(self):
@@ -120,3 +147,1611 @@ class UserAuthTests(TestCase):
         self.assertNotContains(response, "View Assets")
         self.assertNotContains(response, "Logout")
         self.assertContains(response, "Login")
+
+
+def _mock_response(status_code=200, json_data=None, text=''):
+    mock_response = MagicMock()
+    mock_response.status_code = status_code
+    mock_response.json.return_value = json_data if json_data is not None else {}
+    mock_response.text = text
+    # The body, for the code decoding it with json_decoding rather than response.json()
+    mock_response.content = json.dumps(mock_response.json.return_value).encode()
+    mock_response.iter_content.side_effect = lambda chunk_size=1, decode_unicode=False: iter([mock_response.content])
+    return mock_response
+
+
+class SharedCacheTestMixin:
+    """
+    Points the default cache and the search index to throw-away SQLite files for the duration
+    of each test, and writes sessions, audit entries and statistics changes synchronously.
+    """
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache_settings = override_settings(CACHES={'default': {
+            'BACKEND': 'userCheckIO.cache_backends.SQLiteCache',
+            'LOCATION': os.path.join(tmp_dir.name, 'cache.sqlite3'),
+        }}, SESSION_WRITE_BEHIND_INTERVAL=None, AUDIT_LOG={'flush_interval': None, 'max_pending': 10000},
+        INVENTORY_STATS={'flush_interval': None, 'fold_after': 20},
+        SEARCH_INDEX_PATH=os.path.join(tmp_dir.name, 'search_index.sqlite3'))
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        snipeit_cache._local_datasets.clear()
+
+
+class FeaturedAssetListSnapshotTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.featured_url = reverse('featured_asset_list')
+        config = AssetCategoryConfiguration.load()
+        config.allowed_category_ids = [3, 4]
+        config.save()
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_view_serves_snapshot_without_calling_snipeit(self, mock_requests_get):
+        mock_requests_get.side_effect = [
+            _mock_response(json_data={'total': 1, 'rows': [{'id': 1, 'name': 'Laptop One', 'category': {'id': 3, 'name': 'Laptops'}}]}),
+            _mock_response(json_data={'total': 1, 'rows': [{'id': 2, 'name': 'Phone Two', 'category': {'id': 4, 'name': 'Phones'}}]}),
+        ]
+        featured_snapshot.refresh()
+        mock_requests_get.reset_mock()
+
+        for _ in range(3):
+            response = self.client.get(self.featured_url)
+
+        mock_requests_get.assert_not_called()
+        self.assertContains(response, 'Laptop One')
+        self.assertContains(response, 'Phone Two')
+        self.assertContains(response, 'Last refreshed:')
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_failed_refresh_keeps_previous_rows_and_reports_errors(self, mock_requests_get):
+        mock_requests_get.side_effect = [
+            _mock_response(json_data={'total': 1, 'rows': [{'id': 1, 'name': 'Laptop One'}]}),
+            _mock_response(json_data={'total': 0, 'rows': []}),
+            _mock_response(status_code=500, text='Server Error'),
+            _mock_response(json_data={'total': 0, 'rows': []}),
+        ]
+        featured_snapshot.refresh()
+        with patch.object(featured_snapshot, 'RETRY_AFTER', 0):
+            featured_snapshot.refresh()
+
+        with patch('userCheckIO.featured_snapshot.refresh_in_background') as mock_refresh_in_background:
+            response = self.client.get(self.featured_url)
+
+        self.assertContains(response, 'Laptop One')
+        self.assertContains(response, 'Failed to fetch assets for category ID 3')
+        # The snapshot stays stale so that the next view retries the refresh
+        mock_refresh_in_background.assert_called_once()
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_pages_are_followed_until_total(self, mock_requests_get):
+        mock_requests_get.side_effect = [
+            _mock_response(json_data={'total': 2, 'rows': [{'id': 1, 'name': 'First Page Asset'}]}),
+            _mock_response(json_data={'total': 2, 'rows': [{'id': 2, 'name': 'Second Page Asset'}]}),
+            _mock_response(json_data={'total': 0, 'rows': []}),
+        ]
+
+        snapshot = featured_snapshot.refresh()
+
+        self.assertEqual(snapshot['asset_count'], 2)
+        self.assertIn('Second Page Asset', snapshot['rows_html'])
+        self.assertIn('offset=1', mock_requests_get.call_args_list[1].args[0])
+
+    @patch('userCheckIO.featured_snapshot.refresh_in_background')
+    def test_missing_snapshot_is_built_in_background(self, mock_refresh_in_background):
+        response = self.client.get(self.featured_url)
+
+        self.assertContains(response, 'The featured asset list is being prepared.')
+        mock_refresh_in_background.assert_called_once()
+
+    def test_asset_event_rerenders_snapshot_from_cached_rows(self):
+        rows = [{'id': 1, 'name': 'Laptop One', 'category': {'id': 3, 'name': 'Laptops'}, 'assigned_to': None}]
+        snipeit_cache.cache_featured_hardware([3, 4], rows)
+        snipeit_cache.publish_dataset('featured_list', featured_snapshot.build_snapshot([3, 4], rows))
+
+        cache_events.apply_event(cache_events.parse_event({'event': 'checkout', 'asset': {
+            'id': 1, 'name': 'Laptop One', 'category': {'id': 3, 'name': 'Laptops'},
+            'assigned_to': {'id': 7, 'type': 'user', 'name': 'Jean Dupont'},
+        }}))
+
+        snapshot, _ = featured_snapshot.get_snapshot([3, 4])
+        self.assertIn('Jean Dupont', snapshot['rows_html'])
+
+
+class RowFragmentCacheTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        for name in row_cache.counters:
+            row_cache.counters[name] = 0
+        self.assets = [
+            {'id': 1, 'name': 'Laptop One', 'category': {'id': 3, 'name': 'Laptops'},
+             'updated_at': {'datetime': '2024-06-01 10:00:00'}},
+            {'id': 2, 'name': 'Phone Two', 'category': {'id': 4, 'name': 'Phones'},
+             'updated_at': {'datetime': '2024-06-01 11:00:00'}},
+        ]
+
+    def test_only_changed_rows_are_rendered_again(self):
+        first_html = featured_snapshot.render_rows(self.assets)
+        self.assertEqual(row_cache.counters, {'hits': 0, 'misses': 2})
+
+        self.assertEqual(featured_snapshot.render_rows(self.assets), first_html)
+        self.assertEqual(row_cache.counters, {'hits': 2, 'misses': 2})
+
+        self.assets[1] = {**self.assets[1], 'name': 'Phone Renamed', 'updated_at': {'datetime': '2024-06-02 09:00:00'}}
+        html = featured_snapshot.render_rows(self.assets)
+        self.assertEqual(row_cache.counters, {'hits': 3, 'misses': 3})
+        self.assertIn('Laptop One', html)
+        self.assertIn('Phone Renamed', html)
+        self.assertNotIn('Phone Two', html)
+
+    def test_variant_and_missing_updated_at_are_not_shared(self):
+        featured_snapshot.render_rows(self.assets)
+        with override_settings(NEW_ASSET_LIST_DISPLAY_PROPERTIES=[{'label': 'Serial', 'path': 'serial'}]):
+            featured_snapshot.render_rows(self.assets)
+        self.assertEqual(row_cache.counters['misses'], 4)
+
+        asset_without_date = {'id': 5, 'name': 'Dock'}
+        row_cache.render_rows('partials/asset_card.html', [asset_without_date], context={'user': {'id': 7}})
+        row_cache.render_rows('partials/asset_card.html', [asset_without_date], context={'user': {'id': 7}})
+        self.assertEqual(row_cache.counters['misses'], 6)
+
+    @patch('userCheckIO.views.snipeit_cache.get_cached_categories', return_value=[])
+    @patch('userCheckIO.views.snipeit_cache.get_categories', return_value=[])
+    @patch('userCheckIO.views.snipeit_cache.get_user_assets')
+    @patch('userCheckIO.views.get_user_by_employee_number')
+    def test_user_asset_page_reuses_cached_cards(self, mock_get_user, mock_get_user_assets, *_):
+        mock_get_user.return_value = {'id': 7, 'name': 'Test User', 'username': 'tuser', 'employee_num': '123'}
+        mock_get_user_assets.return_value = self.assets
+
+        for _ in range(2):
+            response = Client().get(reverse('user_asset_view'), {'employee_number': '123'})
+
+        self.assertContains(response, 'Phone Two')
+        self.assertContains(response, reverse('unassign_asset_by_tag', kwargs={'user_id': 7}))
+        self.assertEqual(row_cache.counters, {'hits': 2, 'misses': 2})
+
+
+@override_settings(ASSET_LIST_STREAM_CHUNK_SIZE=1)
+@patch('userCheckIO.views.snipeit_cache.get_categories', return_value=[{'id': 3, 'name': 'Laptops'}])
+@patch('userCheckIO.views.get_user_by_employee_number',
+       return_value={'id': 7, 'name': 'Test User', 'username': 'tuser', 'employee_num': '123'})
+class UserAssetStreamingTests(SharedCacheTestMixin, TestCase):
+
+    def _stream(self, **params):
+        response = self.client.get(reverse('user_asset_view'), {'employee_number': '123', 'stream': '1', **params})
+        self.assertTrue(response.streaming)
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        self.assertIn('</html>', chunks[-1])
+        return chunks
+
+    @patch('userCheckIO.views.snipeit_cache.get_user_assets')
+    def test_cards_follow_the_page_head(self, mock_get_user_assets, *_):
+        mock_get_user_assets.return_value = [
+            {'id': 1, 'name': 'Laptop One', 'category': {'id': 3, 'name': 'Laptops'}},
+            {'id': 2, 'name': 'Phone Two', 'category': {'id': 4, 'name': 'Phones'}},
+        ]
+        chunks = self._stream()
+        # The head with the category filter, one chunk per card, then the rest of the page
+        self.assertIn('Filter by Category', chunks[0])
+        self.assertNotIn('Laptop One', chunks[0])
+        self.assertEqual([('Laptop One' in chunk, 'Phone Two' in chunk) for chunk in chunks[1:3]], [(True, False), (False, True)])
+        self.assertIn(reverse('unassign_asset_by_tag', kwargs={'user_id': 7}), chunks[1])
+
+        content = ''.join(self._stream(category_id='4'))
+        self.assertNotIn('Laptop One', content)
+        self.assertIn('Phone Two', content)
+        self.assertIn('No assets currently assigned.', ''.join(self._stream(category_id='9')))
+
+    @patch('userCheckIO.views.snipeit_cache.get_user_assets', side_effect=requests.exceptions.ConnectionError('Snipe-IT is down'))
+    def test_error_after_the_head_is_reported_inline(self, mock_get_user_assets, *_):
+        chunks = self._stream()
+        # The assets are only fetched once the head was sent
+        self.assertIn('Filter by Category', chunks[0])
+        self.assertEqual(len(chunks), 3)
+        self.assertIn('notification is-danger', chunks[1])
+        self.assertIn('Could not retrieve assets from Snipe-IT: Snipe-IT is down', chunks[1])
+        mock_get_user_assets.assert_called_once_with(7, origin=None)
+
+
+class SearchIndexTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.index = SearchIndex(os.path.join(self.tmp_dir.name, 'search.sqlite3'))
+        self.index.replace_all(
+            assets=[
+                {'id': 1, 'asset_tag': 'LAP-0001', 'serial': 'SN123', 'name': 'Laptop Jean', 'model': {'name': 'Latitude 5440'}},
+                {'id': 2, 'asset_tag': 'PHN-0002', 'serial': 'SN999', 'name': 'Phone', 'model': {'name': 'Pixel'}},
+            ],
+            users=[
+                {'id': 10, 'name': 'Jean Dupont', 'username': 'jdupont', 'employee_num': '12345'},
+                {'id': 11, 'name': 'Marie Curie', 'username': 'mcurie', 'employee_num': '67890'},
+            ],
+        )
+
+    def test_prefix_search(self):
+        results = self.index.search('lat')
+        self.assertEqual([a['id'] for a in results['assets']], [1])
+        self.assertEqual(self.index.search('123')['users'][0]['id'], 10)
+        self.assertEqual(self.index.search('LAP-00')['assets'][0]['asset_tag'], 'LAP-0001')
+
+    def test_query_syntax_is_escaped(self):
+        # FTS5 operators and quotes typed by a user must not raise a syntax error
+        self.assertEqual(self.index.search('"jean NEAR(')['users'], [])
+        self.assertEqual(self.index.search('*()'), {'assets': [], 'users': []})
+
+    def test_upsert_replaces_existing_rows(self):
+        self.index.upsert_users([{'id': 11, 'name': 'Marie Sklodowska', 'employee_num': '67890'}])
+        self.assertEqual(self.index.search('curie')['users'], [])
+        self.assertEqual(self.index.search('sklo')['users'][0]['id'], 11)
+
+    @patch('userCheckIO.cache_events.requests.get')
+    def test_follows_asset_events_and_cached_datasets(self, mock_requests_get):
+        index = search_index.get_search_index()
+        mock_requests_get.return_value = _mock_response(json_data={
+            'id': 3, 'asset_tag': 'TAB-0003', 'serial': 'SN3', 'name': 'Tablet', 'model': {'name': 'Galaxy Tab'}})
+        cache_events.apply_event(cache_events.parse_event({'event': 'update', 'asset': {'id': 3}}))
+        self.assertEqual(index.search('galaxy')['assets'][0]['asset_tag'], 'TAB-0003')
+        cache_events.apply_event(cache_events.parse_event({'event': 'delete', 'asset': {'id': 3}}))
+        self.assertEqual(index.search('galaxy')['assets'], [])
+
+        snipeit_cache.publish_dataset('users', {'12345': {'id': 10, 'name': 'Jean Dupont', 'employee_num': '12345'}})
+        snipeit_cache.cache_featured_hardware([3], [{'id': 1, 'asset_tag': 'LAP-0001', 'serial': 'SN123', 'name': 'Laptop'}])
+        self.assertEqual(search_index.update_from_cached_datasets(), ['users', 'featured_hardware'])
+        self.assertEqual(search_index.update_from_cached_datasets(), [])
+        self.assertEqual(index.search('sn12')['assets'][0]['id'], 1)
+        self.assertEqual(index.search('dupont')['users'][0]['id'], 10)
+
+    def test_search_view_requires_authentication(self):
+        response = self.client.get(reverse('search'), {'q': 'jean'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_search_view_returns_json(self):
+        session = self.client.session
+        session['snipeit_authenticated'] = True
+        session.save()
+        with patch('userCheckIO.views.get_search_index', return_value=self.index):
+            response = self.client.get(reverse('search'), {'q': 'jean'})
+        data = response.json()
+        self.assertEqual(data['users'][0]['employee_num'], '12345')
+        self.assertEqual(data['assets'][0]['asset_tag'], 'LAP-0001')
+
+
+class FacetIndexTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.assets = [
+            {'id': 1, 'name': 'A', 'category': {'id': 3, 'name': 'Laptops'}, 'status_label': {'id': 1, 'name': 'Deployed'}, 'model': {'id': 7, 'name': 'X1'}, 'assigned_to': {'id': 10, 'name': 'Jean'}},
+            {'id': 2, 'name': 'B', 'category': {'id': 3, 'name': 'Laptops'}, 'status_label': {'id': 2, 'name': 'Ready'}, 'model': {'id': 7, 'name': 'X1'}, 'assigned_to': None},
+            {'id': 3, 'name': 'C', 'category': {'id': 4, 'name': 'Phones'}, 'status_label': {'id': 2, 'name': 'Ready'}, 'model': {'id': 8, 'name': 'Pixel'}, 'assigned_to': None},
+        ]
+        self.index = FacetIndex(self.assets)
+
+    def test_filters_are_or_within_and_across_facets(self):
+        self.assertEqual([a['id'] for a in self.index.filter({})], [1, 2, 3])
+        self.assertEqual([a['id'] for a in self.index.filter({'category': {'3', '4'}, 'assigned': {'no'}})], [2, 3])
+        self.assertEqual([a['id'] for a in self.index.filter({'category': {'3'}, 'status': {'2'}})], [2])
+        self.assertEqual(self.index.filter({'model': {'999'}}), [])
+
+    def test_facet_counts_ignore_own_selection(self):
+        facets = {facet['key']: facet for facet in self.index.facet_counts({'category': {'3'}})}
+        category_counts = {value['label']: value['count'] for value in facets['category']['values']}
+        self.assertEqual(category_counts, {'Laptops': 2, 'Phones': 1})
+        assigned_counts = {value['key']: value['count'] for value in facets['assigned']['values']}
+        self.assertEqual(assigned_counts, {'yes': 1, 'no': 1})
+
+    def test_bitmap_positions_round_trip(self):
+        positions = [0, 7, 8, 63, 64, 1000]
+        self.assertEqual(list(iter_positions(bitmap_from_positions(positions, 1001))), positions)
+
+    def test_featured_list_applies_facet_filters(self):
+        config = AssetCategoryConfiguration.load()
+        config.allowed_category_ids = [3]
+        config.save()
+        snipeit_cache.cache_featured_hardware([3], self.assets)
+        snipeit_cache.publish_dataset('featured_list', featured_snapshot.build_snapshot([3], self.assets))
+
+        response = self.client.get(reverse('featured_asset_list'), {'assigned': 'no'})
+
+        self.assertEqual([asset['id'] for asset in response.context['assets']], [2, 3])
+        self.assertContains(response, 'Unassigned')
+
+    def test_facet_index_is_built_once_per_version_of_the_rows(self):
+        snipeit_cache.cache_featured_hardware([3], self.assets)
+        with patch('userCheckIO.featured_snapshot.FacetIndex', wraps=FacetIndex) as facet_index_class:
+            first = featured_snapshot.get_facet_index([3])
+            self.assertIs(featured_snapshot.get_facet_index([3]), first)
+            self.assertIsNone(featured_snapshot.get_facet_index([4]))
+            self.assertEqual(facet_index_class.call_count, 1)
+
+            snipeit_cache.cache_featured_hardware([3], self.assets[:2])
+            self.assertEqual(featured_snapshot.get_facet_index([3]).size, 2)
+            self.assertEqual(facet_index_class.call_count, 2)
+
+
+class AssetStoreTests(TestCase):
+
+    def setUp(self):
+        self.rows = [
+            {'id': 5, 'asset_tag': 'LAP-0005', 'name': 'Laptop', 'serial': 'SN5', 'category': {'id': 3, 'name': 'Laptops'},
+             'status_label': {'id': 1, 'name': 'Deployed'}, 'model': {'id': 7, 'name': 'X1'},
+             'assigned_to': {'id': 10, 'name': 'Jean', 'type': 'user', 'employee_number': '12345'},
+             'updated_at': {'datetime': '2024-06-01 10:00:00'}, 'location': {'name': 'HQ'}},
+            {'id': 2, 'asset_tag': 'phn-0002', 'name': 'Phone', 'serial': None, 'category': {'id': 4, 'name': 'Phones'},
+             'status_label': {'id': 2, 'name': 'Ready'}, 'model': {'id': 8, 'name': 'Pixel'}, 'assigned_to': None},
+        ]
+        self.store = AssetStore.from_rows(self.rows, extra_paths=['location.name', 'model.name'])
+
+    def test_lookups_by_id_and_tag(self):
+        self.assertEqual(len(self.store), 2)
+        asset = self.store.get_by_id(5)
+        self.assertEqual(asset['model']['name'], 'X1')
+        self.assertEqual(asset['assigned_to']['employee_number'], '12345')
+        self.assertEqual(asset['location']['name'], 'HQ')
+        self.assertEqual(self.store.get_by_tag('PHN-0002')['id'], 2)
+        self.assertIsNone(self.store.get_by_tag('missing'))
+        self.assertIsNone(self.store.get_by_id(99))
+        self.assertIsNone(self.store.get_by_id(2)['serial'])
+        self.assertIsNone(self.store.get_by_id(2)['assigned_to'])
+
+    def test_duplicate_ids_replace_rows(self):
+        self.store.extend([{**self.rows[1], 'name': 'Phone renamed'}, {'id': 9, 'asset_tag': 'NEW-9'}])
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.get_by_id(2)['name'], 'Phone renamed')
+        self.assertEqual(self.store.get_by_tag('new-9')['id'], 9)
+
+    def test_set_assignment_and_memory_usage(self):
+        self.store.set_assignment(self.store.row_for_id(2), {'id': 11, 'name': 'Marie', 'type': 'user'})
+        self.assertEqual(self.store.get_by_id(2)['assigned_to']['name'], 'Marie')
+        usage = self.store.memory_usage()
+        self.assertGreater(usage['total'], 0)
+        self.assertIn('asset_tag', usage['columns'])
+
+    def test_rows_of_other_instances_and_copies(self):
+        # The same id on another Snipe-IT instance is another asset
+        self.store.extend([{'id': 5, 'asset_tag': 'EU-5', 'origin': 'eu'}])
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.get_by_id(5, 'eu')['asset_tag'], 'EU-5')
+        self.assertNotIn('origin', self.store.get_by_id(5))
+        self.assertEqual([asset['id'] for asset in self.store[1:]], [2, 5])
+        with self.assertRaises(IndexError):
+            self.store[3]
+
+        copy = pickle.loads(pickle.dumps(self.store.copy()))
+        copy.extend([{**self.rows[0], 'name': 'Laptop renamed'}])
+        self.assertEqual((copy.get_by_id(5)['name'], self.store.get_by_id(5)['name']), ('Laptop renamed', 'Laptop'))
+        index = FacetIndex(copy)
+        self.assertIs(index.assets, copy)
+        self.assertEqual([asset['asset_tag'] for asset in index.filter({'category': {'3'}})], ['LAP-0005'])
+
+
+class SQLiteCacheBackendTests(SharedCacheTestMixin, TestCase):
+
+    def test_basic_operations(self):
+        cache.set('key', {'a': 1})
+        self.assertEqual(cache.get('key'), {'a': 1})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.add('new', 'value'))
+        self.assertEqual(cache.get_many(['key', 'new', 'missing']), {'key': {'a': 1}, 'new': 'value'})
+        cache.set('counter', 1)
+        self.assertEqual(cache.incr('counter', 2), 3)
+        self.assertTrue(cache.delete('key'))
+        self.assertIsNone(cache.get('key'))
+
+    def test_expired_entries_are_misses(self):
+        cache.set('key', 'value', timeout=-1)
+        self.assertIsNone(cache.get('key'))
+        self.assertFalse(cache.has_key('key'))
+        self.assertTrue(cache.add('key', 'fresh'))
+        self.assertEqual(cache.get('key'), 'fresh')
+
+
+class SnipeITCacheTests(SharedCacheTestMixin, TestCase):
+
+    def test_dataset_versions_are_swapped(self):
+        first_version = snipeit_cache.publish_dataset('things', [1])
+        second_version = snipeit_cache.publish_dataset('things', [1, 2])
+        self.assertGreater(second_version, first_version)
+        snipeit_cache._local_datasets.clear()
+        payload, pointer = snipeit_cache.get_dataset('things')
+        self.assertEqual(payload, [1, 2])
+        self.assertEqual(pointer['version'], second_version)
+        self.assertIsNone(cache.get(f'dataset:things:{first_version}'))
+
+    def test_concurrent_patches_are_all_applied(self):
+        snipeit_cache.publish_dataset('things', [])
+        cache.add('lock:dataset:things', 'a refresh')  # a refresh running does not drop patches
+
+        def patch_dataset(item):
+            def update(payload):
+                time.sleep(0.02)  # both patches read the dataset before either publishes
+                return payload + [item]
+            self.assertTrue(snipeit_cache.update_dataset('things', update))
+
+        threads = [threading.Thread(target=patch_dataset, args=(item,)) for item in (1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(snipeit_cache.get_dataset('things')[0]), [1, 2])
+        self.assertTrue(cache.get('changed:dataset:things'))
+
+    def test_stale_dataset_is_served_when_refresh_fails(self):
+        snipeit_cache.publish_dataset('categories', [{'id': 1, 'name': 'Old'}])
+        snipeit_cache.invalidate_dataset('categories')
+        with patch('userCheckIO.hedging.requests.get', side_effect=requests.exceptions.ConnectionError('down')):
+            self.assertEqual(snipeit_cache.get_categories(), [{'id': 1, 'name': 'Old'}])
+
+    def test_categories_are_fetched_once(self):
+        with patch('userCheckIO.hedging.requests.get') as mock_requests_get:
+            mock_requests_get.return_value = _mock_response(json_data={'total': 1, 'rows': [{'id': 1, 'name': 'Laptops'}]})
+            snipeit_cache.get_categories()
+            self.assertEqual(snipeit_cache.get_categories(), [{'id': 1, 'name': 'Laptops'}])
+        self.assertEqual(mock_requests_get.call_count, 1)
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_user_lookup_is_cached(self, mock_requests_get):
+        mock_requests_get.return_value = _mock_response(json_data={'rows': [{'id': 10, 'employee_num': 'E 42', 'name': 'Jean'}]})
+        self.assertEqual(get_user_by_employee_number('E 42')['id'], 10)
+        self.assertEqual(get_user_by_employee_number('E 42')['id'], 10)
+        self.assertEqual(mock_requests_get.call_count, 1)
+
+    def test_cached_user_matches_the_exact_employee_number(self):
+        snipeit_cache.cache_user({'id': 10, 'employee_num': 'AB12', 'name': 'Jean'})
+        self.assertEqual(snipeit_cache.get_cached_user('AB12')['id'], 10)
+        self.assertIsNone(snipeit_cache.get_cached_user('ab12'))
+        snipeit_cache.publish_dataset('users', {'ab12': {'id': 10, 'employee_num': 'AB12'}})
+        self.assertIsNone(snipeit_cache.get_cached_user('ab12'))
+
+    def test_user_assets_invalidation(self):
+        with patch('userCheckIO.backends.requests.Session.get') as mock_requests_get:
+            mock_requests_get.return_value = _mock_response(json_data={'rows': [{'id': 1}]})
+            snipeit_cache.get_user_assets(10)
+            snipeit_cache.get_user_assets(10)
+            self.assertEqual(mock_requests_get.call_count, 1)
+            snipeit_cache.invalidate_user_assets(10)
+            snipeit_cache.get_user_assets(10)
+            self.assertEqual(mock_requests_get.call_count, 2)
+
+
+class WriteBehindSessionTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        write_behind_settings = override_settings(SESSION_WRITE_BEHIND_INTERVAL=1)
+        write_behind_settings.enable()
+        self.addCleanup(write_behind_settings.disable)
+        self.queue = WriteBehindQueue(interval=1, start_thread=False)
+        queue_patch = patch('userCheckIO.session_backend.write_behind_queue', self.queue)
+        queue_patch.start()
+        self.addCleanup(queue_patch.stop)
+
+    def test_unchanged_values_do_not_modify_the_session(self):
+        session = SessionStore()
+        session['is_admin'] = False
+        session.save()
+
+        reloaded = SessionStore(session.session_key)
+        reloaded['is_admin'] = False
+        self.assertFalse(reloaded.modified)
+        reloaded['is_admin'] = True
+        self.assertTrue(reloaded.modified)
+
+    def test_sessions_are_persisted_on_flush(self):
+        session = SessionStore()
+        session['snipeit_authenticated'] = True
+        session.save()
+
+        self.assertFalse(Session.objects.filter(session_key=session.session_key).exists())
+        self.assertTrue(SessionStore(session.session_key).get('snipeit_authenticated'))
+
+        self.assertEqual(self.queue.flush(Session), 1)
+        cache.clear()
+        self.assertTrue(SessionStore(session.session_key).get('snipeit_authenticated'))
+
+        session.delete()
+        self.queue.flush(Session)
+        self.assertFalse(Session.objects.filter(session_key=session.session_key).exists())
+
+    def test_zero_interval_writes_synchronously(self):
+        with override_settings(SESSION_WRITE_BEHIND_INTERVAL=0):
+            session = SessionStore()
+            session['snipeit_authenticated'] = True
+            session.save()
+            self.assertTrue(Session.objects.filter(session_key=session.session_key).exists())
+            session.delete()
+            self.assertFalse(Session.objects.filter(session_key=session.session_key).exists())
+        self.assertEqual(len(self.queue), 0)
+        # Nor does a queue without a positive interval start a (busy) flush thread
+        queue = WriteBehindQueue(interval=0)
+        queue.put('key', 'data', None)
+        self.assertIsNone(queue._thread)
+
+
+class AssignmentAuditTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        audit_settings = override_settings(AUDIT_LOG={'flush_interval': 1, 'max_pending': 2})
+        audit_settings.enable()
+        self.addCleanup(audit_settings.disable)
+        self.buffer = audit_log.AuditBuffer(interval=1, max_pending=2, start_thread=False)
+        buffer_patch = patch('userCheckIO.audit_log.audit_buffer', self.buffer)
+        buffer_patch.start()
+        self.addCleanup(buffer_patch.stop)
+        session = self.client.session
+        session['snipeit_authenticated'] = True
+        session['is_admin'] = True
+        session['admin_granting_employee_info'] = {'id': 1, 'name': 'Anna Admin', 'employee_number': 'A1'}
+        session.save()
+
+    def test_zero_flush_interval_writes_synchronously(self):
+        request = RequestFactory().post('/')
+        request.session = self.client.session
+        with override_settings(AUDIT_LOG={'flush_interval': 0, 'max_pending': 2}):
+            audit_log.record(request, audit_log.CHECKIN, 0.1, 'success', 'LAP-1')
+        self.assertEqual((AssignmentAudit.objects.count(), len(self.buffer)), (1, 0))
+        # Nor does a buffer without a positive interval start a (busy) flush thread
+        buffer = audit_log.AuditBuffer(interval=0)
+        buffer.append(AssignmentAudit())
+        self.assertIsNone(buffer._thread)
+
+    @patch('userCheckIO.views.requests.post')
+    @patch('userCheckIO.views.requests.get')
+    def test_checkouts_are_buffered_then_written_in_bulk(self, mock_get, mock_post):
+        snipeit_cache.cache_asset_id_for_tag('LAP-1', 5)
+        mock_get.return_value = _mock_response(json_data={'id': 7, 'name': 'Jean Dupont', 'username': 'jdupont', 'employee_number': 'E1'})
+        mock_post.side_effect = [
+            _mock_response(json_data={'status': 'success'}),
+            _mock_response(json_data={'status': 'error', 'messages': 'Asset already checked out'}),
+            requests.exceptions.ConnectionError('refused'),
+            requests.exceptions.ConnectionError('refused'),
+        ]
+        url = reverse('assign_asset', kwargs={'user_id': 7})
+        for _ in range(3):
+            self.client.post(url, {'asset_tag': 'LAP-1'}, HTTP_X_REQUEST_ID='scan-1')
+
+        # Nothing was written during the requests; the third entry did not fit in the buffer
+        self.assertEqual(AssignmentAudit.objects.count(), 0)
+        self.assertEqual((len(self.buffer), self.buffer.dropped), (2, 1))
+        self.assertEqual(self.buffer.flush(AssignmentAudit), 2)
+
+        first, second = AssignmentAudit.objects.order_by('id')
+        self.assertEqual((first.action, first.result, first.asset_tag, first.asset_id, first.user_id),
+                         ('checkout', 'success', 'LAP-1', 5, 7))
+        self.assertEqual((first.operator_name, first.operator_employee_number, first.correlation_id),
+                         ('Anna Admin', 'A1', 'scan-1'))
+        self.assertEqual((second.result, second.message), ('failed', 'Asset already checked out'))
+
+        self.buffer.max_pending = 10
+        self.client.post(url, {'asset_tag': 'LAP-1'})
+        self.buffer.flush(AssignmentAudit)
+        self.assertEqual(AssignmentAudit.objects.latest('id').result, 'error')
+
+    def test_entries_are_kept_when_the_database_fails(self):
+        entry = AssignmentAudit(created_at=timezone.now(), action='checkin', latency_ms=10, result='success')
+        self.buffer.append(entry)
+        with patch.object(AssignmentAudit.objects, 'bulk_create', side_effect=DatabaseError('locked')):
+            self.assertEqual(self.buffer.flush(AssignmentAudit), 0)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(AssignmentAudit), 1)
+
+    def test_audit_page_filters_and_pages_by_id(self):
+        for number in range(5):
+            AssignmentAudit.objects.create(created_at=timezone.now(), action='checkout', asset_tag=f'LAP-{number % 2}',
+                                           user_id=7, latency_ms=100, result='success')
+        entries, next_before = audit_log.query({'asset_tag': 'LAP-0'}, limit=2)
+        self.assertEqual([entry.asset_tag for entry in entries], ['LAP-0', 'LAP-0'])
+        entries, next_before = audit_log.query({'asset_tag': 'LAP-0'}, before=next_before, limit=2)
+        self.assertEqual((len(entries), next_before), (1, None))
+
+        response = self.client.get(reverse('audit_log'), {'asset_tag': 'LAP-1', 'since': '2000-01-01'})
+        self.assertEqual(len(response.context['entries']), 2)
+        response = self.client.get(reverse('audit_log'), {'user': 'seven'})
+        self.assertEqual(response.context['entries'], [])
+
+        session = self.client.session
+        session['is_admin'] = False
+        session.save()
+        self.assertRedirects(self.client.get(reverse('audit_log')), reverse('index'), fetch_redirect_response=False)
+
+
+class PrefetchTests(SharedCacheTestMixin, TestCase):
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_hint_warms_the_user_asset_page(self, mock_session_get):
+        snipeit_cache.publish_dataset('categories', [{'id': 3, 'name': 'Laptops'}])
+        mock_session_get.side_effect = lambda url, **kwargs: _mock_response(json_data={'rows': (
+            [{'id': 1, 'asset_tag': 'LAP-1', 'name': 'Laptop One', 'category': {'id': 3, 'name': 'Laptops'}}]
+            if url.endswith('/assets') else [{'id': 7, 'employee_num': 'E100', 'name': 'Jean Dupont', 'username': 'jdupont'}])})
+
+        # Only a signed-in kiosk may make the app call Snipe-IT
+        self.assertNotContains(self.client.get(reverse('index')), reverse('prefetch'))
+        self.assertEqual(self.client.post(reverse('prefetch'), {'employee_number': 'E100'}).status_code, 403)
+        session = self.client.session
+        session['snipeit_authenticated'] = True
+        session.save()
+        self.assertContains(self.client.get(reverse('index')), reverse('prefetch'))
+        response = self.client.post(reverse('prefetch'), {'employee_number': ' E100 '})
+        self.assertEqual((response.status_code, response.json()), (202, {'started': True}))
+        prefetch.wait('E100')
+
+        def calls():
+            # Only the calls of this employee: a thread of another test may still be finishing its call
+            return [call.args[0] for call in mock_session_get.call_args_list if 'E100' in call.args[0] or '/users/7/' in call.args[0]]
+        self.assertEqual(len(calls()), 2)
+
+        # The submit is served from the warmed caches
+        response = self.client.get(reverse('user_asset_view'), {'employee_number': 'E100'})
+        self.assertContains(response, 'Laptop One')
+        self.assertEqual(len(calls()), 2)
+
+    @override_settings(PREFETCH={**settings.PREFETCH, 'max_in_flight': 1})
+    def test_hints_are_deduplicated_and_bounded(self):
+        may_finish = threading.Event()
+        self.addCleanup(may_finish.set)
+        with patch.object(prefetch, 'warm', side_effect=lambda employee_number: may_finish.wait(5)):
+            self.assertFalse(prefetch.start('E1'))  # too short to be complete
+            self.assertTrue(prefetch.start('E100'))
+            self.assertFalse(prefetch.start('E100'))
+            self.assertFalse(prefetch.start('E200'))  # one prefetch at a time
+            may_finish.set()
+            prefetch.wait('E100')
+            self.assertFalse(prefetch.start('E100'))  # prefetched a moment ago
+            self.assertTrue(prefetch.start('E200'))
+            prefetch.wait('E200')
+
+    @override_settings(PREFETCH={**settings.PREFETCH, 'max_in_flight': 1})
+    def test_concurrent_hints_stay_within_the_bound(self):
+        may_finish = threading.Event()
+        self.addCleanup(may_finish.set)
+        cache_add = cache.add
+
+        def slow_add(*args, **kwargs):
+            # Widens the window between the check of the bound and the start of a prefetch
+            time.sleep(0.05)
+            return cache_add(*args, **kwargs)
+
+        started = []
+        threads = [threading.Thread(target=lambda number=number: started.append(prefetch.start(number)))
+                   for number in ('E100', 'E200', 'E300')]
+        with patch.object(prefetch, 'warm', side_effect=lambda employee_number: may_finish.wait(5)), \
+                patch.object(cache, 'add', side_effect=slow_add):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(sorted(started), [False, False, True])
+            may_finish.set()
+            for number in ('E100', 'E200', 'E300'):
+                prefetch.wait(number)
+
+
+class TokenHealthTests(SharedCacheTestMixin, TestCase):
+
+    @patch('userCheckIO.token_health.requests.get')
+    def test_logins_share_one_token_check(self, mock_requests_get):
+        mock_requests_get.return_value = _mock_response(status_code=200)
+
+        for _ in range(3):
+            response = self.client.post(reverse('admin_login'))
+            self.assertRedirects(response, reverse('index'), fetch_redirect_response=False)
+
+        self.assertTrue(self.client.session.get('snipeit_authenticated'))
+        self.assertEqual(mock_requests_get.call_count, 1)
+
+    @patch('userCheckIO.token_health.requests.get')
+    def test_failed_check_is_reported(self, mock_requests_get):
+        mock_requests_get.return_value = _mock_response(status_code=401, text='Unauthenticated.')
+
+        response = self.client.post(reverse('admin_login'))
+
+        self.assertFalse(self.client.session.get('snipeit_authenticated'))
+        self.assertContains(response, 'System API token authentication failed. Status: 401')
+
+    @patch('userCheckIO.token_health.requests.get')
+    def test_stale_failure_is_checked_again(self, mock_requests_get):
+        mock_requests_get.side_effect = requests.exceptions.ConnectionError('down')
+        self.assertFalse(token_health.get_token_health()['valid'])
+
+        stale = {**cache.get(token_health.CACHE_KEY), 'checked_at': 0}
+        cache.set(token_health.CACHE_KEY, stale)
+        mock_requests_get.side_effect = None
+        mock_requests_get.return_value = _mock_response(status_code=200)
+        self.assertTrue(token_health.get_token_health()['valid'])
+
+    @patch('userCheckIO.token_health.requests.get')
+    def test_readiness_probe(self, mock_requests_get):
+        mock_requests_get.side_effect = requests.exceptions.ConnectionError('down')
+        response = self.client.get(reverse('readiness'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['snipeit_reachable'], False)
+
+
+class CacheWarmupTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.snapshot_path = os.path.join(tmp_dir.name, 'snapshot.bin')
+
+    def test_snapshot_round_trip_keeps_refresh_time(self):
+        snipeit_cache.publish_dataset('categories', [{'id': 1, 'name': 'Laptops'}], refreshed_at=1000.0)
+        snipeit_cache.publish_dataset('users', {'e100': {'id': 7, 'employee_num': 'E100'}})
+        self.assertEqual(warmup.write_snapshot(self.snapshot_path), ['categories', 'users'])
+
+        cache.clear()
+        snipeit_cache._local_datasets.clear()
+        self.assertEqual(warmup.load_snapshot(self.snapshot_path), ['categories', 'users'])
+
+        payload, pointer = snipeit_cache.get_dataset('categories')
+        self.assertEqual(payload, [{'id': 1, 'name': 'Laptops'}])
+        self.assertEqual(pointer['refreshed_at'], 1000.0)
+        self.assertEqual(snipeit_cache.get_cached_user('E100')['id'], 7)
+        # Nothing newer in the snapshot than in the cache now
+        self.assertEqual(warmup.load_snapshot(self.snapshot_path), [])
+
+    @override_settings(BACKGROUND_JOBS=False, CACHE_WARMUP_ON_STARTUP=True)
+    @patch('userCheckIO.warmup.start_background_warmup')
+    def test_background_jobs_only_start_when_serving(self, mock_start_background_warmup):
+        self.assertFalse(serves_requests(['manage.py', 'migrate']))
+        with patch.dict(os.environ, {'RUN_MAIN': 'true'}):
+            self.assertTrue(serves_requests(['manage.py', 'runserver']))
+        with patch.dict(os.environ):
+            os.environ.pop('RUN_MAIN', None)
+            # The autoreloader only watches the files
+            self.assertFalse(serves_requests(['manage.py', 'runserver']))
+            self.assertTrue(serves_requests(['manage.py', 'runserver', '--noreload']))
+        with override_settings(BACKGROUND_JOBS=True):
+            self.assertTrue(serves_requests(['gunicorn']))
+
+        with patch('userCheckIO.apps.sys.argv', ['manage.py', 'warm_cache']):
+            django_apps.get_app_config('userCheckIO').ready()
+        mock_start_background_warmup.assert_not_called()
+
+    def test_unreadable_snapshot_is_ignored(self):
+        with open(self.snapshot_path, 'wb') as f:
+            f.write(b'not a snapshot')
+        self.assertEqual(warmup.read_snapshot(self.snapshot_path), {})
+        self.assertEqual(warmup.read_snapshot(self.snapshot_path + '.missing'), {})
+
+    @patch('userCheckIO.hedging.requests.get')
+    def test_warm_up_fills_datasets_used_by_featured_list(self, mock_requests_get):
+        # The featured hardware is read through the backend's session, the rest directly
+        session_get = patch('userCheckIO.backends.requests.Session.get', mock_requests_get)
+        session_get.start()
+        self.addCleanup(session_get.stop)
+        config = AssetCategoryConfiguration.load()
+        config.allowed_category_ids = [3]
+        config.save()
+        mock_requests_get.return_value = _mock_response(json_data={'total': 1, 'rows': [
+            {'id': 1, 'name': 'Warm Laptop', 'employee_num': 'E1'},
+        ]})
+
+        with override_settings(CACHE_SNAPSHOT_PATH=self.snapshot_path):
+            results = warmup.warm_up()
+        self.assertEqual(results, {'categories': 'ok', 'users': 'ok', 'featured_hardware': 'ok', 'featured_list': 'ok',
+                                   'inventory_stats': 'ok'})
+        self.assertTrue(os.path.exists(self.snapshot_path))
+
+        mock_requests_get.reset_mock()
+        response = self.client.get(reverse('featured_asset_list'))
+        self.assertContains(response, 'Warm Laptop')
+        mock_requests_get.assert_not_called()
+
+    @patch('userCheckIO.warmup.inventory_stats.refresh')
+    @patch('userCheckIO.warmup.snipeit_cache.get_or_refresh_dataset')
+    @patch('userCheckIO.warmup.featured_snapshot.refresh')
+    def test_forced_warm_up_refreshes_the_featured_list_once(self, mock_featured_refresh, *_):
+        results = warmup.warm_up(force=True, snapshot=False)
+        mock_featured_refresh.assert_called_once_with(0)
+        self.assertEqual((results['featured_hardware'], results['featured_list']), ('ok', 'ok'))
+
+
+@override_settings(SNIPEIT_WEBHOOK_SECRET='hook-secret')
+class WebhookInvalidationTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.webhook_url = reverse('snipeit_webhook')
+        snipeit_cache.cache_featured_hardware([3], [
+            {'id': 1, 'name': 'Laptop One', 'asset_tag': 'LAP-1', 'category': {'id': 3}, 'assigned_to': None},
+        ])
+
+    def _post(self, data, token='hook-secret'):
+        return self.client.post(self.webhook_url, json.dumps(data), content_type='application/json',
+                                HTTP_X_WEBHOOK_TOKEN=token)
+
+    def test_rejects_wrong_token_and_invalid_events(self):
+        self.assertEqual(self._post({'event': 'checkout', 'asset': {'id': 1}}, token='nope').status_code, 403)
+        # The secret is not accepted in the URL
+        response = self.client.post(f"{self.webhook_url}?token=hook-secret", json.dumps({'event': 'checkout', 'asset': {'id': 1}}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self._post({'event': 'explode', 'asset': {'id': 1}}).status_code, 400)
+        with override_settings(SNIPEIT_WEBHOOK_SECRET=None):
+            self.assertEqual(self._post({'event': 'checkout', 'asset': {'id': 1}}).status_code, 404)
+
+    @patch('userCheckIO.cache_events.requests.get')
+    def test_checkout_patches_affected_entries_only(self, mock_requests_get):
+        mock_requests_get.return_value = _mock_response(json_data={
+            'id': 1, 'name': 'Laptop One', 'asset_tag': 'LAP-1', 'category': {'id': 3},
+            'assigned_to': {'id': 7, 'type': 'user', 'name': 'Jean Dupont'},
+        })
+        cache.set('user_assets:7', [])
+        cache.set('user_assets:8', [{'id': 99}])
+
+        response = self._post({'event': 'checkout', 'asset': {'id': 1, 'asset_tag': 'LAP-1'}})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['applied'][0]['featured_patched'])
+        self.assertIsNone(cache.get('user_assets:7'))
+        self.assertEqual(cache.get('user_assets:8'), [{'id': 99}])
+        self.assertEqual(snipeit_cache.get_cached_asset_id_for_tag('LAP-1'), 1)
+        rows = snipeit_cache.get_cached_featured_hardware([3])
+        self.assertEqual(rows[0]['assigned_to']['name'], 'Jean Dupont')
+
+    def test_deleted_asset_is_removed_from_caches(self):
+        snipeit_cache.cache_asset_id_for_tag('LAP-1', 1)
+
+        response = self._post({'events': [{'event': 'delete', 'asset': {'id': 1, 'asset_tag': 'LAP-1'}}]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(snipeit_cache.get_cached_featured_hardware([3])), [])
+        self.assertIsNone(snipeit_cache.get_cached_asset_id_for_tag('LAP-1'))
+
+    def test_change_during_refresh_marks_new_version_stale(self):
+        def loader():
+            snipeit_cache.update_dataset('categories', lambda payload: payload + ['changed'])
+            return ['fetched before the change']
+
+        snipeit_cache.get_or_refresh_dataset('categories', loader, max_age=0)
+
+        self.assertEqual(snipeit_cache.get_dataset_pointer('categories')['refreshed_at'], 0)
+
+
+class ActivityPollerTests(SharedCacheTestMixin, TestCase):
+
+    def _activity(self, *rows):
+        return _mock_response(json_data={'total': len(rows), 'rows': list(rows)})
+
+    def test_events_are_merged_per_asset(self):
+        events = activity_poller.events_from_activity([
+            {'id': 10, 'action_type': 'checkout', 'item': {'id': 1, 'type': 'asset'}, 'target': {'id': 7, 'type': 'user'}},
+            {'id': 11, 'action_type': 'checkin from', 'item': {'id': 1, 'type': 'asset'}, 'target': {'id': 7, 'type': 'user'}},
+            {'id': 12, 'action_type': 'checkout', 'item': {'id': 1, 'type': 'asset'}, 'target': {'id': 8, 'type': 'user'}},
+            {'id': 13, 'action_type': 'create new', 'item': {'id': 2, 'type': 'asset'}},
+            {'id': 14, 'action_type': 'checkout', 'item': {'id': 3, 'type': 'asset'}, 'target': {'id': 4, 'type': 'location'}},
+        ])
+
+        self.assertEqual([(event['asset_id'], event['event'], event['user_ids']) for event in events],
+                         [(1, 'checkout', [7, 8]), (3, 'checkout', [])])
+
+    @patch('userCheckIO.activity_poller.requests.get')
+    def test_poll_applies_entries_after_cursor(self, mock_requests_get):
+        # First poll without a cursor only stores the newest entry id
+        mock_requests_get.return_value = self._activity({'id': 20, 'action_type': 'update', 'item': {'id': 1}})
+        self.assertTrue(activity_poller.poll_once()['resynced'])
+        self.assertEqual(activity_poller.get_cursor(), 20)
+
+        cache.set('user_assets:7', [])
+        activity = self._activity(
+            {'id': 22, 'action_type': 'checkout', 'item': {'id': 5, 'type': 'asset'}, 'target': {'id': 7, 'type': 'user'}},
+            {'id': 21, 'action_type': 'update', 'item': {'id': 6, 'type': 'asset'}},
+            {'id': 20, 'action_type': 'update', 'item': {'id': 1, 'type': 'asset'}},
+        )
+        # requests.get is shared by the poller and cache_events (/hardware/{id} lookups)
+        mock_requests_get.side_effect = lambda url, **kwargs: activity if 'reports/activity' in url else _mock_response(status_code=404)
+
+        summary = activity_poller.poll_once()
+
+        self.assertFalse(summary['resynced'])
+        self.assertEqual([applied['asset_id'] for applied in summary['applied']], [6, 5])
+        self.assertEqual(activity_poller.get_cursor(), 22)
+        self.assertIsNone(cache.get('user_assets:7'))
+
+    @override_settings(ACTIVITY_POLL_MAX_PAGES=1)
+    @patch('userCheckIO.activity_poller.requests.get')
+    def test_poll_too_far_behind_resyncs(self, mock_activity_get):
+        activity_poller.set_cursor(1)
+        snipeit_cache.cache_featured_hardware([3], [])
+        mock_activity_get.return_value = self._activity(*[
+            {'id': activity_id, 'action_type': 'update', 'item': {'id': activity_id}}
+            for activity_id in range(500, 500 - activity_poller.PAGE_SIZE, -1)
+        ])
+
+        self.assertTrue(activity_poller.poll_once()['resynced'])
+        self.assertEqual(activity_poller.get_cursor(), 500)
+        self.assertIsNone(snipeit_cache.get_cached_featured_hardware([3]))
+
+
+class BatchAssetReportTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        session = self.client.session
+        session['snipeit_authenticated'] = True
+        session['is_admin'] = True
+        session.save()
+        self.report_url = reverse('batch_asset_report')
+
+    def test_employee_numbers_are_deduplicated(self):
+        uploaded = SimpleUploadedFile('audit.csv', b'\xef\xbb\xbfName,Employee_Number\nJean,E1\nAnna,e1\nBob, E2 \n,\n')
+        self.assertEqual(batch_report.read_employee_numbers(uploaded), ['E1', 'E2'])
+
+        uploaded = SimpleUploadedFile('audit.txt', b'E1\nE2\nE3\n')
+        with self.assertRaises(batch_report.BatchInputError):
+            batch_report.read_employee_numbers(uploaded, max_count=2)
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_csv_report_lists_assets_in_upload_order(self, mock_requests_get):
+        snipeit_cache.cache_user({'id': 7, 'name': 'Jean Dupont', 'employee_num': 'E1'})
+        user_search = _mock_response(json_data={'total': 0, 'rows': []})
+        user_assets = _mock_response(json_data={'rows': [
+            {'asset_tag': 'LAP-1', 'name': 'Laptop', 'category': {'name': 'Laptops'}, 'model': {'name': 'X1'}, 'serial': 'S1'},
+        ]})
+        mock_requests_get.side_effect = lambda url, **kwargs: user_assets if url.endswith('/assets') else user_search
+
+        response = self.client.post(self.report_url, {
+            'employees_file': SimpleUploadedFile('audit.csv', b'E404\nE1\nE1\n'),
+            'report_format': 'csv',
+        })
+
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ','.join(batch_report.REPORT_COLUMNS))
+        self.assertEqual(lines[1], 'E404,not found,,,,,,,')
+        self.assertEqual(lines[2], 'E1,ok,7,Jean Dupont,LAP-1,Laptop,Laptops,X1,S1')
+        self.assertEqual(len(lines), 3)
+        # E1 came from the cache: only E404 was searched, and only E1's assets fetched
+        self.assertEqual(mock_requests_get.call_count, 2)
+
+    def test_requires_admin(self):
+        session = self.client.session
+        session['is_admin'] = False
+        session.save()
+        self.assertRedirects(self.client.get(self.report_url), reverse('index'), fetch_redirect_response=False)
+
+
+@override_settings(SNIPEIT_BACKENDS=[
+    {'name': 'amer', 'url': 'http://amer.test/api/v1/', 'token': 'amer-token'},
+    {'name': 'emea', 'url': 'http://emea.test/api/v1/', 'token': 'emea-token', 'max_connections': 4, 'rate_limit': 5},
+])
+class FederatedBackendTests(SharedCacheTestMixin, TestCase):
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_employee_lookup_searches_every_backend(self, mock_session_get):
+        mock_session_get.side_effect = lambda url, **kwargs: _mock_response(json_data={'rows': (
+            [{'id': 3, 'employee_num': 'E7', 'name': 'Ana'}] if url.startswith('http://emea.test') else [])})
+
+        user = get_user_by_employee_number('E7')
+
+        self.assertEqual(user['origin'], 'emea')
+        self.assertEqual(mock_session_get.call_count, 2)
+        self.assertEqual(mock_session_get.call_args_list[0].kwargs['headers']['Authorization'][:7], 'Bearer ')
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_first_exact_match_ends_the_lookup(self, mock_session_get):
+        emea_may_answer = threading.Event()
+        self.addCleanup(emea_may_answer.set)
+
+        def session_get(url, **kwargs):
+            if url.startswith('http://emea.test'):
+                emea_may_answer.wait(5)
+                return _mock_response(json_data={'rows': []})
+            return _mock_response(json_data={'rows': [{'id': 9, 'employee_num': 'E7', 'name': 'Bo'}]})
+        mock_session_get.side_effect = session_get
+
+        started = time.monotonic()
+        user = get_user_by_employee_number('E7')
+
+        self.assertEqual(user['origin'], 'amer')
+        self.assertLess(time.monotonic() - started, 2)
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    def test_featured_hardware_is_merged_with_origin(self, mock_session_get):
+        mock_session_get.side_effect = lambda url, **kwargs: _mock_response(json_data={'total': 1, 'rows': [
+            {'id': 1, 'name': 'EMEA Laptop' if url.startswith('http://emea.test') else 'AMER Laptop'}]})
+
+        rows, errors = featured_snapshot.fetch_featured_hardware([3])
+
+        self.assertEqual(errors, [])
+        self.assertEqual([(row['origin'], row['name']) for row in rows], [('amer', 'AMER Laptop'), ('emea', 'EMEA Laptop')])
+        self.assertIn('emea', featured_snapshot.render_rows(rows))
+
+    def test_backends_have_their_own_pool_and_rate_limit(self):
+        amer, emea = backends.get_backends()
+        self.assertIsNot(amer.session, emea.session)
+        self.assertEqual(emea.session.get_adapter('http://emea.test/')._pool_maxsize, 4)
+
+        with patch('userCheckIO.backends.time.sleep') as mock_sleep:
+            for _ in range(6):
+                emea.limiter.acquire()
+                amer.limiter.acquire()
+        # Bursts of 5 requests, the 6th one waits; amer has no limit
+        mock_sleep.assert_called()
+        self.assertTrue(backends.is_primary({'origin': 'amer'}))
+        self.assertFalse(backends.is_primary({'origin': 'emea'}))
+
+
+class PrioritySchedulerTests(TestCase):
+
+    def setUp(self):
+        self.gate = scheduler.PriorityGate({scheduler.INTERACTIVE: 1, scheduler.BACKGROUND: 1})
+
+    def test_background_waits_while_interactive_calls_wait(self):
+        self.gate.acquire(scheduler.INTERACTIVE)
+        waiter = threading.Thread(target=self.gate.acquire, args=(scheduler.INTERACTIVE, 5))
+        waiter.start()
+        while not self.gate.waiting[scheduler.INTERACTIVE]:
+            time.sleep(0.001)
+
+        # A background slot is free, but an interactive call is queued
+        self.assertFalse(self.gate.acquire(scheduler.BACKGROUND, timeout=0.05))
+
+        self.gate.release(scheduler.INTERACTIVE)
+        waiter.join()
+        self.assertEqual(self.gate.in_flight[scheduler.INTERACTIVE], 1)
+        self.assertTrue(self.gate.acquire(scheduler.BACKGROUND, timeout=0.05))
+
+    def test_interactive_calls_never_wait_for_background_work(self):
+        self.assertTrue(self.gate.acquire(scheduler.BACKGROUND))
+        self.assertTrue(self.gate.acquire(scheduler.INTERACTIVE, timeout=0))
+        self.assertFalse(self.gate.acquire(scheduler.BACKGROUND, timeout=0))
+
+    @override_settings(SNIPEIT_SCHEDULER={'interactive': 1, 'background': 1})
+    def test_interactive_wait_is_bounded_by_the_request_deadline(self):
+        scheduler.get_gate().acquire(scheduler.INTERACTIVE)
+        self.addCleanup(scheduler.get_gate().release, scheduler.INTERACTIVE)
+        token = deadline._current.set(deadline.Deadline(0.05))
+        self.addCleanup(deadline._current.reset, token)
+
+        with self.assertRaises(deadline.DeadlineExceeded):
+            scheduler.call(MagicMock())
+
+    def test_background_jobs_run_as_background(self):
+        self.assertEqual(scheduler.current_priority(), scheduler.INTERACTIVE)
+        job = scheduler.background_job(scheduler.current_priority)
+        self.assertEqual(job(), scheduler.BACKGROUND)
+        self.assertEqual(scheduler.current_priority(), scheduler.INTERACTIVE)
+
+
+class ProfilingTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.profile_settings = {'sample_rate': 0.0, 'format': 'pstats', 'interval': 0.001,
+                                 'directory': tmp_dir.name, 'keep': 2}
+        profiling_settings = override_settings(PROFILING=self.profile_settings)
+        profiling_settings.enable()
+        self.addCleanup(profiling_settings.disable)
+
+    def _login_as_admin(self):
+        session = self.client.session
+        session['snipeit_authenticated'] = True
+        session['is_admin'] = True
+        session.save()
+
+    def test_admin_flag_profiles_the_request(self):
+        self.client.get(reverse('index'), {'profile': '1'})
+        self.assertEqual(cache.get(profiling.INDEX_KEY), None)
+
+        self._login_as_admin()
+        self.client.get(reverse('index'), {'profile': '1'})
+        self.client.get(reverse('index'), HTTP_X_PROFILE='1')
+
+        profiles = profiling.slowest_profiles()
+        self.assertEqual([profile['view'] for profile in profiles], ['index', 'index'])
+        self.assertGreater(profiles[0]['categories']['templates'], 0)
+        path = profiling.profile_path(profiles[0]['file'])
+        self.assertTrue(path.endswith('.prof'))
+        self.assertIn('index', {function_name for _, _, function_name in pstats.Stats(path).stats})
+
+    def test_sampled_profiles_are_capped_and_listed_slowest_first(self):
+        self.profile_settings['sample_rate'] = 1.0
+        for _ in range(3):
+            self.client.get(reverse('index'))
+        self._login_as_admin()
+        self.profile_settings['sample_rate'] = 0.0
+
+        profiles = profiling.slowest_profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(len(os.listdir(self.profile_settings['directory'])), 2)
+        self.assertGreaterEqual(profiles[0]['duration'], profiles[1]['duration'])
+
+        response = self.client.get(reverse('profiles'))
+        self.assertContains(response, profiles[0]['file'])
+        response = self.client.get(reverse('profile_download', kwargs={'file_name': profiles[0]['file']}))
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        response = self.client.get(reverse('profile_download', kwargs={'file_name': '..settings.py'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_collapsed_stacks_are_sampled(self):
+        def slow_lookup():
+            time.sleep(0.05)
+
+        sampler = profiling.StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        slow_lookup()
+        sampler.stop()
+
+        collapsed = sampler.collapsed()
+        self.assertIn('tests.py:slow_lookup', collapsed)
+        self.assertRegex(collapsed.splitlines()[0], r' \d+$')
+
+    def test_json_decoding_is_timed_once(self):
+        body = json.dumps({'total': 2000, 'rows': [{'id': i, 'name': f'Asset {i}'} for i in range(2000)]}).encode()
+        response = _mock_response()
+        response.content = body
+
+        def json_time(decode):
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            decode()
+            profiler.disable()
+            elapsed = time.perf_counter() - started
+            return profiling.category_times_from_stats(pstats.Stats(profiler))['json'], elapsed
+
+        seconds, _ = json_time(lambda: json_decoding.decode(response))
+        self.assertGreater(seconds, 0)
+        seconds, _ = json_time(lambda: json_decoding.parse_page([body], ['id']))
+        self.assertGreater(seconds, 0)
+        seconds, _ = json_time(lambda: json.loads(body))  # what response.json() runs
+        self.assertGreater(seconds, 0)
+        # json.loads() called by json_decoding.loads() is not counted twice
+        with override_settings(SNIPEIT_JSON_DECODER='stdlib'):
+            seconds, elapsed = json_time(lambda: json_decoding.decode(response))
+        self.assertLessEqual(seconds, elapsed)
+
+    def test_request_is_sampled_while_another_is_under_cprofile(self):
+        self._login_as_admin()
+        with profiling._cprofile_lock:
+            self.client.get(reverse('index'), {'profile': '1'})
+        self.client.get(reverse('index'), {'profile': '1'})
+        self.assertEqual(sorted(profile['file'].rsplit('.', 1)[1] for profile in profiling.slowest_profiles()),
+                         ['collapsed', 'prof'])
+
+    def test_concurrent_records_are_all_listed(self):
+        self.profile_settings['keep'] = 50
+        cache_get = cache.get
+
+        def slow_get(key, default=None):
+            # Widens the window between reading the index and writing it back
+            value = cache_get(key, default)
+            time.sleep(0.01)
+            return value
+
+        threads = [threading.Thread(target=profiling.record, args=({'file': f'{number}.prof', 'duration': number},))
+                   for number in range(8)]
+        with patch.object(cache, 'get', side_effect=slow_get):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(profiling.slowest_profiles()), 8)
+
+
+class InventoryStatsTests(SharedCacheTestMixin, TestCase):
+
+    @staticmethod
+    def _asset(asset_id, category_id=3, status_id=1, model_id=7, assigned=False):
+        return {
+            'id': asset_id, 'asset_tag': f'TAG-{asset_id}',
+            'category': {'id': category_id, 'name': {3: 'Laptops', 4: 'Phones'}[category_id]},
+            'status_label': {'id': status_id, 'name': {1: 'Deployed', 2: 'Ready'}[status_id]},
+            'model': {'id': model_id, 'name': f'Model {model_id}'},
+            'assigned_to': {'id': 10, 'type': 'user'} if assigned else None,
+        }
+
+    def setUp(self):
+        super().setUp()
+        config = AssetCategoryConfiguration.load()
+        config.allowed_category_ids = [4]
+        config.save()
+        with patch('userCheckIO.snipeit_api.hedging.get') as mock_get:
+            mock_get.return_value = _mock_response(json_data={'total': 3, 'rows': [
+                self._asset(1, assigned=True), self._asset(2, status_id=2), self._asset(3, category_id=4, model_id=8),
+            ]})
+            inventory_stats.rebuild()
+
+    def _summary(self, category_ids=None):
+        payload, _ = inventory_stats.get_stats()
+        return inventory_stats.summarize(payload, category_ids)
+
+    def test_counts_follow_checkouts_and_asset_events(self):
+        summary = self._summary()
+        self.assertEqual((summary['total'], summary['assigned'], summary['unassigned']), (3, 1, 2))
+        self.assertEqual([(entry['name'], entry['count'], entry['assigned']) for entry in summary['by_category']],
+                         [('Laptops', 2, 1), ('Phones', 1, 0)])
+        self.assertEqual([(entry['name'], entry['count']) for entry in summary['by_status']], [('Deployed', 2), ('Ready', 1)])
+
+        payload_before, _ = inventory_stats.get_stats()
+        inventory_stats.set_assigned(2, True)
+        self.assertEqual(self._summary()['assigned'], 2)
+        # Updates never modify the payload other threads may be reading
+        self.assertEqual(payload_before['categories'][3]['assigned'], 1)
+
+        # An asset moved to Phones, a new one, and a deleted one
+        inventory_stats.apply_rows([self._asset(1, category_id=4, assigned=True), self._asset(4, model_id=9)])
+        inventory_stats.apply_asset(3, None)
+        summary = self._summary()
+        self.assertEqual((summary['total'], summary['assigned']), (3, 2))
+        self.assertEqual([(entry['name'], entry['count']) for entry in summary['by_model']], [('Model 7', 2), ('Model 9', 1)])
+        self.assertEqual(self._summary([4])['by_category'], [{'id': 4, 'name': 'Phones', 'count': 1, 'assigned': 1}])
+
+    def test_checkouts_are_logged_off_the_request_path(self):
+        version = snipeit_cache.get_dataset_pointer(inventory_stats.DATASET)['version']
+        # A buffer of its own: the one of the module may be flushed by its thread at any time
+        with override_settings(INVENTORY_STATS={'flush_interval': 60, 'fold_after': 2}), \
+                patch.object(inventory_stats, 'change_buffer', inventory_stats.ChangeBuffer(60)):
+            inventory_stats.set_assigned(2, True)
+            # Only buffered by the worker
+            self.assertEqual(len(inventory_stats.change_buffer), 1)
+            self.assertEqual(self._summary()['assigned'], 1)
+            inventory_stats.change_buffer.flush()
+            self.assertEqual(self._summary()['assigned'], 2)
+            self.assertEqual(snipeit_cache.get_dataset_pointer(inventory_stats.DATASET)['version'], version)
+
+            inventory_stats.set_assigned(1, False)
+            inventory_stats.change_buffer.flush()
+        # The second entry folded the log into the dataset
+        payload, pointer = snipeit_cache.get_dataset(inventory_stats.DATASET)
+        self.assertNotEqual(pointer['version'], version)
+        self.assertEqual((payload['applied_seq'], payload['categories'][3]['assigned']), (2, 1))
+
+    def test_changes_made_during_a_rebuild_are_kept(self):
+        def checkout_during_the_scan(*args, **kwargs):
+            inventory_stats.set_assigned(2, True)
+            return _mock_response(json_data={'total': 2, 'rows': [self._asset(1, assigned=True), self._asset(2, status_id=2)]})
+
+        with patch('userCheckIO.snipeit_api.hedging.get', side_effect=checkout_during_the_scan):
+            inventory_stats.rebuild()
+        summary = self._summary()
+        self.assertEqual((summary['total'], summary['assigned']), (2, 2))
+
+    @override_settings(SNIPEIT_WEBHOOK_SECRET='hook-secret')
+    def test_webhook_events_update_the_counts(self):
+        response = self.client.post(reverse('snipeit_webhook'), data=json.dumps(
+            {'events': [{'event': 'checkin', 'asset_id': 1, 'asset': self._asset(1)}]}), content_type='application/json',
+            HTTP_X_WEBHOOK_TOKEN='hook-secret')
+        self.assertTrue(response.json()['applied'][0]['stats_updated'])
+        self.assertEqual(self._summary()['assigned'], 0)
+
+    @patch('userCheckIO.backends.requests.Session.get')
+    @patch('userCheckIO.snipeit_api.hedging.get')
+    def test_dashboard_never_calls_snipeit(self, mock_get, mock_session_get):
+        response = self.client.get(reverse('inventory_stats'))
+        mock_get.assert_not_called()
+        mock_session_get.assert_not_called()
+        self.assertContains(response, 'Featured Categories')
+        self.assertContains(response, 'Model 8')
+        self.assertEqual(response.context['featured_assets']['total'], 1)
+        self.assertEqual(response.context['all_assets']['total'], 3)
+
+
+class InventoryHistoryTests(SharedCacheTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        history_settings = override_settings(INVENTORY_HISTORY={'directory': tmp_dir.name, 'snapshot_hour': -1})
+        history_settings.enable()
+        self.addCleanup(history_settings.disable)
+
+    @staticmethod
+    def _asset(asset_id, user_id=None, category_id=3, status_id=1):
+        return {
+            'id': asset_id, 'asset_tag': f'TAG-{asset_id}',
+            'assigned_to': {'id': user_id, 'name': f'User {user_id}', 'type': 'user'} if user_id else None,
+            'status_label': {'id': status_id, 'name': 'Deployed' if status_id == 1 else 'Ready'},
+            'category': {'id': category_id, 'name': {3: 'Laptops', 4: 'Phones'}[category_id]},
+        }
+
+    def _snapshot(self, day, *assets):
+        with patch('userCheckIO.snipeit_api.hedging.get') as mock_get:
+            mock_get.return_value = _mock_response(json_data={'total': len(assets), 'rows': list(assets)})
+            return inventory_history.take_snapshot(day)
+
+    def test_only_changes_are_stored(self):
+        self.assertEqual(self._snapshot(date(2026, 3, 1), self._asset(1, user_id=10), self._asset(2), self._asset(3, category_id=4))['changes'], 3)
+        self.assertEqual(self._snapshot(date(2026, 3, 2), self._asset(1, user_id=10), self._asset(2), self._asset(3, category_id=4))['changes'], 0)
+        # Asset 1 moves to user 11, asset 3 is deleted
+        self.assertEqual(self._snapshot(date(2026, 3, 5), self._asset(1, user_id=11), self._asset(2))['changes'], 2)
+        with self.assertRaises(ValueError):
+            self._snapshot(date(2026, 3, 4), self._asset(1))
+
+        # A new reader maps the files written by another process
+        history = inventory_history.InventoryHistory(settings.INVENTORY_HISTORY['directory'])
+        self.assertEqual(history.holder(1, date(2026, 2, 28))['known'], False)
+        holder = history.holder(1, date(2026, 3, 4))
+        self.assertEqual((holder['user'], holder['category'], holder['asset_tag']),
+                         ({'id': 10, 'name': 'User 10'}, {'id': 3, 'name': 'Laptops'}, 'TAG-1'))
+        self.assertEqual(history.holder(1, date(2026, 3, 5))['user']['id'], 11)
+        self.assertIsNone(history.holder(2, date(2026, 3, 5))['user'])
+        self.assertFalse(history.holder(3, date(2026, 3, 6))['known'])
+        self.assertTrue(history.holder(3, date(2026, 3, 4))['known'])
+
+        headcount = history.headcount(date(2026, 2, 28), date(2026, 3, 5))
+        self.assertEqual(headcount['categories'], {3: 'Laptops', 4: 'Phones'})
+        counts = {point['date']: point['counts'] for point in headcount['series']}
+        self.assertEqual(counts['2026-02-28'], {})
+        self.assertEqual(counts['2026-03-03'], {3: {'assets': 2, 'assigned': 1}, 4: {'assets': 1, 'assigned': 0}})
+        self.assertEqual(counts['2026-03-05'], {3: {'assets': 2, 'assigned': 1}, 4: {'assets': 0, 'assigned': 0}})
+        self.assertEqual(history.headcount(date(2026, 3, 1), date(2026, 3, 1), [4])['series'][0]['counts'], {4: {'assets': 1, 'assigned': 0}})
+
+    def test_api(self):
+        self._snapshot(date(2026, 3, 1), self._asset(1, user_id=10))
+        client = Client()
+        self.assertEqual(client.get(reverse('history_holder'), {'asset': 'TAG-1'}).status_code, 403)
+        session = client.session
+        session['snipeit_authenticated'] = True
+        session.save()
+
+        response = client.get(reverse('history_holder'), {'asset': 'TAG-1', 'date': '2026-03-02'})
+        self.assertEqual(response.json()['user'], {'id': 10, 'name': 'User 10'})
+        self.assertEqual(client.get(reverse('history_holder'), {'asset': '1', 'date': '2026-03-02'}).json()['asset_id'], 1)
+        self.assertEqual(client.get(reverse('history_holder'), {'asset': 'TAG-404'}).status_code, 404)
+        self.assertEqual(client.get(reverse('history_holder'), {'asset': '1', 'date': 'yesterday'}).status_code, 400)
+        response = client.get(reverse('history_headcount'), {'start': '2026-03-01', 'end': '2026-03-02'})
+        self.assertEqual(response.json()['series'][1]['counts'], {'3': {'assets': 1, 'assigned': 1}})
+        self.assertEqual(client.get(reverse('history_headcount'), {'start': '2026-03-02', 'end': '2026-03-01'}).status_code, 400)
+
+
+class JsonDecodingTests(TestCase):
+
+    PAGE = {
+        'total': 3,
+        'rows': [
+            {'id': 1, 'name': 'Caf\u00e9 laptop', 'model': {'id': 7, 'name': 'X1'}, 'assigned_to': None,
+             'purchase_cost': 1299.5, 'notes': 'x' * 300, 'custom_fields': {'RAM': {'value': '16GB'}}},
+            {'id': 22, 'name': 'Phone', 'model': {'id': 8, 'name': 'P2'}, 'assigned_to': {'id': 5, 'name': 'Ann'},
+             'purchase_cost': -12e3, 'notes': '', 'custom_fields': []},
+            {'id': 333, 'name': 'Dock', 'model': None, 'assigned_to': {'id': 6, 'name': 'Bob'}, 'purchase_cost': 0},
+        ],
+        'messages': None,
+    }
+    PATHS = ['id', 'name', 'model.name', 'assigned_to', 'purchase_cost', 'custom_fields.RAM.value']
+
+    def test_selective_parse_of_a_page_cut_into_small_chunks(self):
+        body = json.dumps(self.PAGE, ensure_ascii=False, indent=1).encode()
+        expected = [json_decoding.select(row, self.PATHS) for row in self.PAGE['rows']]
+        for chunk_size in (1, 3, 7, len(body)):
+            chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+            rows, fields = json_decoding.parse_page(chunks, self.PATHS)
+            self.assertEqual(rows, expected)
+            self.assertEqual(fields, {'total': 3, 'messages': None})
+
+        self.assertEqual(expected[0], {'id': 1, 'name': 'Caf\u00e9 laptop', 'model': {'name': 'X1'}, 'assigned_to': None,
+                                       'purchase_cost': 1299.5, 'custom_fields': {'RAM': {'value': '16GB'}}})
+        self.assertEqual((expected[1]['custom_fields'], expected[2]['model']), ([], None))
+        self.assertEqual(json_decoding.parse_page([b'{"total": 0, "rows": []}'], self.PATHS), ([], {'total': 0}))
+        with self.assertRaises(ValueError):
+            json_decoding.parse_page([b'{"total": 1, "rows": [{"id": 1}'], self.PATHS)
+
+    def test_decoders_agree(self):
+        response = _mock_response(json_data=self.PAGE)
+        with override_settings(SNIPEIT_JSON_DECODER='json'):
+            self.assertFalse(json_decoding.fast_decoder_available())
+            self.assertEqual(json_decoding.decode(response), self.PAGE)
+        with patch.object(json_decoding, 'orjson', None):
+            self.assertFalse(json_decoding.fast_decoder_available())
+            self.assertEqual(json_decoding.decode(response), self.PAGE)
+        self.assertEqual(json_decoding.decode(response), self.PAGE)
+
+
+class StructuredLoggingTests(TestCase):
+
+    def _handler(self, **kwargs):
+        stream = io.StringIO()
+        handler = structured_logging.BackgroundQueueHandler(target=logging.StreamHandler(stream), **kwargs)
+        handler.addFilter(structured_logging.CorrelationIdFilter())
+        self.addCleanup(handler.close)
+        test_logger = logging.getLogger('structured_logging_tests')
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        self.addCleanup(test_logger.removeHandler, handler)
+        return test_logger, handler, stream
+
+    def test_records_carry_the_request_correlation_id(self):
+        test_logger, handler, stream = self._handler()
+
+        def view(request):
+            test_logger.warning("Checkout of asset %s failed", 12, extra={'status_code': 500})
+            return HttpResponse('ok')
+
+        middleware = structured_logging.CorrelationIdMiddleware(view)
+        response = middleware(RequestFactory().get('/', HTTP_X_REQUEST_ID='abc123'))
+        generated = middleware(RequestFactory().get('/'))['X-Request-ID']
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            test_logger.exception("Outside of a request")
+        handler.flush()
+
+        records = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual(response['X-Request-ID'], 'abc123')
+        self.assertEqual(records[0]['correlation_id'], 'abc123')
+        self.assertEqual((records[0]['message'], records[0]['status_code']), ("Checkout of asset 12 failed", 500))
+        self.assertEqual(records[1]['correlation_id'], generated)
+        self.assertEqual(records[2]['correlation_id'], '-')
+        self.assertIn("ValueError: boom", records[2]['exception'])
+
+    def test_full_queue_drops_records_instead_of_blocking(self):
+        test_logger, handler, stream = self._handler(max_size=2)
+        handler.stop_writing()
+        for _ in range(5):
+            test_logger.warning("Snipe-IT is down")
+        self.assertEqual(handler.dropped, 3)
+
+    def test_error_storm_is_sampled(self):
+        sampler = structured_logging.StormSampler(burst=3, window=60, sample_every=5)
+        records = [logging.LogRecord('userCheckIO', logging.WARNING, '', 0, "Error %s", (i,), None) for i in range(13)]
+        kept = [record for record in records if sampler.filter(record)]
+        self.assertEqual([record.args[0] for record in kept], [0, 1, 2, 7, 12])
+        self.assertEqual(kept[3].suppressed, 4)
+        other = logging.LogRecord('userCheckIO', logging.WARNING, '', 0, "Another error", (), None)
+        self.assertTrue(sampler.filter(other))
+
+    @override_settings(LOG_BODIES={'max_length': 10, 'per_minute': 1})
+    def test_response_bodies_are_truncated_and_rate_limited(self):
+        response = MagicMock(text='<html>' + 'x' * 100, content=b'x' * 106)
+        with patch.object(structured_logging, '_body_budget', structured_logging.BodyBudget()):
+            self.assertEqual(structured_logging.body_excerpt(response), '<html>xxxx... [96 more characters]')
+            self.assertEqual(structured_logging.body_excerpt(response), '[body not logged, 106 bytes]')
+
+
+class LoadTestHarnessTests(TestCase):
+
+    def test_fake_snipeit_checkout_and_checkin(self):
+        fake = loadtest.FakeSnipeIT(user_count=10, assets_per_user=2)
+        status, user_search = fake.handle('GET', 'users', {'employee_num': ['E3']})
+        self.assertEqual((status, user_search['rows'][0]['id']), (200, 3))
+        status, asset = fake.handle('GET', 'hardware/bytag/TAG-000005', {})
+        self.assertEqual(status, 200)
+
+        fake.handle('POST', f"hardware/{asset['id']}/checkout", {}, {'assigned_user': 3})
+        _, assets = fake.handle('GET', 'users/3/assets', {})
+        self.assertIn(asset['id'], [row['id'] for row in assets['rows']])
+        fake.handle('POST', f"hardware/{asset['id']}/checkin", {}, {})
+        self.assertIsNone(fake.assets[asset['id']]['assigned_to'])
+
+        _, page = fake.handle('GET', 'hardware', {'category_id': ['1'], 'limit': ['2'], 'offset': ['0']})
+        self.assertEqual(len(page['rows']), 2)
+        self.assertEqual(fake.requests['GET /hardware/bytag/{id}'], 1)
+
+    def test_knee_is_the_last_level_worth_its_concurrency(self):
+        levels = [
+            {'concurrency': 1, 'throughput': 10, 'p95': 0.1},
+            {'concurrency': 2, 'throughput': 19, 'p95': 0.12},
+            {'concurrency': 4, 'throughput': 35, 'p95': 0.15},
+            {'concurrency': 8, 'throughput': 36, 'p95': 0.4},
+        ]
+        self.assertEqual(loadtest.find_knee(levels)['concurrency'], 4)
+        levels[2]['p95'] = 0.3
+        self.assertEqual(loadtest.find_knee(levels)['concurrency'], 2)
+        # Every request failed (fast) at 4 clients
+        levels[2].update(throughput=40, p95=None)
+        self.assertEqual(loadtest.find_knee(levels)['concurrency'], 2)
+        self.assertEqual(loadtest.find_knee([{'concurrency': 1, 'throughput': 0, 'p95': None}, *levels])['concurrency'], 1)
+
+    def test_traffic_mix(self):
+        self.assertEqual(loadtest.parse_mix('index=2, featured'), {'index': 2.0, 'featured': 1.0})
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('checkout=1')
+
+
+class RequestDeadlineTests(SharedCacheTestMixin, TestCase):
+
+    def test_timeout_is_capped_by_remaining_budget(self):
+        self.assertEqual(deadline.timeout(15), 15)  # no request being handled
+
+        token = deadline._current.set(deadline.Deadline(3))
+        self.addCleanup(deadline._current.reset, token)
+        self.assertLessEqual(deadline.timeout(15), 3)
+        self.assertEqual(deadline.timeout(1), 1)
+
+        deadline.current().expires_at -= 3
+        with self.assertRaises(requests.exceptions.Timeout):
+            deadline.timeout(15)
+        self.assertFalse(deadline.has_time_for_optional())
+
+    @override_settings(REQUEST_DEADLINE={'budget': 4, 'optional_reserve': 5, 'min_call_timeout': 0.5})
+    @patch('userCheckIO.views.get_user_by_employee_number')
+    def test_user_assets_render_without_categories_when_budget_is_low(self, mock_get_user):
+        mock_get_user.return_value = {'id': 7, 'name': 'Jean Dupont', 'username': 'jdupont', 'employee_num': 'E1'}
+        cache.set('user_assets:7', [{'id': 1, 'name': 'Laptop One', 'category': {'id': 3, 'name': 'Laptops'}}])
+
+        with patch('userCheckIO.hedging.requests.get') as mock_requests_get:
+            response = self.client.get(reverse('user_asset_view'), {'employee_number': 'E1', 'stream': '0'})
+
+        mock_requests_get.assert_not_called()
+        self.assertContains(response, 'Laptop One')
+        self.assertContains(response, 'The category list could not be loaded in time')
+
+
+@override_settings(SNIPEIT_HEDGING={
+    'enabled': True, 'endpoints': ['hardware'], 'max_extra_percent': 100,
+    'min_samples': 5, 'min_delay': 0.01, 'max_workers': 4,
+})
+class HedgedRequestTests(TestCase):
+
+    def setUp(self):
+        hedging.reset()
+        self.addCleanup(hedging.reset)
+        self.url = f"{settings.SNIPEIT_API_URL}hardware"
+        for _ in range(5):
+            hedging._window('hardware').add(0.01)
+
+    def test_endpoint_key(self):
+        self.assertEqual(hedging.endpoint_key(f"{settings.SNIPEIT_API_URL}users/12/assets?limit=5"), 'users/{id}/assets')
+        self.assertEqual(hedging.endpoint_key(f"{settings.SNIPEIT_API_URL}hardware?category_id=3"), 'hardware')
+
+    @patch('userCheckIO.hedging.requests.get')
+    def test_slow_request_is_hedged(self, mock_requests_get):
+        slow, fast = _mock_response(json_data={'from': 'slow'}), _mock_response(json_data={'from': 'fast'})
+        responses = [slow, fast]
+
+        def get(url, **kwargs):
+            response = responses.pop(0)
+            if response is slow:
+                time.sleep(0.5)
+            return response
+        mock_requests_get.side_effect = get
+
+        response = hedging.get(self.url, timeout=5)
+
+        self.assertEqual(response.json(), {'from': 'fast'})
+        self.assertEqual(hedging.counters['hedges'], 1)
+        self.assertEqual(hedging.counters['hedge_wins'], 1)
+
+    @patch('userCheckIO.hedging.requests.get')
+    def test_hedge_stays_within_the_request_deadline(self, mock_requests_get):
+        timeouts = []
+
+        def get(url, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            if len(timeouts) == 1:
+                time.sleep(0.3)
+            return _mock_response()
+        mock_requests_get.side_effect = get
+
+        token = deadline._current.set(deadline.Deadline(2))
+        self.addCleanup(deadline._current.reset, token)
+        hedging.get(self.url, timeout=5)
+        self.assertEqual(hedging.counters['hedges'], 1)
+        self.assertEqual(timeouts[0], 5)
+        self.assertLessEqual(timeouts[1], 2)
+
+        # Less than min_call_timeout left: the primary request is not hedged
+        timeouts.clear()
+        deadline._current.set(deadline.Deadline(0.2))
+        hedging.get(self.url, timeout=5)
+        self.assertEqual(hedging.counters['hedges'], 1)
+        self.assertEqual(timeouts, [5])
+
+    @patch('userCheckIO.hedging.requests.get')
+    def test_budget_caps_extra_requests(self, mock_requests_get):
+        mock_requests_get.side_effect = lambda url, **kwargs: time.sleep(0.05) or _mock_response()
+
+        with override_settings(SNIPEIT_HEDGING={**settings.SNIPEIT_HEDGING, 'max_extra_percent': 0}):
+            hedging.get(self.url)
+        self.assertEqual(hedging.counters['hedges'], 0)
+        # Endpoints not listed are never hedged
+        hedging.get(f"{settings.SNIPEIT_API_URL}users")
+        self.assertEqual(mock_requests_get.call_count, 2)
@@ -0,0 +1,100 @@
+"""
+Health of the Snipe-IT API token shared by every user of the app.
+
+login_view used to call /users/me on every POST. The token is the same for everyone, so its
+validity is checked once and the result is kept in the shared cache: a fresh result is served
+directly, a stale one is served while a single background thread re-checks it, and only a
+missing result makes a request wait for Snipe-IT (once per host, other workers wait for it).
+The same result backs the readiness probe endpoint.
+"""
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from . import deadline, scheduler, snipeit_api
+
+CACHE_KEY = 'token_health'
+LOCK_KEY = 'lock:token_health'
+LOCK_TIMEOUT = 30
+# How long a request waits for another worker's check before checking by itself.
+WAIT_FOR_OTHER_CHECK = 10
+# Response bodies kept in the result, e.g. to display Snipe-IT's error message.
+DETAIL_MAX_LENGTH = 500
+
+
+def check_token(timeout=10):
+    """
+    Calls /users/me with the configured token and returns the result:
+    {'valid': bool, 'status_code': int|None, 'detail': str, 'checked_at': float}
+    status_code is None when Snipe-IT could not be reached; detail then holds the error.
+    """
+    me_url = f"{settings.SNIPEIT_API_URL.rstrip('/')}/users/me"
+    try:
+        response = scheduler.call(requests.get, me_url, headers=snipeit_api.api_headers(), timeout=deadline.timeout(timeout))
+    except requests.exceptions.RequestException as e:
+        return {'valid': False, 'status_code': None, 'detail': str(e), 'checked_at': time.time()}
+    return {
+        'valid': response.status_code == 200,
+        'status_code': response.status_code,
+        'detail': '' if response.status_code == 200 else response.text[:DETAIL_MAX_LENGTH],
+        'checked_at': time.time(),
+    }
+
+
+def _result_ttl(result):
+    if result['valid']:
+        return settings.TOKEN_HEALTH_TTL['valid']
+    if result['status_code'] is None:
+        return settings.TOKEN_HEALTH_TTL['unreachable']
+    return settings.TOKEN_HEALTH_TTL['invalid']
+
+
+def _store(result):
+    # Kept in the cache longer than its TTL so that a stale result can be served during a re-check.
+    cache.set(CACHE_KEY, result, timeout=_result_ttl(result) + settings.TOKEN_HEALTH_STALE_GRACE)
+    return result
+
+
+def refresh():
+    """Checks the token now and stores the result for every worker."""
+    try:
+        return _store(check_token())
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def _refresh_in_background():
+    if cache.add(LOCK_KEY, True, timeout=LOCK_TIMEOUT):
+        threading.Thread(target=scheduler.background_job(refresh), name='token-health-refresh', daemon=True).start()
+
+
+def get_token_health():
+    """
+    Returns the last token check result (see check_token()), checking the token only when no
+    fresh result is cached. A stale successful result is returned as is and re-checked in the
+    background; a stale failure is re-checked before returning.
+    """
+    result = cache.get(CACHE_KEY)
+    if result is not None:
+        if time.time() - result['checked_at'] < _result_ttl(result):
+            return result
+        if result['valid']:
+            _refresh_in_background()
+            return result
+        # A stale failure is not served: the token or Snipe-IT may be fixed by now.
+
+    if cache.add(LOCK_KEY, True, timeout=LOCK_TIMEOUT):
+        return refresh()
+
+    # Another worker is checking the token right now: wait for its result.
+    previous_check = result['checked_at'] if result is not None else 0
+    give_up_at = time.monotonic() + WAIT_FOR_OTHER_CHECK
+    while time.monotonic() < give_up_at:
+        time.sleep(0.1)
+        result = cache.get(CACHE_KEY)
+        if result is not None and result['checked_at'] > previous_check:
+            return result
+    return _store(check_token())
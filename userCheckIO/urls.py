@@ -6,10 +6,21 @@ urlpatterns = [
     path("admin_login/", views.login_view, name="admin_login"),
     path("logout/", views.logout_view, name="logout"), 
     path("user_assets/", views.user_asset_view, name="user_asset_view"),
+    path("search/", views.search_view, name="search"),
+    path("prefetch/", views.prefetch_view, name="prefetch"),
+    path("health/ready/", views.readiness_view, name="readiness"),
+    path("history/holder/", views.history_holder_view, name="history_holder"),
+    path("history/headcount/", views.history_headcount_view, name="history_headcount"),
+    path("webhooks/snipeit/", views.snipeit_webhook_view, name="snipeit_webhook"),
     path("assets/featured/", views.filtered_asset_list_view, name="featured_asset_list"),
+    path("stats/", views.inventory_stats_view, name="inventory_stats"),
     # URLs for assign/unassign actions
     path("user/<int:user_id>/assign/", views.assign_asset_to_user_view, name="assign_asset"),
     path("asset/<int:asset_id>/unassign/", views.unassign_asset_from_user_view, name="unassign_asset"), # Kept for direct unassignment if still used
     path('user/<int:user_id>/unassign_by_tag/', views.unassign_asset_by_tag_view, name='unassign_asset_by_tag'),
+    path("reports/batch/", views.batch_asset_report_view, name="batch_asset_report"),
+    path("profiles/", views.profiles_view, name="profiles"),
+    path("audit/", views.audit_log_view, name="audit_log"),
+    path("profiles/<str:file_name>", views.profile_download_view, name="profile_download"),
     path("configure_categories/", views.configure_asset_categories_view, name="configure_asset_categories"),
 ]
\ No newline at end of file
@@ -1,84 +1,207 @@
 from django.shortcuts import render, redirect
+from django.template.loader import render_to_string
 from django.urls import reverse # Added for named URL reversal with query params
 from django.conf import settings
 import requests, json
-from django.http import HttpResponse # Added for potential intermediate use
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse # Added for potential intermediate use
 from django.contrib import messages # Added for Django messaging framework
-from .forms import LoginForm, EmployeeNumberForm, AssignAssetForm, UnassignAssetForm, CategoryConfigForm
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import hmac
+import logging
+import os
+from .forms import LoginForm, EmployeeNumberForm, AssignAssetForm, UnassignAssetForm, CategoryConfigForm, EmployeeBatchForm
 from .decorators import admin_required
-from .models import AssetCategoryConfiguration
-from .utils import get_nested_value # Import the helper function
+from .models import AssetCategoryConfiguration, AssignmentAudit
+from .streaming import render_streaming, chunked
+from .search_index import get_search_index
+from .facets import selections_from_querydict
+from . import audit_log, backends, batch_report, cache_events, deadline, featured_snapshot, inventory_history, inventory_stats, prefetch, profiling, row_cache, scheduler, snipeit_cache, structured_logging, token_health
+
+logger = logging.getLogger(__name__)
 
 # Replace with your Snipe-IT API URL and token
 API_URL = settings.SNIPEIT_API_URL
 API_TOKEN = settings.SNIPEIT_API_TOKEN
 
+def _streaming_requested(request):
+    """
+    Asset tables are streamed when ASSET_LIST_STREAMING is enabled, or per request with ?stream=1.
+    """
+    stream_param = request.GET.get('stream')
+    if stream_param is not None:
+        return stream_param.lower() in ('1', 'true', 'yes')
+    return settings.ASSET_LIST_STREAMING
+
 def login_view(request):
     form = LoginForm() # Instantiate the form
     if request.method == 'POST':
         # For this simplified "login", we'll assume the act of POSTing
         # to this view is an attempt to "log in" using the pre-configured token.
-        # We need to verify the token with a test API call.
-        # Let's try to fetch user details for the current token holder.
-        # (Using /users endpoint as an example, Snipe-IT might have a /me endpoint)
-        headers = {
-            "Authorization": f"Bearer {API_TOKEN}",
-            "Accept": "application/json",
-        }
-        # Attempting to get the first user as a test. A /hardware endpoint or similar could also be used.
-        # A /users/me endpoint would be ideal if Snipe-IT has one.
-        # Using /api/v1/users/me to check token and get user details
-        me_url = f"{settings.SNIPEIT_API_URL.rstrip('/')}/users/me"
-        try:
-            response = requests.get(me_url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                # Authentication successful
-                # System Authentication successful based on API token validity
-                request.session['snipeit_authenticated'] = True
-                request.session['snipeit_api_token'] = API_TOKEN # Store token if needed for other requests
-                request.session['is_admin'] = False # Explicitly set to False on system login
-
-                # Remove admin_granting_employee_info if it exists from a previous session
-                if 'admin_granting_employee_info' in request.session:
-                    del request.session['admin_granting_employee_info']
-
-                messages.success(request, "System login successful. Admin status will be determined by employee lookup.")
-                return redirect('index') # Redirect to the main index page
-            else:
-                # System Authentication failed
-                if 'snipeit_authenticated' in request.session:
-                    del request.session['snipeit_authenticated']
-                if 'snipeit_api_token' in request.session:
-                    del request.session['snipeit_api_token']
-                if 'is_admin' in request.session:
-                    del request.session['is_admin']
-                if 'admin_granting_employee_info' in request.session:
-                    del request.session['admin_granting_employee_info']
-
-                messages.error(request, f"System API token authentication failed. Status: {response.status_code} - {response.text}")
-                return render(request, 'login.html', {'form': form}) # Re-render login form with error
-        except requests.exceptions.RequestException as e:
-            if 'snipeit_authenticated' in request.session:
-                del request.session['snipeit_authenticated']
-            if 'snipeit_api_token' in request.session:
-                del request.session['snipeit_api_token']
-            if 'is_admin' in request.session:
-                del request.session['is_admin']
+        # The token is the same for every user, so its validity (checked with /users/me)
+        # is cached and shared by all the workers, see token_health.py.
+        health = token_health.get_token_health()
+        if health['valid']:
+            # System Authentication successful based on API token validity
+            request.session['snipeit_authenticated'] = True
+            request.session['snipeit_api_token'] = API_TOKEN # Store token if needed for other requests
+            request.session['is_admin'] = False # Explicitly set to False on system login
+
+            # Remove admin_granting_employee_info if it exists from a previous session
             if 'admin_granting_employee_info' in request.session:
                 del request.session['admin_granting_employee_info']
 
-            messages.error(request, f"Error connecting to Snipe-IT API during system login: {e}")
-            return render(request, 'login.html', {'form': form}) # Re-render login form with error
-    
+            messages.success(request, "System login successful. Admin status will be determined by employee lookup.")
+            return redirect('index') # Redirect to the main index page
+
+        # System Authentication failed
+        if 'snipeit_authenticated' in request.session:
+            del request.session['snipeit_authenticated']
+        if 'snipeit_api_token' in request.session:
+            del request.session['snipeit_api_token']
+        if 'is_admin' in request.session:
+            del request.session['is_admin']
+        if 'admin_granting_employee_info' in request.session:
+            del request.session['admin_granting_employee_info']
+
+        if health['status_code'] is None:
+            messages.error(request, f"Error connecting to Snipe-IT API during system login: {health['detail']}")
+        else:
+            messages.error(request, f"System API token authentication failed. Status: {health['status_code']} - {health['detail']}")
+        return render(request, 'login.html', {'form': form}) # Re-render login form with error
+
     # For a GET request, just show the login page with the form
     # Make sure login.html can display messages.
     return render(request, 'login.html', {'form': form})
 
+def readiness_view(request):
+    """
+    Readiness probe: 200 when the Snipe-IT API token is valid (cached check), 503 otherwise.
+    """
+    health = token_health.get_token_health()
+    return JsonResponse({
+        'ready': health['valid'],
+        'snipeit_reachable': health['status_code'] is not None,
+        'snipeit_status_code': health['status_code'],
+        'checked_at': health['checked_at'],
+    }, status=200 if health['valid'] else 503)
+
+@csrf_exempt
+@require_POST
+def snipeit_webhook_view(request):
+    """
+    Receives asset events (one event object, or {"events": [...]}) and updates the affected
+    cached entries, see cache_events.py. The shared secret SNIPEIT_WEBHOOK_SECRET must be sent
+    in the X-Webhook-Token header (never in the URL, which ends up in access logs).
+    """
+    secret = settings.SNIPEIT_WEBHOOK_SECRET
+    if not secret:
+        return JsonResponse({'error': 'Webhooks are not enabled.'}, status=404)
+    token = request.headers.get('X-Webhook-Token', '')
+    if not hmac.compare_digest(token.encode(), secret.encode()):
+        return JsonResponse({'error': 'Invalid webhook token.'}, status=403)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'The request body is not valid JSON.'}, status=400)
+    raw_events = data.get('events') if isinstance(data, dict) and 'events' in data else [data]
+    if not isinstance(raw_events, list):
+        return JsonResponse({'error': "'events' must be a list."}, status=400)
+
+    # Validate every event before applying any of them
+    try:
+        events = [cache_events.parse_event(raw_event) for raw_event in raw_events]
+    except cache_events.InvalidEvent as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'applied': [cache_events.apply_event(event) for event in events]})
+
 def index(request):
     # Messages are now handled by Django's messaging framework
     # and displayed in the template. No specific context needed here for them.
     form = EmployeeNumberForm()
-    return render(request, 'index.html', {'form': form})
+    return render(request, 'index.html', {'form': form, 'prefetch': settings.PREFETCH})
+
+@require_POST
+def prefetch_view(request):
+    """
+    Prefetch hint sent by the index form while an employee number is typed: the caches of the
+    user's asset page are warmed in the background (see prefetch.py). Answers at once.
+    """
+    if not request.session.get('snipeit_authenticated'):
+        return JsonResponse({'error': 'Authentication required.'}, status=403)
+
+    employee_number = request.POST.get('employee_number', '').strip()
+    if not settings.PREFETCH['enabled'] or not employee_number:
+        return JsonResponse({'started': False}, status=202)
+    return JsonResponse({'started': prefetch.start(employee_number)}, status=202)
+
+def search_view(request):
+    """
+    Typeahead endpoint: /search/?q=<text> returns the assets and users matching the text
+    from the local search index, as JSON. No call is made to Snipe-IT.
+    """
+    if not request.session.get('snipeit_authenticated'):
+        return JsonResponse({'error': 'Authentication required.'}, status=403)
+
+    query = request.GET.get('q', '').strip()
+    limit_str = request.GET.get('limit', '')
+    limit = min(int(limit_str), 50) if limit_str.isdigit() else 10
+
+    if len(query) < settings.SEARCH_MIN_QUERY_LENGTH:
+        results = {'assets': [], 'users': []}
+    else:
+        results = get_search_index().search(query, limit=limit)
+    return JsonResponse({'query': query, **results})
+
+def _parse_date(value, default=None):
+    if not value:
+        return default
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def history_holder_view(request):
+    """
+    /history/holder/?asset=<id or tag>&date=YYYY-MM-DD: who held the asset at the end of that day
+    (today by default), from the daily inventory history. No call is made to Snipe-IT.
+    """
+    if not request.session.get('snipeit_authenticated'):
+        return JsonResponse({'error': 'Authentication required.'}, status=403)
+
+    history = inventory_history.get_history()
+    history.refresh()
+    asset = request.GET.get('asset', '').strip()
+    asset_id = history.asset_ids_by_tag.get(asset)
+    if asset_id is None and asset.isdigit():
+        asset_id = int(asset)
+    if asset_id is None:
+        return JsonResponse({'error': f"Unknown asset '{asset}'."}, status=404)
+    try:
+        day = _parse_date(request.GET.get('date'), default=timezone.localdate())
+    except ValueError:
+        return JsonResponse({'error': 'date must be formatted as YYYY-MM-DD.'}, status=400)
+    return JsonResponse(history.holder(asset_id, day))
+
+def history_headcount_view(request):
+    """
+    /history/headcount/?start=YYYY-MM-DD&end=YYYY-MM-DD[&category=<id>...]: the number of assets,
+    and of assigned assets, of each category on every day of the period (the last 30 days by
+    default), from the daily inventory history.
+    """
+    if not request.session.get('snipeit_authenticated'):
+        return JsonResponse({'error': 'Authentication required.'}, status=403)
+
+    try:
+        end = _parse_date(request.GET.get('end'), default=timezone.localdate())
+        start = _parse_date(request.GET.get('start'), default=end - timedelta(days=29))
+        category_ids = [int(category_id) for category_id in request.GET.getlist('category')]
+        if start > end:
+            raise ValueError("start must not be after end.")
+        result = inventory_history.get_history().headcount(start, end, category_ids)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(result)
 
 def get_user_by_employee_number(employee_number_str):
     """
@@ -88,31 +211,35 @@ def get_user_by_employee_number(employee_number_str):
     if not employee_number_str:
         return None
 
-    headers = {
-        "Authorization": f"Bearer {API_TOKEN}",
-        "Accept": "application/json",
-    }
+    cached_user = snipeit_cache.get_cached_user(employee_number_str)
+    if cached_user is not None:
+        return cached_user
 
-    search_url = f"{API_URL}users?employee_num={employee_number_str}"
-
-    try:
-        response = requests.get(search_url, headers=headers, timeout=100)
-        if response.status_code == 200:
-            data = response.json()
-            rows = data.get('rows', [])
-            for user in rows:
-                # Ensure case-insensitive or exact match as per Snipe-IT's behavior if necessary
-                # Assuming employee_number field in Snipe-IT is reliable for exact match.
-                if user.get('employee_num') == employee_number_str:
-                    return user # Return the first exact match
-            return None # No exact match found
-        else:
-            # Log error or handle specific status codes if needed
-            print(f"Error fetching user: API returned status {response.status_code}")
+    def search_backend(backend):
+        response = backend.get(f"users?employee_num={employee_number_str}", timeout=deadline.timeout(100))
+        if response.status_code != 200:
+            logger.warning("Error fetching user from %s: API returned status %s", backend.name, response.status_code,
+                           extra={'backend': backend.name, 'status_code': response.status_code,
+                                  'body': structured_logging.body_excerpt(response)})
             return None
-    except requests.exceptions.RequestException as e:
-        print(f"RequestException while fetching user: {e}")
-        return None
+        rows = response.json().get('rows', [])
+        for user in rows:
+            # Ensure case-insensitive or exact match as per Snipe-IT's behavior if necessary
+            # Assuming employee_number field in Snipe-IT is reliable for exact match.
+            if user.get('employee_num') == employee_number_str:
+                return backends.tag([user], backend)[0]
+        return None # No exact match found
+
+    # Every Snipe-IT instance is searched in parallel, the first exact match wins
+    for backend, user, error in backends.fan_out(search_backend):
+        if isinstance(error, requests.exceptions.RequestException):
+            logger.warning("RequestException while fetching user from %s: %s", backend.name, error)
+        elif error is not None:
+            raise error
+        elif user is not None:
+            snipeit_cache.cache_user(user)
+            return user
+    return None
 
 
 def get_assets():
@@ -120,7 +247,7 @@ def get_assets():
         "Authorization": f"Bearer {API_TOKEN}",
         "Accept": "application/json",
     }
-    response = requests.get(f"{API_URL}assets", headers=headers)
+    response = scheduler.call(requests.get, f"{API_URL}assets", headers=headers)
     if response.status_code == 200:
         return response.json()
     else:
@@ -135,12 +262,62 @@ def asset_list(request):
     assets = get_assets() # Moved after authentication check
     return render(request, 'asset_list.html', {'assets': assets})
 
+def _filter_assets_by_category(assets_data, category_id):
+    if category_id is None:
+        return assets_data
+    return [
+        asset for asset in assets_data
+        if asset.get('category') and asset['category'].get('id') == category_id
+    ]
+
+def _stream_user_asset_cards(user, selected_category_id):
+    """
+    Generator of rendered asset card fragments for the streaming version of user_asset_view.
+    """
+    user_id = user['id']
+    try:
+        assets_data = snipeit_cache.get_user_assets(user_id, origin=user.get('origin'))
+    except requests.exceptions.RequestException as e:
+        logger.warning("RequestException while fetching assets for user %s: %s", user_id, e)
+        yield render_to_string('partials/stream_notice.html', {'message': f'Could not retrieve assets from Snipe-IT: {e}', 'level': 'danger'})
+        return
+
+    assets_data = _filter_assets_by_category(assets_data, selected_category_id)
+    if not assets_data:
+        yield render_to_string('partials/stream_notice.html', {'message': "No assets currently assigned."})
+        return
+    for chunk in chunked(assets_data, settings.ASSET_LIST_STREAM_CHUNK_SIZE):
+        yield _render_asset_cards(user, chunk)
+
+def _render_asset_cards(user, assets_data):
+    # Cards are cached per asset and updated_at; the unassign link depends on the user
+    manage_assets = backends.is_primary(user)
+    return row_cache.render_rows('partials/asset_card.html', assets_data,
+                                 context={'user': user, 'manage_assets': manage_assets},
+                                 variant=f"user:{user.get('origin')}:{user.get('id')}:{manage_assets}")
+
+def _get_filter_categories(request):
+    """
+    Categories for the filter dropdown of asset_list.html, as (categories, skipped).
+    They are optional: when the request's deadline budget runs low, or Snipe-IT fails, the
+    categories already cached (possibly stale, possibly none) are used and skipped is True.
+    """
+    if deadline.has_time_for_optional():
+        # Shared cache, refreshed by a single worker when stale
+        try:
+            return snipeit_cache.get_categories(), False
+        except requests.exceptions.RequestException as e:
+            logger.warning("RequestException while fetching categories: %s", e)
+    return snipeit_cache.get_cached_categories(), True
+
 def user_asset_view(request):
     employee_number = request.GET.get('employee_number')
     if not employee_number:
         messages.error(request, 'Please provide an employee number.')
         return redirect('index')
 
+    # Served from the caches warmed by the prefetch hint of the index form, once it is done
+    prefetch.wait(employee_number)
     user = get_user_by_employee_number(employee_number)
 
     if user and 'id' in user:
@@ -168,56 +345,48 @@ def user_asset_view(request):
 
         user_id = user['id']
         assets_data = []
-        categories_data = []
-        
-        headers = {
-            "Authorization": f"Bearer {API_TOKEN}",
-            "Accept": "application/json",
-        }
 
-        # Fetch assets for this user
-        user_assets_url = f"{API_URL}users/{user_id}/assets"
-        try:
-            response = requests.get(user_assets_url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                assets_data = response.json().get('rows', [])
-            else:
-                error_msg_api = f"Error fetching assets for user {user_id}: API returned status {response.status_code} - {response.text}"
-                print(error_msg_api)
-                messages.error(request, f'Could not retrieve assets from Snipe-IT. Details: {error_msg_api}')
-        except requests.exceptions.RequestException as e:
-            print(f"RequestException while fetching assets for user {user_id}: {e}")
-            messages.error(request, f'Could not retrieve assets from Snipe-IT due to a network error: {e}')
+        selected_category_id_str = request.GET.get('category_id')
+        selected_category_id = None # Ensure it's defined
+        if selected_category_id_str and selected_category_id_str.isdigit():
+            selected_category_id = int(selected_category_id_str)
+
+        if _streaming_requested(request):
+            # The page header and the category filter are sent right away, the asset cards follow.
+            categories_data, categories_skipped = _get_filter_categories(request)
+            context = {
+                'user': user,
+                # Assets are only assigned and unassigned on the primary Snipe-IT instance
+                'manage_assets': backends.is_primary(user),
+                'assets': [],
+                'categories': categories_data,
+                'categories_skipped': categories_skipped,
+                'selected_category_id': selected_category_id,
+                'employee_number': employee_number,
+            }
+            cards = _stream_user_asset_cards(user, selected_category_id)
+            return render_streaming(request, 'asset_list.html', context, cards)
 
-        # Fetch categories
-        categories_url = f"{API_URL}categories"
+        # Fetch assets for this user (cached for a short time, dropped on checkout/checkin)
         try:
-            response = requests.get(categories_url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                categories_data = response.json().get('rows', [])
-            else:
-                error_msg_api_cat = f"Error fetching categories: API returned status {response.status_code} - {response.text}"
-                print(error_msg_api_cat)
-                messages.error(request, f'Could not retrieve asset categories from Snipe-IT. Details: {error_msg_api_cat}')
+            assets_data = snipeit_cache.get_user_assets(user_id, origin=user.get('origin'))
         except requests.exceptions.RequestException as e:
-            print(f"RequestException while fetching categories: {e}")
-            messages.error(request, f'Could not retrieve asset categories from Snipe-IT due to a network error: {e}')
+            logger.warning("RequestException while fetching assets for user %s: %s", user_id, e)
+            messages.error(request, f'Could not retrieve assets from Snipe-IT: {e}')
 
-        selected_category_id_str = request.GET.get('category_id')
-        filtered_assets = assets_data
-        selected_category_id = None # Ensure it's defined
+        filtered_assets = _filter_assets_by_category(assets_data, selected_category_id)
+
+        # Categories only feed the filter dropdown, so they are fetched after the assets
+        categories_data, categories_skipped = _get_filter_categories(request)
 
-        if selected_category_id_str and selected_category_id_str.isdigit():
-            selected_category_id = int(selected_category_id_str)
-            filtered_assets = [
-                asset for asset in assets_data 
-                if asset.get('category') and asset['category'].get('id') == selected_category_id
-            ]
-        
         context = {
             'user': user,
+            # Assets are only assigned and unassigned on the primary Snipe-IT instance
+            'manage_assets': backends.is_primary(user),
             'assets': filtered_assets,
+            'cards_html': _render_asset_cards(user, filtered_assets),
             'categories': categories_data,
+            'categories_skipped': categories_skipped,
             'selected_category_id': selected_category_id,
             'employee_number': employee_number, # For displaying in template or pre-filling form
         }
@@ -243,6 +412,58 @@ def logout_view(request):
     messages.info(request, "You have been successfully logged out.")
     return redirect('index')
 
+def _resolve_asset_by_tag(request, asset_tag):
+    """
+    Resolves an asset tag to (asset_id, asset_data), using the shared tag cache before calling
+    /hardware/bytag. asset_data is None when the id came from the cache.
+    Error messages are added to the request and (None, None) is returned when the tag cannot be resolved.
+    """
+    cached_asset_id = snipeit_cache.get_cached_asset_id_for_tag(asset_tag)
+    if cached_asset_id is not None:
+        return cached_asset_id, None
+
+    headers = {
+        "Authorization": f"Bearer {API_TOKEN}",
+        "Accept": "application/json",
+    }
+    # Assuming /hardware/bytag/{asset_tag} is the endpoint.
+    # If it's /hardware?search={asset_tag}, response handling might need adjustment
+    # to pick the correct asset from a list or handle multiple matches.
+    asset_by_tag_url = f"{API_URL}hardware/bytag/{asset_tag}"
+    asset_id = None
+    asset_data = None
+    try:
+        asset_response = scheduler.call(requests.get, asset_by_tag_url, headers=headers, timeout=deadline.timeout(10))
+        if asset_response.status_code == 200:
+            fetched_asset_data = asset_response.json()
+            # Check if the response is a direct asset object or a list (like from a search)
+            if isinstance(fetched_asset_data, dict) and 'id' in fetched_asset_data: # Direct object
+                asset_id = fetched_asset_data.get('id')
+                asset_data = fetched_asset_data
+            elif isinstance(fetched_asset_data, dict) and 'rows' in fetched_asset_data and len(fetched_asset_data['rows']) == 1: # Search result with one match
+                asset_id = fetched_asset_data['rows'][0].get('id')
+                asset_data = fetched_asset_data['rows'][0]
+            else:
+                # Handle cases: not found, or multiple assets found if API behaves that way
+                if isinstance(fetched_asset_data, dict) and fetched_asset_data.get('total', 0) > 1:
+                     messages.error(request, f"Multiple assets found for tag '{asset_tag}'. Please use a unique tag.")
+                else:
+                     messages.error(request, f"Asset with tag '{asset_tag}' not found or API response format unclear.")
+
+        elif asset_response.status_code == 404:
+             messages.error(request, f"Asset with tag '{asset_tag}' not found (404).")
+        else:
+            logger.warning("Error fetching asset by tag %s: API returned status %s", asset_tag, asset_response.status_code,
+                           extra={'status_code': asset_response.status_code, 'body': structured_logging.body_excerpt(asset_response)})
+            messages.error(request, f"Error fetching asset by tag '{asset_tag}'. API Status: {asset_response.status_code} - {structured_logging.truncate(asset_response.text)}")
+
+    except requests.exceptions.RequestException as e:
+        messages.error(request, f"Network error fetching asset by tag '{asset_tag}': {e}")
+
+    if asset_id is not None:
+        snipeit_cache.cache_asset_id_for_tag(asset_tag, asset_id)
+    return asset_id, asset_data
+
 def assign_asset_to_user_view(request, user_id):
     headers = {
         "Authorization": f"Bearer {API_TOKEN}",
@@ -254,7 +475,7 @@ def assign_asset_to_user_view(request, user_id):
     user_to_assign_data = None
     user_url = f"{API_URL}users/{user_id}"
     try:
-        user_response = requests.get(user_url, headers=headers, timeout=10)
+        user_response = scheduler.call(requests.get, user_url, headers=headers, timeout=deadline.timeout(10))
         if user_response.status_code == 200:
             user_to_assign_data = user_response.json()
         else:
@@ -266,19 +487,12 @@ def assign_asset_to_user_view(request, user_id):
 
     # Fetch all asset-type categories from Snipe-IT for the form choices
     category_choices_for_form = []
-    categories_url = f"{API_URL}categories?limit=500&sort=name&order=asc"
     try:
-        get_only_headers = {key: value for key, value in headers.items() if key != "Content-Type"}
-        categories_response = requests.get(categories_url, headers=get_only_headers, timeout=10)
-        if categories_response.status_code == 200:
-            snipeit_categories_data = categories_response.json().get('rows', [])
-            # Filter for asset type categories and ensure they have id and name, convert ID to string for form
-            category_choices_for_form = [
-                (str(cat['id']), cat['name']) for cat in snipeit_categories_data
-                if cat.get('category_type') == 'asset' and cat.get('id') is not None and cat.get('name') is not None
-            ]
-        else:
-            messages.error(request, f"Could not fetch asset categories from Snipe-IT: Status {categories_response.status_code}")
+        # Filter for asset type categories and ensure they have id and name, convert ID to string for form
+        category_choices_for_form = [
+            (str(cat['id']), cat['name']) for cat in snipeit_cache.get_categories()
+            if cat.get('category_type') == 'asset' and cat.get('id') is not None and cat.get('name') is not None
+        ]
     except requests.exceptions.RequestException as e:
         messages.error(request, f"Error connecting to Snipe-IT to fetch categories: {e}")
 
@@ -291,46 +505,10 @@ def assign_asset_to_user_view(request, user_id):
         if form.is_valid(): # Form was already instantiated with potentially filtered choices
             asset_tag_to_find = form.cleaned_data['asset_tag']
 
-            # Fetch asset by tag from Snipe-IT
-            # Assuming /hardware/bytag/{asset_tag} is the endpoint.
-            # If it's /hardware?search={asset_tag}, response handling might need adjustment
-            # to pick the correct asset from a list or handle multiple matches.
-            asset_by_tag_url = f"{API_URL}hardware/bytag/{asset_tag_to_find}"
-            # Remove Content-Type for GET request to fetch asset by tag
-            get_headers = {k: v for k, v in headers.items() if k != "Content-Type"}
-
-            asset_id_to_assign = None
-            asset_data_for_validation = None # To store asset data for category check
-            try:
-                asset_response = requests.get(asset_by_tag_url, headers=get_headers, timeout=10)
-                if asset_response.status_code == 200:
-                    fetched_asset_data = asset_response.json()
-                    # Check if the response is a direct asset object or a list (like from a search)
-                    if isinstance(fetched_asset_data, dict) and 'id' in fetched_asset_data: # Direct object
-                        asset_id_to_assign = fetched_asset_data.get('id')
-                        asset_data_for_validation = fetched_asset_data
-                    elif isinstance(fetched_asset_data, dict) and 'rows' in fetched_asset_data and len(fetched_asset_data['rows']) == 1: # Search result with one match
-                        asset_id_to_assign = fetched_asset_data['rows'][0].get('id')
-                        asset_data_for_validation = fetched_asset_data['rows'][0]
-                    elif isinstance(fetched_asset_data, dict) and 'total' in fetched_asset_data and fetched_asset_data['total'] == 1 and 'rows' in fetched_asset_data and len(fetched_asset_data['rows']) == 1: # Another common search result pattern
-                        asset_id_to_assign = fetched_asset_data['rows'][0].get('id')
-                        asset_data_for_validation = fetched_asset_data['rows'][0]
-                    else:
-                        # Handle cases: not found, or multiple assets found if API behaves that way
-                        if isinstance(fetched_asset_data, dict) and fetched_asset_data.get('total', 0) > 1:
-                             messages.error(request, f"Multiple assets found for tag '{asset_tag_to_find}'. Please use a unique tag.")
-                        else:
-                             messages.error(request, f"Asset with tag '{asset_tag_to_find}' not found or API response format unclear.")
-
-                elif asset_response.status_code == 404:
-                     messages.error(request, f"Asset with tag '{asset_tag_to_find}' not found (404).")
-                else:
-                    messages.error(request, f"Error fetching asset by tag '{asset_tag_to_find}'. API Status: {asset_response.status_code} - {asset_response.text}")
+            # Fetch asset by tag from Snipe-IT (or from the tag cache)
+            asset_id_to_assign, _asset_data = _resolve_asset_by_tag(request, asset_tag_to_find)
 
-            except requests.exceptions.RequestException as e:
-                messages.error(request, f"Network error fetching asset by tag '{asset_tag_to_find}': {e}")
-
-            if asset_id_to_assign and asset_data_for_validation:
+            if asset_id_to_assign:
                # Proceed with checkout
                 checkout_url = f"{API_URL}hardware/{asset_id_to_assign}/checkout"
                 payload = {
@@ -340,10 +518,13 @@ def assign_asset_to_user_view(request, user_id):
                 }
                 try:
                     # Use original headers with Content-Type for POST
-                    response = requests.post(checkout_url, headers=headers, json=payload, timeout=10)
+                    with audit_log.recording(request, audit_log.CHECKOUT, asset_tag_to_find, asset_id_to_assign, user_id) as audit:
+                        response = audit.response = scheduler.call(requests.post, checkout_url, headers=headers, json=payload, timeout=deadline.timeout(10))
                     if response.status_code == 200:
                         response_data = response.json()
                         if response_data.get('status') == 'success':
+                            snipeit_cache.invalidate_user_assets(user_id)
+                            inventory_stats.set_assigned(asset_id_to_assign, True)
                             messages.success(request, f"Asset tag '{asset_tag_to_find}' (ID: {asset_id_to_assign}) assigned successfully to user {user_to_assign_data.get('name', user_id)}.")
                             employee_number = user_to_assign_data.get('employee_number')
                             if employee_number:
@@ -353,10 +534,12 @@ def assign_asset_to_user_view(request, user_id):
                             api_message = response_data.get('messages', 'Unknown error from Snipe-IT API.')
                             messages.error(request, f"Failed to assign asset: {api_message}")
                     else:
-                        messages.error(request, f"Failed to assign asset. Snipe-IT API returned status {response.status_code}. Response: {response.text}")
+                        logger.warning("Checkout of asset %s failed: API returned status %s", asset_id_to_assign, response.status_code,
+                                       extra={'status_code': response.status_code, 'body': structured_logging.body_excerpt(response)})
+                        messages.error(request, f"Failed to assign asset. Snipe-IT API returned status {response.status_code}. Response: {structured_logging.truncate(response.text)}")
                 except requests.exceptions.RequestException as e:
                     messages.error(request, f"Error during asset assignment: {e}")
-            # If asset_id_to_assign is None, or asset_data_for_validation is None, or category validation failed and form error was added,
+            # If asset_id_to_assign is None, or category validation failed and form error was added,
             # messages/form errors are already set. The form will be re-rendered below.
             # No explicit 'else' needed here as the context rendering is the default fall-through.
 
@@ -386,7 +569,7 @@ def unassign_asset_from_user_view(request, asset_id):
     original_user_id = None
     asset_details_url = f"{API_URL}hardware/{asset_id}"
     try:
-        asset_response = requests.get(asset_details_url, headers=headers, timeout=10)
+        asset_response = scheduler.call(requests.get, asset_details_url, headers=headers, timeout=deadline.timeout(10))
         if asset_response.status_code == 200:
             asset_data = asset_response.json()
             if asset_data.get('assigned_to') and isinstance(asset_data['assigned_to'], dict):
@@ -396,7 +579,7 @@ def unassign_asset_from_user_view(request, asset_id):
                 # For now, this should cover most cases if employee_number is populated in Snipe-IT
                 if not employee_number and original_user_id: # Attempt to get user details for employee_number
                     user_url = f"{API_URL}users/{original_user_id}"
-                    user_resp = requests.get(user_url, headers=headers, timeout=5)
+                    user_resp = scheduler.call(requests.get, user_url, headers=headers, timeout=deadline.timeout(5))
                     if user_resp.status_code == 200:
                         employee_number = user_resp.json().get('employee_number')
         else:
@@ -411,10 +594,13 @@ def unassign_asset_from_user_view(request, asset_id):
     payload = {"note": "Unassigned via asset management app."}
 
     try:
-        response = requests.post(checkin_url, headers=headers, json=payload, timeout=10)
+        with audit_log.recording(request, audit_log.CHECKIN, asset_data.get('asset_tag'), asset_id, original_user_id) as audit:
+            response = audit.response = scheduler.call(requests.post, checkin_url, headers=headers, json=payload, timeout=deadline.timeout(10))
         if response.status_code == 200:
             response_data = response.json()
             if response_data.get('status') == 'success':
+                snipeit_cache.invalidate_user_assets(original_user_id)
+                inventory_stats.set_assigned(asset_id, False)
                 messages.success(request, "Asset unassigned successfully.")
                 if employee_number:
                     return redirect(reverse('user_asset_view') + f'?employee_number={employee_number}')
@@ -423,7 +609,9 @@ def unassign_asset_from_user_view(request, asset_id):
                 api_message = response_data.get('messages', 'Unknown error from API.')
                 messages.error(request, f"Failed to unassign asset: {api_message}")
         else:
-            messages.error(request, f"Failed to unassign asset. Snipe-IT API returned status {response.status_code}. Response: {response.text}")
+            logger.warning("Checkin of asset %s failed: API returned status %s", asset_id, response.status_code,
+                           extra={'status_code': response.status_code, 'body': structured_logging.body_excerpt(response)})
+            messages.error(request, f"Failed to unassign asset. Snipe-IT API returned status {response.status_code}. Response: {structured_logging.truncate(response.text)}")
     except requests.exceptions.RequestException as e:
         messages.error(request, f"Error during asset unassignment: {e}")
 
@@ -447,7 +635,7 @@ def unassign_asset_by_tag_view(request, user_id):
     try:
         # Use headers without Content-Type for this GET request
         get_headers = {k: v for k, v in headers.items() if k != "Content-Type"}
-        user_response = requests.get(user_url, headers=get_headers, timeout=10)
+        user_response = scheduler.call(requests.get, user_url, headers=get_headers, timeout=deadline.timeout(10))
         if user_response.status_code == 200:
             user_context_data = user_response.json()
         else:
@@ -463,37 +651,13 @@ def unassign_asset_by_tag_view(request, user_id):
         if form.is_valid():
             asset_tag_to_unassign = form.cleaned_data['asset_tag']
 
-            asset_id_to_unassign = None
-            # Fetch asset by tag from Snipe-IT to get its ID
-            asset_by_tag_url = f"{API_URL}hardware/bytag/{asset_tag_to_unassign}"
-            get_headers = {k: v for k, v in headers.items() if k != "Content-Type"} # Ensure no content-type for GET
-
-            try:
-                asset_response = requests.get(asset_by_tag_url, headers=get_headers, timeout=10)
-                if asset_response.status_code == 200:
-                    asset_data = asset_response.json()
-                    if isinstance(asset_data, dict) and 'id' in asset_data:
-                        asset_id_to_unassign = asset_data.get('id')
-                        # Optional: Check if asset is assigned to the user_context_data.id if needed
-                        # current_assignee_id = asset_data.get('assigned_to', {}).get('id')
-                        # if current_assignee_id != user_id:
-                        #    messages.warning(request, f"Asset {asset_tag_to_unassign} is not assigned to {user_context_data.get('name', 'this user')}.")
-                            # Decide if to proceed or stop
-                    elif isinstance(asset_data, dict) and 'rows' in asset_data and len(asset_data['rows']) == 1:
-                        asset_id_to_unassign = asset_data['rows'][0].get('id')
-                    elif isinstance(asset_data, dict) and 'total' in asset_data and asset_data['total'] == 1 and 'rows' in asset_data and len(asset_data['rows']) == 1:
-                        asset_id_to_unassign = asset_data['rows'][0].get('id')
-                    else:
-                        if isinstance(asset_data, dict) and asset_data.get('total', 0) > 1:
-                            messages.error(request, f"Multiple assets found for tag '{asset_tag_to_unassign}'. Please use a unique tag.")
-                        else:
-                            messages.error(request, f"Asset with tag '{asset_tag_to_unassign}' not found or API response format unclear.")
-                elif asset_response.status_code == 404:
-                    messages.error(request, f"Asset with tag '{asset_tag_to_unassign}' not found (404).")
-                else:
-                    messages.error(request, f"Error fetching asset by tag '{asset_tag_to_unassign}'. API Status: {asset_response.status_code} - {asset_response.text}")
-            except requests.exceptions.RequestException as e:
-                messages.error(request, f"Network error fetching asset by tag '{asset_tag_to_unassign}': {e}")
+            # Fetch asset by tag from Snipe-IT (or from the tag cache) to get its ID
+            asset_id_to_unassign, asset_data = _resolve_asset_by_tag(request, asset_tag_to_unassign)
+            # Optional: Check if asset is assigned to the user_context_data.id if needed
+            # current_assignee_id = asset_data.get('assigned_to', {}).get('id')
+            # if current_assignee_id != user_id:
+            #    messages.warning(request, f"Asset {asset_tag_to_unassign} is not assigned to {user_context_data.get('name', 'this user')}.")
+                # Decide if to proceed or stop
 
             if asset_id_to_unassign:
                 # Proceed with check-in (unassignment)
@@ -502,10 +666,16 @@ def unassign_asset_by_tag_view(request, user_id):
                 post_headers = {**headers, "Content-Type": "application/json"}
 
                 try:
-                    response = requests.post(checkin_url, headers=post_headers, json=payload, timeout=10)
+                    with audit_log.recording(request, audit_log.CHECKIN, asset_tag_to_unassign, asset_id_to_unassign, user_id) as audit:
+                        response = audit.response = scheduler.call(requests.post, checkin_url, headers=post_headers, json=payload, timeout=deadline.timeout(10))
                     if response.status_code == 200:
                         response_data = response.json()
                         if response_data.get('status') == 'success':
+                            snipeit_cache.invalidate_user_assets(user_id)
+                            if asset_data and isinstance(asset_data.get('assigned_to'), dict):
+                                # The asset may have been held by someone else than the user in context
+                                snipeit_cache.invalidate_user_assets(asset_data['assigned_to'].get('id'))
+                            inventory_stats.set_assigned(asset_id_to_unassign, False)
                             messages.success(request, f"Asset tag '{asset_tag_to_unassign}' (ID: {asset_id_to_unassign}) unassigned successfully.")
                             employee_number = user_context_data.get('employee_number')
                             if employee_number:
@@ -516,7 +686,9 @@ def unassign_asset_by_tag_view(request, user_id):
                             api_message = response_data.get('messages', 'Unknown error from Snipe-IT API.')
                             messages.error(request, f"Failed to unassign asset: {api_message}")
                     else:
-                        messages.error(request, f"Failed to unassign asset. Snipe-IT API returned status {response.status_code}. Response: {response.text}")
+                        logger.warning("Checkin of asset %s failed: API returned status %s", asset_id_to_unassign, response.status_code,
+                                       extra={'status_code': response.status_code, 'body': structured_logging.body_excerpt(response)})
+                        messages.error(request, f"Failed to unassign asset. Snipe-IT API returned status {response.status_code}. Response: {structured_logging.truncate(response.text)}")
                 except requests.exceptions.RequestException as e:
                     messages.error(request, f"Error during asset unassignment: {e}")
             # If asset_id_to_unassign is None, error messages are already set. Re-render form.
@@ -531,24 +703,14 @@ def unassign_asset_by_tag_view(request, user_id):
 
 @admin_required
 def configure_asset_categories_view(request):
-    headers = {
-        "Authorization": f"Bearer {API_TOKEN}", # Assuming API_TOKEN is globally defined or accessible
-        "Accept": "application/json",
-    }
     category_choices_list = []
-    categories_url = f"{API_URL}categories?limit=500&sort=name&order=asc" # Get all, sort for display
     try:
-        categories_response = requests.get(categories_url, headers=headers, timeout=10)
-        if categories_response.status_code == 200:
-            categories_data = categories_response.json().get('rows', [])
-            # Removed cat.get('category_type') == 'asset' filter.
-            # Now includes all categories that have an id and a name.
-            category_choices_list = [
-                (str(cat['id']), cat['name']) for cat in categories_data
-                if cat.get('id') is not None and cat.get('name') is not None
-            ]
-        else:
-            messages.error(request, f"Failed to fetch asset categories from Snipe-IT: Status {categories_response.status_code}")
+        # Removed cat.get('category_type') == 'asset' filter.
+        # Now includes all categories that have an id and a name.
+        category_choices_list = [
+            (str(cat['id']), cat['name']) for cat in snipeit_cache.get_categories()
+            if cat.get('id') is not None and cat.get('name') is not None
+        ]
     except requests.exceptions.RequestException as e:
         messages.error(request, f"Error connecting to Snipe-IT to fetch categories: {e}")
 
@@ -575,72 +737,156 @@ def configure_asset_categories_view(request):
     return render(request, 'configure_asset_categories.html', {'form': form})
 
 
+@admin_required
+def batch_asset_report_view(request):
+    """
+    Asset report for a list of employees uploaded as CSV, streamed as a web page or a CSV file.
+    See batch_report.py for how lookups are batched.
+    """
+    if request.method != 'POST':
+        return render(request, 'batch_asset_report.html', {'form': EmployeeBatchForm()})
+
+    form = EmployeeBatchForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return render(request, 'batch_asset_report.html', {'form': form})
+    try:
+        employee_numbers = batch_report.read_employee_numbers(form.cleaned_data['employees_file'])
+    except batch_report.BatchInputError as e:
+        messages.error(request, str(e))
+        return render(request, 'batch_asset_report.html', {'form': form})
+    if not employee_numbers:
+        messages.warning(request, "The uploaded file does not contain any employee number.")
+        return render(request, 'batch_asset_report.html', {'form': form})
+
+    results = batch_report.iter_employee_assets(employee_numbers, get_user_by_employee_number)
+
+    if form.cleaned_data['report_format'] == 'csv':
+        response = StreamingHttpResponse(batch_report.iter_csv(results), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="asset_report.csv"'
+        return response
+
+    def rendered_rows():
+        for result in results:
+            yield render_to_string('partials/batch_report_rows.html', {'rows': batch_report.report_rows(*result)})
+
+    context = {
+        'form': EmployeeBatchForm(),
+        'employee_count': len(employee_numbers),
+        'column_headers': batch_report.REPORT_COLUMNS,
+    }
+    return render_streaming(request, 'batch_asset_report.html', context, rendered_rows())
+
+
+def inventory_stats_view(request):
+    """
+    Dashboard of the asset counts by category, status, model and assignment, for all the assets
+    and for the featured categories. Only read from the incrementally maintained counts, see
+    inventory_stats.py: a view never calls Snipe-IT.
+    """
+    featured_category_ids = [int(category_id) for category_id in AssetCategoryConfiguration.load().allowed_category_ids]
+    payload, is_stale = inventory_stats.get_stats()
+    if is_stale:
+        inventory_stats.rebuild_in_background()
+    context = {'stats_pending': payload is None}
+    if payload is not None:
+        context['all_assets'] = inventory_stats.summarize(payload)
+        if featured_category_ids:
+            context['featured_assets'] = inventory_stats.summarize(payload, featured_category_ids)
+    return render(request, 'inventory_stats.html', context)
+
 def filtered_asset_list_view(request):
     config = AssetCategoryConfiguration.load()
     featured_category_ids = config.allowed_category_ids # These are integers
     display_properties_config = settings.NEW_ASSET_LIST_DISPLAY_PROPERTIES
+    column_headers = ["Assigned To", "Category"] + [prop['label'] for prop in display_properties_config]
 
-    all_raw_assets_from_api = []
+    context = {
+        'assets': [],
+        'column_headers': column_headers,
+        'featured_category_ids': featured_category_ids, # For display or debugging if needed
+        'page_title': "Featured Assets by Category"
+    }
 
     if not featured_category_ids:
         messages.info(request, "No featured categories have been configured by the administrator. Please select categories in the 'Configure Featured Categories' admin page to see assets here.")
-    else:
-        headers = {
-            "Authorization": f"Bearer {API_TOKEN}",
-            "Accept": "application/json",
-        }
-        for category_id in featured_category_ids:
-            # Ensure category_id is an integer for the API call
-            assets_url = f"{API_URL}hardware?category_id={int(category_id)}&limit=200&sort=name&order=asc"
-            try:
-                response = requests.get(assets_url, headers=headers, timeout=15)
-                if response.status_code == 200:
-                    assets_data = response.json().get('rows', [])
-                    all_raw_assets_from_api.extend(assets_data)
-                else:
-                    messages.error(request, f"Failed to fetch assets for category ID {category_id}. Snipe-IT API status: {response.status_code} - {response.text}")
-            except requests.exceptions.RequestException as e:
-                messages.error(request, f"Error connecting to Snipe-IT API for category ID {category_id}: {e}")
-
-    processed_assets_list = []
-    # Deduplicate assets based on ID, in case an asset is in multiple featured categories
-    # (though Snipe-IT typically assigns an asset to a single category)
-    seen_asset_ids = set()
-    unique_raw_assets = []
-    for asset_data in all_raw_assets_from_api:
-        asset_id = asset_data.get('id')
-        if asset_id and asset_id not in seen_asset_ids:
-            unique_raw_assets.append(asset_data)
-            seen_asset_ids.add(asset_id)
-
-    for asset_data in unique_raw_assets:
-        processed_asset = {'id': asset_data.get('id'), 'raw': asset_data} # Store raw for potential future use in template
-
-        assigned_to_info = asset_data.get('assigned_to')
-        if assigned_to_info and isinstance(assigned_to_info, dict):
-            processed_asset['assigned_to_name'] = assigned_to_info.get('name')
-            processed_asset['assigned_to_type'] = assigned_to_info.get('type')
-        else:
-            processed_asset['assigned_to_name'] = None
-            processed_asset['assigned_to_type'] = None
-
-        processed_asset['category_name'] = get_nested_value(asset_data, 'category.name')
+        return render(request, 'filtered_asset_list.html', context)
+
+    # The list is only read from its materialized snapshot: a view never calls Snipe-IT.
+    # A stale or missing snapshot is rebuilt in the background, see featured_snapshot.py.
+    snapshot, is_stale = featured_snapshot.get_snapshot(featured_category_ids)
+    if is_stale:
+        featured_snapshot.refresh_in_background()
+    if snapshot is None:
+        context['snapshot_pending'] = True
+        return render(request, 'filtered_asset_list.html', context)
+
+    for error_message in snapshot['errors']:
+        messages.error(request, error_message)
+    context['refreshed_at'] = datetime.fromtimestamp(snapshot['refreshed_at'], tz=dt_timezone.utc)
+    context['total_asset_count'] = snapshot['asset_count']
+    context['shown_asset_count'] = snapshot['asset_count']
+    context['facets'] = snapshot['facets']
+
+    facet_selections = selections_from_querydict(request.GET)
+    facet_index = featured_snapshot.get_facet_index(featured_category_ids) if facet_selections else None
+    if facet_index is None:
+        if facet_selections:
+            messages.warning(request, "Filters are unavailable until the featured list has been fully refreshed.")
+        context['rows_html'] = snapshot['rows_html']
+        return render(request, 'filtered_asset_list.html', context)
+
+    context['facets'] = facet_index.facet_counts(facet_selections)
+    context['facet_selections'] = facet_selections
+    context['assets'] = facet_index.filter(facet_selections)
+    context['rows_html'] = featured_snapshot.render_rows(context['assets'])
+    context['shown_asset_count'] = len(context['assets'])
+    return render(request, 'filtered_asset_list.html', context)
 
-        processed_asset['properties'] = []
-        for prop_config in display_properties_config:
-            value = get_nested_value(asset_data, prop_config['path'])
-            processed_asset['properties'].append({
-                'label': prop_config['label'],
-                'value': value if value is not None else ''
-            })
-        processed_assets_list.append(processed_asset)
 
-    column_headers = ["Assigned To", "Category"] + [prop['label'] for prop in display_properties_config]
+@admin_required
+def profiles_view(request):
+    """Lists the slowest of the recent request profiles (see profiling.py)."""
+    context = {
+        'profiles': profiling.slowest_profiles(),
+        'categories': list(profiling.CATEGORIES),
+        'sample_rate': settings.PROFILING['sample_rate'],
+    }
+    return render(request, 'profiles.html', context)
 
+@admin_required
+def audit_log_view(request):
+    """The checkouts and checkins made with this app, newest first, filtered by tag, user, operator, action, result and period."""
     context = {
-        'assets': processed_assets_list,
-        'column_headers': column_headers,
-        'featured_category_ids': featured_category_ids, # For display or debugging if needed
-        'page_title': "Featured Assets by Category"
+        'filters': {param: request.GET.get(param, '').strip() for param in audit_log.FILTERS},
+        'since': request.GET.get('since', ''),
+        'until': request.GET.get('until', ''),
+        'action_choices': AssignmentAudit.ACTION_CHOICES,
+        'result_choices': AssignmentAudit.RESULT_CHOICES,
+        'pending_count': len(audit_log.audit_buffer),
+        'entries': [],
     }
-    return render(request, 'filtered_asset_list.html', context)
\ No newline at end of file
+    try:
+        since = _parse_date(context['since'])
+        until = _parse_date(context['until'])
+        before = int(request.GET['before']) if request.GET.get('before') else None
+        context['entries'], next_before = audit_log.query(
+            request.GET,
+            since=timezone.make_aware(datetime.combine(since, datetime.min.time())) if since else None,
+            until=timezone.make_aware(datetime.combine(until + timedelta(days=1), datetime.min.time())) if until else None,
+            before=before,
+        )
+    except ValueError:
+        messages.error(request, "Invalid filter: dates must be formatted as YYYY-MM-DD, user and page as numbers.")
+    else:
+        if next_before is not None:
+            next_params = request.GET.copy()
+            next_params['before'] = next_before
+            context['next_page_query'] = next_params.urlencode()
+    return render(request, 'audit_log.html', context)
+
+@admin_required
+def profile_download_view(request, file_name):
+    path = profiling.profile_path(file_name)
+    if path is None or not os.path.exists(path):
+        raise Http404("Unknown profile.")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=file_name)
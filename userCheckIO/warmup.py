@@ -0,0 +1,185 @@
+"""
+Cache warm-up and on-disk snapshot of the cached Snipe-IT datasets.
+
+After a deploy the shared cache may be empty (new host, new CACHE_PATH) and every worker starts
+without decoded datasets, so the first requests used to wait for the categories, the user
+directory and the featured asset list to be fetched from Snipe-IT. Warm-up runs in two steps:
+
+1. load_snapshot() restores the datasets from the snapshot file written by the previous warm-up.
+   The file is memory-mapped and each dataset is a separately compressed block, so this takes
+   milliseconds and only touches the pages of the datasets actually restored. Restored datasets
+   keep their original refresh time, they are revalidated on their normal schedule.
+2. warm_up() refreshes the stale datasets from Snipe-IT (only one worker does it, see
+   WARMUP_LOCK_KEY) and writes a new snapshot.
+
+start_background_warmup() does step 1 synchronously and step 2 in a background thread. It is
+called from UsercheckioConfig.ready() when CACHE_WARMUP_ON_STARTUP is set; `python manage.py
+warm_cache` runs both steps in the foreground.
+
+Snapshot file layout:
+    MAGIC | index length (8 bytes, little endian) | index (JSON) | blocks
+The index maps each dataset name to its pointer (version, refreshed_at) and to the offset and
+length of its block; a block is the zlib-compressed pickle of the dataset payload.
+"""
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+from . import featured_snapshot, inventory_stats, scheduler, search_index, snipeit_cache
+
+logger = logging.getLogger(__name__)
+
+# Version 2: the featured hardware rows are an AssetStore
+MAGIC = b'SNIPEIT-SNAPSHOT-2\n'
+_INDEX_LENGTH = struct.Struct('<Q')
+
+def _refresh_featured(max_age):
+    featured_snapshot.refresh(max_age)
+
+
+# Dataset name -> function refreshing it from Snipe-IT when it is older than max_age seconds.
+# A function shared by several datasets is run once per warm-up.
+DATASETS = {
+    'categories': lambda max_age: snipeit_cache.get_or_refresh_dataset(
+        'categories', snipeit_cache.load_categories, max_age),
+    'users': lambda max_age: snipeit_cache.get_or_refresh_dataset(
+        'users', snipeit_cache.load_user_directory, max_age),
+    # Both are rebuilt by the featured list refresh
+    'featured_hardware': _refresh_featured,
+    'featured_list': _refresh_featured,
+    'inventory_stats': lambda max_age: inventory_stats.refresh(max_age),
+}
+
+WARMUP_LOCK_KEY = 'lock:warmup'
+WARMUP_LOCK_TIMEOUT = 600
+
+
+def write_snapshot(path=None):
+    """
+    Writes the current version of every dataset to the snapshot file (atomically replaced).
+    Returns the names of the datasets written.
+    """
+    path = str(path or settings.CACHE_SNAPSHOT_PATH)
+    index = {}
+    blocks = []
+    offset = 0
+    for name in DATASETS:
+        payload, pointer = snipeit_cache.get_dataset(name)
+        if payload is None:
+            continue
+        block = zlib.compress(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL), 1)
+        index[name] = {'pointer': pointer, 'offset': offset, 'length': len(block)}
+        blocks.append(block)
+        offset += len(block)
+
+    index_bytes = json.dumps(index).encode()
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_INDEX_LENGTH.pack(len(index_bytes)))
+        f.write(index_bytes)
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp_path, path)
+    return list(index)
+
+
+def read_snapshot(path=None, names=None):
+    """
+    Returns {name: (payload, pointer)} for the datasets of the snapshot file (all of them, or
+    only those in names). Returns {} when the file is missing or unreadable.
+    """
+    path = str(path or settings.CACHE_SNAPSHOT_PATH)
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                logger.warning("Ignoring cache snapshot %s: unknown format.", path)
+                return {}
+            index_start = len(MAGIC) + _INDEX_LENGTH.size
+            (index_length,) = _INDEX_LENGTH.unpack_from(mm, len(MAGIC))
+            index = json.loads(mm[index_start:index_start + index_length])
+            blocks_start = index_start + index_length
+
+            datasets = {}
+            for name, entry in index.items():
+                if names is not None and name not in names:
+                    continue
+                start = blocks_start + entry['offset']
+                payload = pickle.loads(zlib.decompress(mm[start:start + entry['length']]))
+                datasets[name] = (payload, entry['pointer'])
+            return datasets
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, zlib.error, pickle.UnpicklingError) as e:
+        logger.warning("Ignoring unreadable cache snapshot %s: %s", path, e)
+        return {}
+
+
+def load_snapshot(path=None):
+    """
+    Publishes the datasets of the snapshot that are missing from the shared cache, or older in
+    the cache than in the snapshot. Returns the names of the datasets restored.
+    """
+    restored = []
+    for name, (payload, pointer) in read_snapshot(path, names=set(DATASETS)).items():
+        current_pointer = snipeit_cache.get_dataset_pointer(name)
+        if current_pointer is not None and current_pointer['refreshed_at'] >= pointer['refreshed_at']:
+            continue
+        snipeit_cache.publish_dataset(name, payload, refreshed_at=pointer['refreshed_at'])
+        restored.append(name)
+    return restored
+
+
+def warm_up(force=False, snapshot=True):
+    """
+    Refreshes the datasets that are stale (all of them with force=True) and writes a new snapshot.
+    Returns {name: 'ok' | error message}. Returns {} when another worker is already warming up.
+    """
+    if not cache.add(WARMUP_LOCK_KEY, os.getpid(), timeout=WARMUP_LOCK_TIMEOUT):
+        return {}
+    results = {}
+    outcomes = {}
+    try:
+        for name, refresh in DATASETS.items():
+            if refresh not in outcomes:
+                names = [other for other, other_refresh in DATASETS.items() if other_refresh is refresh]
+                max_age = 0 if force else min(settings.SNIPEIT_CACHE_TIMEOUTS[other] for other in names)
+                try:
+                    refresh(max_age)
+                    outcomes[refresh] = 'ok'
+                except (requests.exceptions.RequestException, DatabaseError) as e:
+                    logger.warning("Cache warm-up of %s failed: %s", ', '.join(names), e)
+                    outcomes[refresh] = str(e)
+            results[name] = outcomes[refresh]
+        search_index.update_from_cached_datasets()
+        if snapshot:
+            try:
+                write_snapshot()
+            except OSError as e:
+                logger.warning("Could not write the cache snapshot: %s", e)
+    finally:
+        cache.delete(WARMUP_LOCK_KEY)
+    return results
+
+
+def start_background_warmup():
+    """Restores the snapshot now, then revalidates the datasets in a background thread."""
+    try:
+        restored = load_snapshot()
+    except Exception:
+        # Never prevent a worker from starting; the background refresh fills the cache anyway
+        logger.exception("Could not restore the cache snapshot.")
+        restored = []
+    if restored:
+        logger.info("Restored cached datasets from snapshot: %s", ', '.join(restored))
+    threading.Thread(target=scheduler.background_job(warm_up), name='cache-warmup', daemon=True).start()